@@ -0,0 +1,48 @@
+'''Benchmark of all_circuits with and without the fragment cache.
+
+Run from the repository root with:  python -m benchmarks.bench_all_circuits
+'''
+import time
+
+from qiskit import QuantumProgram
+
+import tools.Experiment_tools as exptool
+
+# Coupling maps of the devices queried in Constructing_circuits.ipynb
+COUPLING_MAPS = {'ibmqx2': (5, [[0, 1], [0, 2], [1, 2], [3, 2], [3, 4], [4, 2]]),
+                 'ibmqx4': (5, [[1, 0], [2, 0], [2, 1], [3, 2], [3, 4], [2, 4]]),
+                 'ibmqx5': (16, [[1, 0], [1, 2], [2, 3], [3, 4], [3, 14], [5, 4], [6, 5], [6, 7],
+                                 [6, 11], [7, 10], [8, 7], [9, 8], [9, 10], [11, 10], [12, 5],
+                                 [12, 11], [12, 13], [13, 4], [13, 14], [15, 0], [15, 2], [15, 14]])}
+
+
+def build_suite(n_qubits, coupling_map):
+    qprogram = QuantumProgram()
+    qprogram.create_quantum_register('q', n_qubits)
+    qprogram.create_classical_register('c', n_qubits)
+    return exptool.all_circuits(qprogram, coupling_map)
+
+def time_builds(repeat, clear_cache):
+    timings = {}
+    for backend, (n_qubits, coupling_map) in COUPLING_MAPS.items():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            if clear_cache:
+                exptool.clear_fragment_cache()
+            build_suite(n_qubits, coupling_map)
+        timings[backend] = (time.perf_counter() - start)/repeat
+    return timings
+
+def main(repeat=10):
+    cold = time_builds(repeat, clear_cache=True)
+    exptool.clear_fragment_cache()
+    time_builds(1, clear_cache=False)
+    warm = time_builds(repeat, clear_cache=False)
+    print('{:8} {:>12} {:>12} {:>8}'.format('backend', 'cold (ms)', 'cached (ms)', 'speedup'))
+    for backend in COUPLING_MAPS:
+        print('{:8} {:12.2f} {:12.2f} {:8.1f}'.format(backend, 1e3*cold[backend], 1e3*warm[backend],
+                                                       cold[backend]/warm[backend]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+'''Benchmark of the import times of the tools and of the rendering of the full figure set.
+
+The import of every tools module is timed in a fresh interpreter, which also reports whether
+qiskit, matplotlib and scipy got loaded. The figures (averaged plot, the six averaged diffs and
+the calibration plot) are rendered from a synthetic Processed_data folder, first one plot
+function after the other as in the notebook, then with render_all_figures on one and on
+--workers processes. No qiskit is needed. The results are saved as JSON, as in bench_pipeline.
+
+Run from the repository root with:  python -m benchmarks.bench_figures --runs 50 --workers 4
+'''
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.bench_pipeline import PAIRS, synthetic_calibration, run_stage, git_commit, compare_reports
+
+MODULES = ['tools.Analysis_tools', 'tools.Experiment_tools', 'tools.Ploting_tools', 'tools.Noise_tools']
+HEAVY_MODULES = ['qiskit', 'matplotlib', 'scipy']
+
+IMPORT_SCRIPT = '''import json, sys, time
+start = time.perf_counter()
+import {}
+print(json.dumps([time.perf_counter() - start, [m for m in {} if m in sys.modules]]))
+'''
+
+
+def import_times(repeat=5):
+    '''import_times(repeat=5)
+    Best time of repeat fresh imports of every module of MODULES and the heavy modules it loads.
+    '''
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    times = {}
+    for module in MODULES:
+        runs = []
+        for _ in range(repeat):
+            output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT.format(module, HEAVY_MODULES)],
+                                    capture_output=True, text=True, cwd=root)
+            if output.returncode != 0:
+                runs = None
+                times[module] = {'error': output.stderr.strip().splitlines()[-1]}
+                break
+            runs.append(json.loads(output.stdout))
+        if runs:
+            times[module] = {'seconds': min(r[0] for r in runs), 'loaded': runs[0][1]}
+        print('{:32} {}'.format(module, times[module]))
+    return times
+
+def write_synthetic_processed(n_runs, shots, n_calibrations, noise, seed):
+    '''write_synthetic_processed(n_runs, shots, n_calibrations, noise, seed)
+    Writes n_runs processed entries per circuit into data/Processed_data/ of the working directory,
+    their decoded counts drawn around the expected distributions, with n_calibrations calibrations.
+    '''
+    import tools.Experiment_tools as exptool
+    import tools.Storage_tools as storetool
+    rng = np.random.default_rng(seed)
+    calibrations = [synthetic_calibration(rng, '2017-10-{:02d}T10:00:00.000Z'.format(1 + k % 28))
+                    for k in range(n_calibrations)]
+    circuits = []
+    for gates, state, expected in exptool.CIRCUITS:
+        circuit_string = '-'.join(reversed(gates)) + state
+        circuits.extend(('bM' + circuit_string + str(pair), 'bare', expected, 10 + 3*len(gates)) for pair in PAIRS)
+        versions = exptool.ENCODED_VERSION_LIST if state == '|00>' else ['']
+        circuits.extend(('eM' + circuit_string + v, 'encoded', expected, 20 + 6*len(gates)) for v in versions)
+    entries = []
+    for k in range(n_runs):
+        for name, version, expected, qasm_count in circuits:
+            error_rate = noise*(3 if version == 'bare' else 1)
+            probabilities = np.append((1 - error_rate)*((1 - noise)*np.asarray(expected) + noise/4), error_rate)
+            counts = rng.multinomial(shots, probabilities)
+            total_valid = int(counts[:4].sum())
+            distribution = counts[:4]/total_valid
+            entries.append({'name': name,
+                            'version': version,
+                            'counts': dict(zip(storetool.COUNT_KEYS, [int(c) for c in counts] + [total_valid])),
+                            'qasm_count': qasm_count,
+                            'expected_distribution_array': list(expected),
+                            'experimental_distribution_array': distribution.tolist(),
+                            'post_selection_ratio': total_valid/shots,
+                            'stat_dist': float(.5*np.abs(distribution - expected).sum()),
+                            'calibration': calibrations[k % n_calibrations]})
+    exptool.write_processed_entries(entries)
+    return len(entries)
+
+def render_sequentially():
+    import tools.Ploting_tools as plottool
+    import tools.Analysis_tools as anatool
+    anatool._AGGREGATE_CACHE.clear()
+    plottool.plot_everything_averaged('data/Processed_data/', save_data_folder_pref='data/Plot_data/')
+    for bareindex in range(0, 6):
+        plottool.plot_everything_averaged_diff('data/Processed_data/', bareindex=bareindex,
+                                               save_data_folder_pref='data/Plot_data/')
+    plottool.save_everything_calib_data_avg('data/Processed_data/', 'data/Table_data/')
+
+def render_batch(n_workers):
+    import tools.Ploting_tools as plottool
+    import tools.Analysis_tools as anatool
+    anatool._AGGREGATE_CACHE.clear()
+    return plottool.render_all_figures('data/Processed_data/', 'data/Figures/', 'pdf', n_workers=n_workers,
+                                       save_data_folder_pref='data/Plot_data/')
+
+def run_benchmark(n_runs=20, shots=8192, n_calibrations=10, noise=.05, n_workers=4, seed=0):
+    '''run_benchmark(n_runs=20, shots=8192, n_calibrations=10, noise=.05, n_workers=4, seed=0)
+    Times the imports, then the rendering of the full figure set in a temporary working directory.
+    Returns the report dictionary.
+    '''
+    results = {}
+    imports = import_times()
+    import matplotlib
+    matplotlib.use('Agg')
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp()
+    try:
+        os.chdir(workdir)
+        for sub in ['Processed_data', 'Plot_data', 'Table_data', 'Figures']:
+            os.makedirs(os.path.join('data', sub))
+        n_entries = run_stage(results, 'write_synthetic_processed', 0, write_synthetic_processed,
+                              n_runs, shots, n_calibrations, noise, seed)
+        results['write_synthetic_processed']['items'] = n_entries
+        run_stage(results, 'plot_functions_sequential', 8, render_sequentially)
+        run_stage(results, 'render_all_figures_1', 8, render_batch, 1)
+        run_stage(results, 'render_all_figures_{}'.format(n_workers), 8, render_batch, n_workers)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {'date': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime()),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'matplotlib': matplotlib.__version__,
+            'config': {'n_runs': n_runs, 'shots': shots, 'n_calibrations': n_calibrations, 'noise': noise,
+                       'n_workers': n_workers, 'seed': seed},
+            'imports': imports,
+            'stages': results}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the imports and of the figure rendering.')
+    parser.add_argument('--runs', type=int, default=20, help='processed runs of every circuit')
+    parser.add_argument('--shots', type=int, default=8192)
+    parser.add_argument('--calibrations', type=int, default=10, help='distinct calibrations')
+    parser.add_argument('--noise', type=float, default=.05)
+    parser.add_argument('--workers', type=int, default=4, help='render processes of the parallel batch')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='JSON report (default benchmarks/results/figures_<date>.json)')
+    parser.add_argument('--compare', default=None, help='previous JSON report to compare with')
+    args = parser.parse_args()
+    report = run_benchmark(args.runs, args.shots, args.calibrations, args.noise, args.workers, args.seed)
+    output = args.output
+    if output is None:
+        folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+        os.makedirs(folder, exist_ok=True)
+        output = os.path.join(folder, 'figures_' + time.strftime('%Y%m%d-%H%M%S') + '.json')
+    with open(output, 'w') as report_file:
+        json.dump(report, report_file, indent=1)
+    print('Report written to', output)
+    if args.compare:
+        with open(args.compare, 'r') as old_file:
+            old = json.load(old_file)
+        compare_reports(old, report)
+        for module, record in report['imports'].items():
+            if 'seconds' in record and 'seconds' in old.get('imports', {}).get(module, {}):
+                print('{:32} import time ratio {:.2f}'.format(module, record['seconds']/old['imports'][module]['seconds']))
+
+
+if __name__ == '__main__':
+    main()
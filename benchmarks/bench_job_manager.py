@@ -0,0 +1,106 @@
+'''Load test of the asyncio JobManager against a local stand-in of the API.
+
+Run from the repository root with:  python -m benchmarks.bench_job_manager
+'''
+import os
+import random
+import tempfile
+import threading
+import time
+
+from qiskit import QuantumProgram
+
+import tools.Experiment_tools as exptool
+import tools.Job_tools as jobtool
+import tools.Manifest_tools as manifesttool
+import tools.Simulation_tools as simtool
+
+
+class LocalApiServer:
+    '''Stand-in of the blocking QISKit API: run_job and get_job answer after latency seconds, a
+    job runs for a random duration up to max_run_time seconds and its results are simulated by
+    the stabilizer simulator (once per distinct circuit and number of shots) and returned without
+    the 'OPENQASM 2.0;' prefix of their qasm, as the API does. A fraction failure_rate of the get_job calls raise ConnectionError.
+    '''
+    def __init__(self, latency=.05, max_run_time=1., failure_rate=0., seed=None):
+        self.latency = latency
+        self.max_run_time = max_run_time
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.jobs = {}
+        self.n_calls = 0
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def run_job(self, qasms, backend, shots=1, max_credits=3):
+        time.sleep(self.latency)
+        with self._lock:
+            self.n_calls += 1
+            job_id = 'local{:06d}'.format(len(self.jobs))
+            self.jobs[job_id] = (time.monotonic() + self.random.uniform(0, self.max_run_time), qasms, shots)
+        return {'id': job_id, 'status': 'RUNNING'}
+
+    def get_job(self, job_id):
+        time.sleep(self.latency)
+        with self._lock:
+            self.n_calls += 1
+            if self.random.random() < self.failure_rate:
+                raise ConnectionError('stand-in connection failure')
+            done_at, qasms, shots = self.jobs[job_id]
+        if time.monotonic() < done_at:
+            return {'id': job_id, 'status': 'RUNNING'}
+        date = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+        return {'id': job_id, 'status': 'COMPLETED', 'calibration': None,
+                'qasms': [{'qasm': qasm['qasm'][len('OPENQASM 2.0;'):], 'data': {'counts': self.counts(qasm['qasm'], shots), 'date': date}}
+                          for qasm in qasms]}
+
+    def counts(self, qasm, shots):
+        with self._lock:
+            if not (qasm, shots) in self._counts:
+                self._counts[(qasm, shots)] = simtool.sample_counts(qasm, shots)
+            return self._counts[(qasm, shots)]
+
+
+def compiled_batches(batch_size=50, shots=8192):
+    qprogram = QuantumProgram()
+    qprogram.create_quantum_register('q', 5)
+    qprogram.create_classical_register('c', 5)
+    names = exptool.all_circuits(qprogram, [[1, 0], [2, 0], [2, 1], [3, 2], [3, 4], [2, 4]])
+    return [{'config': {'backend': 'local_stand_in', 'shots': shots, 'max_credits': 5},
+             'circuits': [{'name': name, 'compiled_circuit_qasm': qprogram.get_qasm(name)}
+                          for name in names[j:j+batch_size]]}
+            for j in range(0, len(names), batch_size)]
+
+def sequential_polling(server, job_ids, poll_interval):
+    # What run_batch_async then fetch_previous amount to: one blocking API call at a time
+    pending = list(job_ids)
+    while pending:
+        pending = [job_id for job_id in pending if server.get_job(job_id)['status'] != 'COMPLETED']
+        if pending:
+            time.sleep(poll_interval)
+
+def main(n_copies=8, latency=.2, max_run_time=2., failure_rate=.05, max_concurrent=16):
+    batches = compiled_batches()
+    batches = [dict(batch, config=dict(batch['config'], shots=1024 + k)) for k in range(n_copies) for batch in batches]
+    with tempfile.TemporaryDirectory() as folder:
+        server = LocalApiServer(latency, max_run_time, failure_rate=0., seed=1)
+        start = time.perf_counter()
+        job_ids = [server.run_job(jobtool.batch_qasms(b), 'local_stand_in', b['config']['shots'])['id'] for b in batches]
+        sequential_polling(server, job_ids, poll_interval=.2)
+        sequential = time.perf_counter() - start
+
+        server = LocalApiServer(latency, max_run_time, failure_rate, seed=1)
+        manifest = manifesttool.open_manifest(os.path.join(folder, 'manifest.sqlite'))
+        start = time.perf_counter()
+        statuses = jobtool.run_batches(server, manifest, batches, dump_folder=folder, max_concurrent=max_concurrent,
+                                       poll_interval=.2, max_poll_interval=1., log_filename=None)
+        concurrent = time.perf_counter() - start
+        n_dumps = len([f for f in os.listdir(folder) if f.startswith('api_dump_')])
+    print('{} jobs, {} s latency per call, {} failed calls'.format(len(batches), latency, failure_rate))
+    print('sequential calls: {:.2f} s'.format(sequential))
+    print('JobManager:       {:.2f} s, {} API calls, {} dumps, statuses {}'.format(
+        concurrent, server.n_calls, n_dumps, sorted(set(statuses.values()))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+'''Benchmark of the ingest, analysis and plotting pipeline on synthetic data.
+
+Generates synthetic API dumps for the circuits of all_circuits (counts drawn around the ideal
+distributions of the stabilizer simulator, calibrations shaped like the ones of the API), then
+times every stage of the pipeline on them. Every stage reports its wall and CPU times, the number
+of items it handled, its throughput and its peak Python memory (tracemalloc). The results are
+saved as JSON so that two versions can be compared with --compare.
+
+Run from the repository root with:  python -m benchmarks.bench_pipeline --runs 20 --shots 8192
+'''
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import tools.Experiment_tools as exptool
+import tools.Simulation_tools as simtool
+import tools.Dump_tools as dumptool
+import tools.Analysis_tools as anatool
+
+PAIRS = [[1, 0], [2, 0], [2, 1], [2, 4], [3, 2], [3, 4]]
+CX_PAIRS = [[1, 0], [2, 0], [2, 1], [3, 2], [3, 4], [2, 4]]
+
+
+# Synthetic data
+################
+def synthetic_calibration(rng, date):
+    '''synthetic_calibration(rng, date)
+    Calibration dictionary with the fields and units of the ibmqx4 calibrations of the API.
+    '''
+    qubits = []
+    for q in range(5):
+        qubits.append({'name': 'Q' + str(q),
+                       'buffer': {'value': 10, 'unit': 'ns'},
+                       'gateTime': {'value': 50, 'unit': 'ns'},
+                       'frequency': {'value': float(rng.uniform(5.0, 5.5)), 'unit': 'GHz'},
+                       'T1': {'value': float(rng.uniform(30, 60)), 'unit': 'µs', 'date': date},
+                       'T2': {'value': float(rng.uniform(15, 50)), 'unit': 'µs', 'date': date},
+                       'gateError': {'value': float(rng.uniform(5e-4, 2e-3)), 'date': date},
+                       'readoutError': {'value': float(rng.uniform(.02, .08)), 'date': date}})
+    return {'lastUpdateDate': date,
+            'backend': 'ibmqx4',
+            'qubits': qubits,
+            'multiQubitGates': [{'qubits': pair, 'type': 'CX', 'name': 'CX{}_{}'.format(*pair),
+                                 'gateError': {'value': float(rng.uniform(.015, .05)), 'date': date}}
+                                for pair in CX_PAIRS],
+            'fridgeParameters': {'cooldownDate': '2017-09-07',
+                                 'Temperature': {'value': float(rng.uniform(.015, .025)), 'unit': 'K', 'date': date}}}
+
+def outcome_distribution(qasm, noise):
+    '''outcome_distribution(qasm, noise)
+    32 entries distribution of the ideal outcomes of qasm mixed with a fraction noise of uniform outcomes.
+    '''
+    n_qubits, n_clbits, ops, measurements = simtool.parse_qasm(qasm)
+    x0, basis = simtool.StabilizerTableau(n_qubits).apply(ops).measurement_affine_space()
+    words = np.full(2**len(basis), x0, dtype=np.uint64)
+    for k, vector in enumerate(basis):
+        words[(np.arange(len(words)) >> k) & 1 == 1] ^= np.uint64(vector)
+    ideal = np.bincount(simtool.words_to_clbits(words, measurements), minlength=32)/len(words)
+    return (1 - noise)*ideal + noise/32
+
+def generate_dumps(folder, n_runs, circuits_per_job, shots, n_calibrations, noise, seed):
+    '''generate_dumps(folder, n_runs, circuits_per_job, shots, n_calibrations, noise, seed)
+    Writes the dumps of jobs running every circuit n_runs times (shuffled, circuits_per_job per
+    job) into folder. Returns the job ids and the dictionary qasm -> circuit names.
+    '''
+    from qiskit import QuantumProgram
+    rng = np.random.default_rng(seed)
+    qprogram = QuantumProgram()
+    qprogram.create_quantum_register('q', 5)
+    qprogram.create_classical_register('c', 5)
+    names = exptool.all_circuits(qprogram, PAIRS)
+    qasms = {name: qprogram.get_qasm(name) for name in names}
+    distributions = {name: outcome_distribution(qasms[name], noise) for name in names}
+    calibrations = [synthetic_calibration(rng, '2017-10-{:02d}T10:00:00.000Z'.format(1 + k % 28))
+                    for k in range(n_calibrations)]
+    runs = [name for name in names for _ in range(n_runs)]
+    random.Random(seed).shuffle(runs)
+    job_ids = []
+    for k in range(0, len(runs), circuits_per_job):
+        job_id = 'bench{:06d}'.format(len(job_ids))
+        results = []
+        for name in runs[k:k+circuits_per_job]:
+            histogram = rng.multinomial(shots, distributions[name])
+            results.append({'qasm': qasms[name][len('OPENQASM 2.0;'):],
+                            'data': {'counts': {format(o, '05b'): int(c) for o, c in enumerate(histogram) if c > 0},
+                                     'date': '2017-10-01T10:00:00.000Z'}})
+        dumptool.write_dump(os.path.join(folder, 'api_dump_' + job_id + '.jsonl'),
+                            {'id': job_id, 'status': 'COMPLETED',
+                             'calibration': calibrations[len(job_ids) % n_calibrations], 'qasms': results})
+        job_ids.append(job_id)
+    dict_qasm_name = {}
+    for name in names:
+        dict_qasm_name.setdefault(qasms[name], []).append(name)
+    return job_ids, dict_qasm_name
+
+
+# Timing of the stages
+######################
+def run_stage(results, stage, items, function, *args, **kwargs):
+    '''run_stage(results, stage, items, function, *args, **kwargs)
+    Runs function(*args, **kwargs) and records its wall and CPU times, throughput (items per second)
+    and peak traced memory in results[stage]. A failing stage records its error instead.
+    '''
+    tracemalloc.start()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    record = {'items': items}
+    try:
+        output = function(*args, **kwargs)
+    except Exception as stage_err:
+        output = None
+        record['error'] = repr(stage_err)
+    record['wall_s'] = time.perf_counter() - wall
+    record['cpu_s'] = time.process_time() - cpu
+    record['peak_memory_kib'] = tracemalloc.get_traced_memory()[1]/1024
+    tracemalloc.stop()
+    record['items_per_s'] = items/record['wall_s'] if record['wall_s'] > 0 else None
+    results[stage] = record
+    print('{:32} {:10.3f} s {:10.3f} s cpu {:12.1f} items/s {:10.0f} KiB{}'.format(
+        stage, record['wall_s'], record['cpu_s'], record['items_per_s'] or 0, record['peak_memory_kib'],
+        '  ' + record['error'] if 'error' in record else ''))
+    return output
+
+def decode_all(job_ids, dict_qasm_name):
+    n_results = 0
+    for job_id in job_ids:
+        job_result = dumptool.read_dump(dumptool.dump_filename(job_id))
+        for res in job_result['qasms']:
+            for name in dict_qasm_name['OPENQASM 2.0;' + res['qasm']]:
+                exptool.api_data_to_dict(res, name)
+                n_results += 1
+    return n_results
+
+def plot_stage(function, *args, **kwargs):
+    import matplotlib.pyplot as plt
+    function(*args, **kwargs)
+    plt.close('all')
+
+def run_benchmark(n_runs=10, circuits_per_job=50, shots=8192, n_calibrations=10, noise=.05,
+                  n_workers=1, seed=0, plots=True):
+    '''run_benchmark(n_runs=10, circuits_per_job=50, shots=8192, n_calibrations=10, noise=.05, n_workers=1, seed=0, plots=True)
+    Generates the synthetic data in a temporary working directory and times every stage.
+    Returns the report dictionary.
+    '''
+    # Plots are rendered off screen, the backend has to be chosen before pyplot is imported
+    import matplotlib
+    matplotlib.use('Agg')
+    import tools.Ploting_tools as plottool
+    results = {}
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp()
+    try:
+        os.chdir(workdir)
+        for sub in ['API_dumps', 'Processed_data', 'Plot_data', 'Table_data']:
+            os.makedirs(os.path.join('data', sub))
+        generated = run_stage(results, 'generate_dumps', 0, generate_dumps, 'data/API_dumps/', n_runs,
+                              circuits_per_job, shots, n_calibrations, noise, seed)
+        if generated is None:
+            raise RuntimeError('Generation of the synthetic dumps failed: ' + results['generate_dumps']['error'])
+        job_ids, dict_qasm_name = generated
+        n_results = sum(len(names) for names in dict_qasm_name.values())*n_runs
+        results['generate_dumps']['items'] = len(job_ids)
+        with open('data/to_process.txt', 'w') as ids_file:
+            ids_file.write(''.join(job_id + '\n' for job_id in job_ids))
+        run_stage(results, 'api_data_to_dict', n_results, decode_all, job_ids, dict_qasm_name)
+        run_stage(results, 'process_all_api_dumps', n_results, exptool.process_all_api_dumps,
+                  'data/to_process.txt', 'data/already_processed.txt', dict_qasm_name, n_workers=n_workers)
+        run_stage(results, 'process_all_api_dumps_store', n_results, exptool.process_all_api_dumps,
+                  'data/to_process.txt', None, dict_qasm_name, store_folder='data/Processed_store/', n_workers=n_workers)
+        run_stage(results, 'aggregate_processed_data', n_results, anatool.aggregate_processed_data, 'data/Processed_data/')
+        run_stage(results, 'aggregate_store', n_results, anatool.aggregate_processed_data, 'data/Processed_store/')
+        if plots:
+            run_stage(results, 'plot_everything_averaged', n_results, plot_stage, plottool.plot_everything_averaged,
+                      'data/Processed_data/', save_data_folder_pref='data/Plot_data/')
+            run_stage(results, 'plot_everything_averaged_diff', n_results, plot_stage, plottool.plot_everything_averaged_diff,
+                      'data/Processed_data/', save_data_folder_pref='data/Plot_data/')
+        run_stage(results, 'save_everything_calib_data_avg', n_calibrations, plottool.save_everything_calib_data_avg,
+                  'data/Processed_data/', 'data/Table_data/')
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {'date': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime()),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'config': {'n_runs': n_runs, 'circuits_per_job': circuits_per_job, 'shots': shots,
+                       'n_calibrations': n_calibrations, 'noise': noise, 'n_workers': n_workers, 'seed': seed},
+            'stages': results}
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare_reports(old, new):
+    '''compare_reports(old, new)
+    Prints the ratio new/old of the wall times and peak memories of the stages of two reports.
+    '''
+    print('{:32} {:>12} {:>12}'.format('stage', 'time ratio', 'memory ratio'))
+    for stage, record in new['stages'].items():
+        if stage in old['stages'] and old['stages'][stage]['wall_s'] > 0 and old['stages'][stage]['peak_memory_kib'] > 0:
+            print('{:32} {:12.2f} {:12.2f}'.format(stage, record['wall_s']/old['stages'][stage]['wall_s'],
+                                                   record['peak_memory_kib']/old['stages'][stage]['peak_memory_kib']))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the pipeline on synthetic data.')
+    parser.add_argument('--runs', type=int, default=10, help='runs of every circuit')
+    parser.add_argument('--circuits-per-job', type=int, default=50)
+    parser.add_argument('--shots', type=int, default=8192)
+    parser.add_argument('--calibrations', type=int, default=10, help='distinct calibrations')
+    parser.add_argument('--noise', type=float, default=.05, help='fraction of uniformly random outcomes')
+    parser.add_argument('--workers', type=int, default=1, help='n_workers of process_all_api_dumps')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-plots', action='store_true')
+    parser.add_argument('--output', default=None, help='JSON report (default benchmarks/results/pipeline_<date>.json)')
+    parser.add_argument('--compare', default=None, help='previous JSON report to compare with')
+    args = parser.parse_args()
+    report = run_benchmark(args.runs, args.circuits_per_job, args.shots, args.calibrations, args.noise,
+                           args.workers, args.seed, not args.no_plots)
+    output = args.output
+    if output is None:
+        folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+        os.makedirs(folder, exist_ok=True)
+        output = os.path.join(folder, 'pipeline_' + time.strftime('%Y%m%d-%H%M%S') + '.json')
+    with open(output, 'w') as report_file:
+        json.dump(report, report_file, indent=1)
+    print('Report written to', output)
+    if args.compare:
+        with open(args.compare, 'r') as old_file:
+            compare_reports(json.load(old_file), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+'''Check of the exact density matrix predictions against the Pauli-frame sampling.
+
+Builds a few CIRCUITS entries with all_circuits on two pairs of ibmqx4, draws synthetic
+calibrations as bench_pipeline does and compares Density_tools.predict_distributions with the
+runs of Noise_tools.predict_runs (Density_tools.compare_with_sampling). The check is done on the
+calibrations without idle noise, where the two engines model the same noise and must agree
+within shot noise; with the T1/T2 noise the differences (the sampling twirls the damping) are
+only printed. Exits with status 1 when a circuit disagrees.
+
+Run from the repository root with:  python -m benchmarks.check_density_sampling --runs 20
+'''
+import argparse
+import sys
+
+import numpy as np
+
+import tools.Experiment_tools as exptool
+import tools.Density_tools as denstool
+from benchmarks.bench_pipeline import PAIRS, synthetic_calibration
+
+# Empty, single gate, HHS and CZ sequences on the three input states
+CHECKED_CIRCUITS = [exptool.CIRCUITS[k] for k in [0, 1, 4, 5, 8, 13, 17, 18, 19]]
+
+
+def build_circuits(pairs):
+    from qiskit import QuantumProgram
+    qprogram = QuantumProgram()
+    qprogram.create_quantum_register('q', 5)
+    qprogram.create_classical_register('c', 5)
+    names = exptool.all_circuits(qprogram, pairs, circuits=CHECKED_CIRCUITS)
+    return qprogram, names
+
+def print_comparison(comparison):
+    print('{:40} {:>10} {:>10} {:>10} {:>9}'.format('circuit', 'stat_dist', 'sampled', 'tolerance', 'max sigma'))
+    for name, values in comparison.items():
+        print('{:40} {:10.5f} {:10.5f} {:10.5f} {:9.2f}{}'.format(
+            name, values['stat_dist'], values['sampled_stat_dist'], values['tolerance'], values['max_sigma'],
+            '' if values['agrees'] else '  DISAGREES'))
+
+def main():
+    parser = argparse.ArgumentParser(description='Density matrix predictions against the Pauli-frame sampling.')
+    parser.add_argument('--runs', type=int, default=20, help='sampled runs of every circuit')
+    parser.add_argument('--shots', type=int, default=8192)
+    parser.add_argument('--calibrations', type=int, default=2, help='synthetic calibrations checked')
+    parser.add_argument('--sigma', type=float, default=5., help='tolerance in binomial standard deviations')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    qprogram, names = build_circuits(PAIRS[:2])
+    rng = np.random.default_rng(args.seed)
+    n_failed = 0
+    for k in range(args.calibrations):
+        calibration = synthetic_calibration(rng, '2017-10-{:02d}T10:00:00.000Z'.format(1 + k))
+        print('Calibration', k, 'without idle noise')
+        comparison = denstool.compare_with_sampling(qprogram, names, denstool.without_idle_noise(calibration),
+                                                    args.runs, args.shots, args.sigma, seed=args.seed + k)
+        print_comparison(comparison)
+        n_failed += sum(1 for values in comparison.values() if not values['agrees'])
+        print('Calibration', k, 'with idle noise (not checked)')
+        print_comparison(denstool.compare_with_sampling(qprogram, names, calibration, args.runs, args.shots,
+                                                        args.sigma, seed=args.seed + k))
+    print(n_failed, 'disagreements out of', args.calibrations*len(names), 'checked circuits')
+    if n_failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
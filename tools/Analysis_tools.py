@@ -0,0 +1,368 @@
+import ast
+import concurrent.futures
+import os
+import re
+import statistics
+import numpy as np
+
+from tools.Experiment_tools import PLOT_LABELS, circuit_record
+import tools.Storage_tools as storetool
+import tools.Calibration_tools as calibtool
+import tools.Profiling_tools as proftool
+
+# Patterns of the file names of every label of PLOT_LABELS (label_index uses the circuit registry)
+RE_LABELS = [re.compile('[\\S]*\\[1, 0\\].txt'),
+             re.compile('[\\S]*\\[2, 0\\].txt'),
+             re.compile('[\\S]*\\[2, 1\\].txt'),
+             re.compile('[\\S]*\\[2, 4\\].txt'),
+             re.compile('[\\S]*\\[3, 2\\].txt'),
+             re.compile('[\\S]*\\[3, 4\\].txt'),
+             re.compile('[\\S]*>ftv1.txt'),
+             re.compile('[\\S]*>ftv2.txt'),
+             re.compile('[\\S]*nftv1.txt'),
+             re.compile('e[\\S]*\\|0\\+>.txt'),
+             re.compile('e[\\S]*\\|00>\\+\\|11>.txt')]
+
+
+# Loading the processed data
+############################
+def load_processed_data(folder, fields):
+    '''load_processed_data(folder, fields)
+    Reads the given fields for every circuit of folder, which is either a text Processed_data
+    folder or a columnar store. Returns the list of (circuit_filename, {field: values}) and the
+    numbers of skipped and kept experiments. Calibrations are resolved from the calibration table.
+    '''
+    circuits = []
+    n_skipped = 0
+    n_kept = 0
+    if storetool.is_store(folder):
+        with proftool.stage('parse_processed'):
+            data = storetool.load_store(folder)
+        for circuit_filename, rows in storetool.group_by_circuit(data):
+            values = {}
+            for field in fields:
+                if field == 'calibration':
+                    values[field] = [data['calibrations'][c] for c in data['calibration'][rows]]
+                else:
+                    values[field] = data[field][rows]
+            circuits.append((circuit_filename, values))
+            n_kept += len(rows)
+        proftool.count('parse_processed', items=n_kept)
+        return circuits, n_skipped, n_kept
+    if 'calibration' in fields:
+        calibrations = calibtool.load_calibration_table(folder)
+    for circuit_filename in os.listdir(folder):
+        values = {field: [] for field in fields}
+        with proftool.stage('parse_processed', circuit_filename):
+            with open(folder+circuit_filename, 'r') as circuit_file:
+                expe_list = circuit_file.readlines()
+            for expe_data_string in expe_list:
+                try:
+                    expe_data = ast.literal_eval(expe_data_string)
+                    for field in fields:
+                        values[field].append(expe_data[field])
+                    if 'calibration' in fields:
+                        values['calibration'][-1] = calibtool.resolve_calibration(values['calibration'][-1], calibrations)
+                    n_kept += 1
+                except SyntaxError:
+                    n_skipped += 1
+        proftool.count('parse_processed', items=len(expe_list), bytes_read=sum(map(len, expe_list)),
+                       circuit=circuit_filename)
+        circuits.append((circuit_filename, values))
+    return circuits, n_skipped, n_kept
+
+# Calibration parameters
+########################
+UNIT_FACTORS = {'s': 1., 'ms': 1e-3, 'us': 1e-6, '\u00b5s': 1e-6, '\u03bcs': 1e-6, 'ns': 1e-9,
+                'Hz': 1., 'kHz': 1e3, 'MHz': 1e6, 'GHz': 1e9}
+
+def convert_parameter(param):
+    '''convert_parameter(param)
+    Value in SI units of a calibration parameter {'value': v, 'unit': u, ...} (or of a bare number).
+    '''
+    if isinstance(param, dict):
+        return float(param['value'])*UNIT_FACTORS.get(param.get('unit'), 1.)
+    return float(param)
+
+def label_index(circuit_filename):
+    '''label_index(circuit_filename)
+    Index in PLOT_LABELS of the label a processed data file belongs to, None if it has none.
+    '''
+    try:
+        return circuit_record(circuit_filename).label_index
+    except ValueError:
+        return None
+
+def circuit_index(circuit_filename):
+    '''circuit_index(circuit_filename)
+    Position (starting at 1) in CIRCUIT_NAMES of the circuit a processed data file belongs to.
+    '''
+    try:
+        return circuit_record(circuit_filename).circuit_index
+    except ValueError:
+        return None
+
+
+# Bootstrap confidence intervals
+################################
+# The stat_dist of a run is biased and far from Gaussian at small values, so as an alternative
+# to the Student-t interval over the runs, the average stat_dist of a circuit is bootstrapped at
+# both levels: the runs are resampled with replacement and the valid shots of every drawn run are
+# resampled (multinomial) from its decoded counts. The resamples of a circuit are drawn together
+# as (n_resamples, n_runs, 4) arrays, by chunks spread over processes.
+
+BOOTSTRAP_CHUNK = 2000
+
+def count_rows(counts):
+    '''count_rows(counts)
+    (n_runs, 6) array of the decoded counts of a circuit, from the store column or from the
+    list of counts dictionaries of the text files.
+    '''
+    if len(counts) > 0 and isinstance(counts[0], dict):
+        return np.array([[c[key] for key in storetool.COUNT_KEYS] for c in counts], dtype=np.int64)
+    return np.asarray(counts, dtype=np.int64).reshape(-1, len(storetool.COUNT_KEYS))
+
+def bootstrap_means(counts, expected, n_resamples, rng):
+    '''bootstrap_means(counts, expected, n_resamples, rng)
+    n_resamples bootstrap replicates of the average stat_dist of the runs whose decoded counts
+    are counts, the expected distribution being expected. The replicates are NaN when no run has
+    valid counts.
+    '''
+    valid = counts[:, :4]
+    valid = valid[valid.sum(axis=1) > 0]
+    if len(valid) == 0:
+        return np.full(n_resamples, np.nan)
+    totals = valid.sum(axis=1)
+    distributions = valid/totals[:, None]
+    runs = rng.integers(0, len(valid), size=(n_resamples, len(valid)))
+    resampled = rng.multinomial(totals[runs], distributions[runs])
+    stat_dists = .5*np.abs(resampled/totals[runs, None] - np.asarray(expected)).sum(axis=2)
+    return stat_dists.mean(axis=1)
+
+def _bootstrap_task(task):
+    counts, expected, n_resamples, seed_sequence = task
+    return bootstrap_means(counts, expected, n_resamples, np.random.default_rng(seed_sequence))
+
+
+# Shared aggregation of a processed data folder
+###############################################
+class ProcessedAggregate:
+    '''Per-label and per-circuit statistics of a processed data folder: average stat_dist,
+    its standard deviation, the number of runs, the qasm count and the post-selection ratios,
+    and when loaded the decoded counts and expected distributions used by the bootstrap.
+    Every list is indexed by the position of the label in PLOT_LABELS (12 slots); the experiments
+    of the files of no label are skipped and counted in n_skipped.
+    '''
+    @proftool.profiled('statistics')
+    def __init__(self, circuits, n_skipped, n_kept):
+        self.n_skipped = n_skipped
+        self.n_kept = n_kept
+        self.qasm_counts = [[] for j in range(0, 12)]
+        self.circuit_indices = [[] for j in range(0, 12)]
+        self.stat_dists = [[] for j in range(0, 12)]
+        self.post_select_r = [[] for j in range(0, 12)]
+        self.stdevs = [[] for j in range(0, 12)]
+        self.n_runs = [[] for j in range(0, 12)]
+        self.counts = [[] for j in range(0, 12)]
+        self.expected = [[] for j in range(0, 12)]
+        self._conf_ints = {}
+        self._bootstraps = {}
+        for circuit_filename, circuit_values in circuits:
+            index = label_index(circuit_filename)
+            if index is None:
+                # A file of no label of PLOT_LABELS, its experiments are skipped as by the plots
+                self.n_skipped += len(circuit_values['stat_dist'])
+                self.n_kept -= len(circuit_values['stat_dist'])
+                continue
+            values = np.asarray(circuit_values['stat_dist'], dtype=float)
+            self.stat_dists[index].append(float(values.mean()))
+            self.stdevs[index].append(float(values.std(ddof=1)))
+            self.n_runs[index].append(len(values))
+            self.post_select_r[index].extend(float(r) for r in circuit_values['post_selection_ratio'])
+            self.qasm_counts[index].append(int(circuit_values['qasm_count'][-1]))
+            self.circuit_indices[index].append(circuit_index(circuit_filename))
+            if 'counts' in circuit_values and 'expected_distribution_array' in circuit_values:
+                self.counts[index].append(count_rows(circuit_values['counts']))
+                self.expected[index].append(np.asarray(circuit_values['expected_distribution_array'][0], dtype=float))
+
+    @proftool.profiled('statistics')
+    def conf_ints(self, ci=.99):
+        '''conf_ints(ci=.99)
+        Half widths of the Student-t confidence intervals at level ci on the average stat_dist.
+        '''
+        if ci not in self._conf_ints:
+            from scipy.stats import t
+            self._conf_ints[ci] = [[t.interval(ci, n-1, loc=0, scale=1)[1]*sd/np.sqrt(n) for sd, n in zip(sds, ns)]
+                                   for sds, ns in zip(self.stdevs, self.n_runs)]
+        return self._conf_ints[ci]
+
+    @proftool.profiled('bootstrap')
+    def bootstrap(self, n_resamples=10000, seed=None, n_workers=1):
+        '''bootstrap(n_resamples=10000, seed=None, n_workers=1)
+        Bootstrap replicates (arrays of n_resamples) of the average stat_dist of every circuit,
+        computed on n_workers processes if > 1. Cached per (n_resamples, seed).
+        '''
+        key = (n_resamples, seed)
+        if key in self._bootstraps:
+            return self._bootstraps[key]
+        if sum(len(c) for c in self.counts) < sum(len(s) for s in self.stat_dists):
+            raise ValueError('The bootstrap needs the decoded counts and expected distributions of every circuit')
+        tasks = []
+        for counts, expected in zip(sum(self.counts, []), sum(self.expected, [])):
+            for first in range(0, n_resamples, BOOTSTRAP_CHUNK):
+                tasks.append([counts, expected, min(BOOTSTRAP_CHUNK, n_resamples - first)])
+        for task, seed_sequence in zip(tasks, np.random.SeedSequence(seed).spawn(len(tasks))):
+            task.append(seed_sequence)
+        if n_workers > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+                chunks = list(executor.map(_bootstrap_task, tasks, chunksize=max(1, len(tasks)//(4*n_workers))))
+        else:
+            chunks = [_bootstrap_task(task) for task in tasks]
+        n_chunks = -(-n_resamples//BOOTSTRAP_CHUNK)
+        replicates = [np.concatenate(chunks[k:k+n_chunks]) for k in range(0, len(chunks), n_chunks)]
+        self._bootstraps[key] = []
+        for counts in self.counts:
+            self._bootstraps[key].append(replicates[:len(counts)])
+            replicates = replicates[len(counts):]
+        return self._bootstraps[key]
+
+    def bootstrap_conf_ints(self, ci=.99, bareindex=None, n_resamples=10000, seed=None, n_workers=1):
+        '''bootstrap_conf_ints(ci=.99, bareindex=None, n_resamples=10000, seed=None, n_workers=1)
+        Basic bootstrap intervals at level ci, as the (low, high) bounds of the average stat_dist
+        of every circuit, or of stat_dists_diff(bareindex) for the encoded labels if bareindex is
+        given (the bare replicates being subtracted from the encoded ones). Resampling the shots
+        adds the upward bias of stat_dist to the replicates a second time, so their percentiles
+        q_low, q_high are reflected around the point estimate sd: (2 sd - q_high, 2 sd - q_low),
+        which removes that bias instead of adding it.
+        '''
+        replicates = self.bootstrap(n_resamples, seed, n_workers)
+        stat_dists = self.stat_dists
+        if bareindex is not None:
+            stat_dists = self.stat_dists_diff(bareindex)
+            bare_refs = dict(zip(self.circuit_indices[bareindex], replicates[bareindex]))
+            replicates = [[r - bare_refs[c] for c, r in zip(cis, reps)] if j >= 6 else reps
+                          for j, (cis, reps) in enumerate(zip(self.circuit_indices, replicates))]
+        conf_ints = []
+        for sds, reps in zip(stat_dists, replicates):
+            bounds = []
+            for sd, r in zip(sds, reps):
+                low, high = np.quantile(r, [.5 - ci/2, .5 + ci/2])
+                bounds.append((float(2*sd - high), float(2*sd - low)))
+            conf_ints.append(bounds)
+        return conf_ints
+
+    def stat_dists_diff(self, bareindex):
+        '''stat_dists_diff(bareindex)
+        Average stat_dist of every label minus the one of the same circuit for the bare label bareindex.
+        '''
+        bare_refs = dict(zip(self.circuit_indices[bareindex], self.stat_dists[bareindex]))
+        return [[sd - bare_refs[c] for c, sd in zip(cis, sds)] if j >= 6 else list(sds)
+                for j, (cis, sds) in enumerate(zip(self.circuit_indices, self.stat_dists))]
+
+_AGGREGATE_CACHE = {}
+
+def folder_signature(folder):
+    '''folder_signature(folder)
+    Names, modification times and sizes of the files of folder, used to invalidate cached aggregates.
+    '''
+    return tuple(sorted((entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+                        for entry in os.scandir(folder)))
+
+@proftool.profiled('aggregate_processed_data')
+def aggregate_processed_data(folder):
+    '''aggregate_processed_data(folder)
+    Scans folder (text Processed_data or columnar store) once and returns its ProcessedAggregate.
+    The result is cached until a file of the folder is added, removed or modified.
+    '''
+    key = os.path.abspath(folder)
+    signature = folder_signature(folder)
+    cached = _AGGREGATE_CACHE.get(key)
+    if cached is None or cached[0] != signature:
+        circuits, n_skipped, n_kept = load_processed_data(folder, ['stat_dist', 'post_selection_ratio', 'qasm_count',
+                                                                   'counts', 'expected_distribution_array'])
+        cached = (signature, ProcessedAggregate(circuits, n_skipped, n_kept))
+        _AGGREGATE_CACHE[key] = cached
+    return cached[1]
+
+
+# Data of the figures
+#####################
+# The plot functions of Ploting_tools only render the dictionaries computed here. They hold lists
+# of numbers (they are sent to the render worker processes) and computing them loads neither
+# matplotlib nor qiskit, scipy being only needed for the Student-t intervals.
+
+def _as_aggregate(folder):
+    if isinstance(folder, str):
+        return aggregate_processed_data(folder)
+    return folder
+
+def _aggregate_conf_ints(aggregate, ci, bareindex, ci_method, n_resamples, n_workers):
+    if ci_method == 'bootstrap':
+        return aggregate.bootstrap_conf_ints(ci, bareindex, n_resamples=n_resamples, n_workers=n_workers)
+    return aggregate.conf_ints(ci)
+
+def averaged_plot_data(folder, sublabels=PLOT_LABELS, ci=.99, ci_method='student', n_resamples=10000, n_workers=1):
+    '''averaged_plot_data(folder, sublabels=PLOT_LABELS, ci=.99, ci_method='student', n_resamples=10000, n_workers=1)
+    Data of plot_everything_averaged for a folder or a ProcessedAggregate: the (label index, points)
+    series of sublabels, points being (circuit_index, stat_dist, conf_int) sorted by circuit index,
+    the (circuit_index, qasm_count) of the first bare pair, and the averages printed with the plot.
+    '''
+    aggregate = _as_aggregate(folder)
+    conf_ints = _aggregate_conf_ints(aggregate, ci, None, ci_method, n_resamples, n_workers)
+    post_select_r = aggregate.post_select_r
+    return {'series': [(j, sorted(zip(aggregate.circuit_indices[j], aggregate.stat_dists[j], conf_ints[j])))
+                       for j in [PLOT_LABELS.index(pl) for pl in sublabels]],
+            'qasm_count': sorted(zip(aggregate.circuit_indices[0], aggregate.qasm_counts[0])),
+            'n_skipped': aggregate.n_skipped,
+            'n_kept': aggregate.n_kept,
+            'averages': [(PLOT_LABELS[k], statistics.mean(aggregate.stat_dists[k])) for k in range(0, 11)],
+            'post_selection': [(PLOT_LABELS[k], statistics.mean(post_select_r[k]+post_select_r[10]+post_select_r[11]))
+                               for k in range(6, 10)]}
+
+def averaged_diff_plot_data(folder, bareindex=1, ci=.99, ci_method='student', n_resamples=10000, n_workers=1):
+    '''averaged_diff_plot_data(folder, bareindex=1, ci=.99, ci_method='student', n_resamples=10000, n_workers=1)
+    Data of plot_everything_averaged_diff: the (label index, points) series of the encoded labels,
+    points being (circuit_index, stat_dist - bare stat_dist, conf_int) sorted by circuit index, their
+    (label index, [(circuit_index, qasm_count)]) and the averages printed with the plot.
+    '''
+    aggregate = _as_aggregate(folder)
+    conf_ints = _aggregate_conf_ints(aggregate, ci, bareindex, ci_method, n_resamples, n_workers)
+    stat_dists = aggregate.stat_dists_diff(bareindex)
+    circuit_indices = aggregate.circuit_indices
+    encoded = range(6, len(PLOT_LABELS))
+    return {'bareindex': bareindex,
+            'series': [(j, sorted(zip(circuit_indices[j], stat_dists[j], conf_ints[j]))) for j in encoded],
+            'qasm_counts': [(j, sorted(zip(circuit_indices[j], aggregate.qasm_counts[j]))) for j in encoded],
+            'n_skipped': aggregate.n_skipped,
+            'n_kept': aggregate.n_kept,
+            'averages': [(PLOT_LABELS[k], statistics.mean(stat_dists[k])) for k in range(0, 11)]}
+
+def _mean_stdev(values):
+    return (statistics.mean(values), statistics.stdev(values) if len(values) > 1 else float('nan'))
+
+def calibration_statistics(folder):
+    '''calibration_statistics(folder)
+    (mean, standard deviation) over the distinct calibrations of folder of the T1, T2 (s), gateError
+    and readoutError of every qubit ('single_q'), of the gateError of every CX ('multi_q') and of
+    the fridge temperature (K). The standard deviations of a single calibration are nan.
+    '''
+    calibrations = calibtool.calibration_table(folder)
+    single_q_param_names = ['T1', 'T2', 'gateError', 'readoutError']
+    single_q_parameters = [{} for j in range(0, 5)]
+    multi_q_parameters = [{} for j in range(0, 6)]
+    fridge_T = []
+    for calibration in calibrations:
+        for i, param in enumerate(calibration['multiQubitGates']):
+            multi_q_parameters[i]['qubits'] = param['qubits']
+            multi_q_parameters[i].setdefault('gateError', []).append(convert_parameter(param['gateError']))
+        for i, param in enumerate(calibration['qubits']):
+            single_q_parameters[i]['name'] = param['name']
+            for name in single_q_param_names:
+                single_q_parameters[i].setdefault(name, []).append(convert_parameter(param[name]))
+        fridge_T.append(calibration['fridgeParameters']['Temperature']['value'])
+    return {'n_calibrations': len(calibrations),
+            'single_q': [dict(name=line['name'], **{name: _mean_stdev(line[name]) for name in single_q_param_names})
+                         for line in single_q_parameters],
+            'multi_q': [{'qubits': line['qubits'], 'gateError': _mean_stdev(line['gateError'])}
+                        for line in multi_q_parameters],
+            'temperature': _mean_stdev(fridge_T)}
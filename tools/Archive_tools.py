@@ -0,0 +1,147 @@
+import ast
+import json
+import os
+import threading
+import numpy as np
+
+import tools.Experiment_tools as exptool
+import tools.Timeline_tools as timetool
+
+# Packed archive of the raw counts
+##################################
+# The raw histograms of the job results used to be written to one data/Raw_counts/<name>_<date>.txt
+# file per circuit run. The archive packs them instead: the outcomes of the 5 qubits fit a 32 bins
+# histogram, appended as a row of counts.bin (uint32), with its row of index.bin (circuit code,
+# job code, execution timestamp) and a meta.json holding the number of rows and the lists
+# decoding the circuit and job codes. Both files are read back with np.memmap, so that a query
+# selects the rows on the index and slices the histograms without reading the rest.
+
+ARCHIVE_FOLDER = 'data/Raw_counts_archive/'
+INDEX_DTYPE = np.dtype([('circuit', '<i4'), ('job', '<i4'), ('timestamp', '<f8')])
+COUNTS_DTYPE = np.dtype('<u4')
+
+_ARCHIVE_LOCK = threading.Lock()
+
+
+def _read_meta(archive_folder):
+    filename = os.path.join(archive_folder, 'meta.json')
+    if not os.path.isfile(filename):
+        return {'n_rows': 0, 'circuits': [], 'jobs': []}
+    with open(filename, 'r') as meta_file:
+        return json.load(meta_file)
+
+def _write_meta(archive_folder, meta):
+    tmp_name = os.path.join(archive_folder, 'meta.json.tmp')
+    with open(tmp_name, 'w') as meta_file:
+        json.dump(meta, meta_file)
+    os.replace(tmp_name, os.path.join(archive_folder, 'meta.json'))
+
+def append_counts(records, archive_folder=ARCHIVE_FOLDER):
+    '''append_counts(records, archive_folder=ARCHIVE_FOLDER)
+    Appends the raw counts of records, a list of (circuit_name, job_id, date, counts) with counts
+    as returned by the API ({'01101': n, ...}), to the archive, creating it if needed.
+    Returns the number of rows. Safe to call from the threads of the job callbacks.
+    '''
+    with _ARCHIVE_LOCK:
+        os.makedirs(archive_folder, exist_ok=True)
+        meta = _read_meta(archive_folder)
+        n_rows = meta['n_rows']
+        codes = {col: {value: k for k, value in enumerate(meta[col])} for col in ['circuits', 'jobs']}
+        index = np.zeros(len(records), dtype=INDEX_DTYPE)
+        for k, (circuit_name, job_id, date, counts) in enumerate(records):
+            for col, value in [('circuits', circuit_name), ('jobs', job_id)]:
+                if value not in codes[col]:
+                    codes[col][value] = len(meta[col])
+                    meta[col].append(value)
+            index[k] = (codes['circuits'][circuit_name], codes['jobs'][job_id],
+                        np.nan if date is None else timetool.timestamp(date))
+        counts = exptool.counts_matrix([record[3] for record in records]).astype(COUNTS_DTYPE)
+        # Rows past meta['n_rows'] come from an interrupted append and are dropped first
+        for name, array, row_size in [('index.bin', index, INDEX_DTYPE.itemsize),
+                                      ('counts.bin', counts, 32*COUNTS_DTYPE.itemsize)]:
+            with open(os.path.join(archive_folder, name), 'ab') as archive_file:
+                archive_file.truncate(n_rows*row_size)
+                archive_file.write(array.tobytes())
+        meta['n_rows'] = n_rows + len(records)
+        _write_meta(archive_folder, meta)
+        return meta['n_rows']
+
+def append_result(res, archive_folder=ARCHIVE_FOLDER):
+    '''append_result(res, archive_folder=ARCHIVE_FOLDER)
+    Appends the raw counts of every circuit of a finished job result (as given to the callbacks)
+    to the archive. Returns the number of circuits appended.
+    '''
+    records = []
+    for circuit_name in res.get_names():
+        circuit_data = res.get_data(circuit_name)
+        records.append((circuit_name, res.get_job_id(), circuit_data['date'], circuit_data['counts']))
+    append_counts(records, archive_folder)
+    return len(records)
+
+def load_archive(archive_folder=ARCHIVE_FOLDER):
+    '''load_archive(archive_folder=ARCHIVE_FOLDER)
+    Returns the archive as read-only arrays memory-mapped from it: 'counts' (n, 32), 'circuit',
+    'job' and 'timestamp' (n,), with the lists 'circuits' and 'jobs' decoding the codes.
+    '''
+    meta = _read_meta(archive_folder)
+    n_rows = meta['n_rows']
+    if n_rows == 0:
+        index = np.zeros(0, dtype=INDEX_DTYPE)
+        counts = np.zeros((0, 32), dtype=COUNTS_DTYPE)
+    else:
+        index = np.memmap(os.path.join(archive_folder, 'index.bin'), dtype=INDEX_DTYPE, mode='r', shape=(n_rows,))
+        counts = np.memmap(os.path.join(archive_folder, 'counts.bin'), dtype=COUNTS_DTYPE, mode='r', shape=(n_rows, 32))
+    return {'counts': counts, 'circuit': index['circuit'], 'job': index['job'], 'timestamp': index['timestamp'],
+            'circuits': meta['circuits'], 'jobs': meta['jobs']}
+
+def select_rows(archive, circuit_names=None, job_ids=None, start=None, end=None):
+    '''select_rows(archive, circuit_names=None, job_ids=None, start=None, end=None)
+    Indices of the rows of a loaded archive run on one of circuit_names, in one of job_ids and
+    executed in [start, end) (dates as accepted by Timeline_tools.timestamp), all optional.
+    archive['counts'][rows] are then their histograms.
+    '''
+    mask = np.ones(len(archive['circuit']), dtype=bool)
+    for col, values in [('circuit', circuit_names), ('job', job_ids)]:
+        if values is not None:
+            codes = {value: k for k, value in enumerate(archive[col + 's'])}
+            mask &= np.isin(archive[col], [codes[value] for value in values if value in codes])
+    if start is not None:
+        mask &= archive['timestamp'] >= timetool.timestamp(start)
+    if end is not None:
+        mask &= archive['timestamp'] < timetool.timestamp(end)
+    return np.flatnonzero(mask)
+
+def import_raw_counts_folder(folder='data/Raw_counts/', archive_folder=ARCHIVE_FOLDER, batch_size=10000):
+    '''import_raw_counts_folder(folder='data/Raw_counts/', archive_folder=ARCHIVE_FOLDER, batch_size=10000)
+    Imports the <name>_<date>.txt files of the per-file layout into the archive, by batches of
+    batch_size files, in date order. Their job is unknown and recorded as ''. The files are kept.
+    Returns the numbers of skipped and imported files.
+    '''
+    files = []
+    for filename in os.listdir(folder):
+        if filename.endswith('.txt') and '_' in filename:
+            circuit_name, date = filename[:-len('.txt')].rsplit('_', 1)
+            files.append((date, circuit_name, filename))
+    n_skipped = 0
+    n_imported = 0
+    records = []
+    for date, circuit_name, filename in sorted(files):
+        with open(os.path.join(folder, filename), 'r') as counts_file:
+            try:
+                counts = ast.literal_eval(counts_file.read())
+            except SyntaxError:
+                n_skipped += 1
+                continue
+        try:
+            timetool.timestamp(date)
+        except ValueError:
+            date = None
+        records.append((circuit_name, '', date, counts))
+        if len(records) == batch_size:
+            append_counts(records, archive_folder)
+            n_imported += len(records)
+            records = []
+    if records:
+        append_counts(records, archive_folder)
+        n_imported += len(records)
+    return n_skipped, n_imported
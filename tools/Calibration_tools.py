@@ -0,0 +1,149 @@
+import ast
+import hashlib
+import json
+import os
+
+import tools.Storage_tools as storetool
+
+# Deduplicated table of the device calibrations
+###############################################
+# Every result of a job ran under the same calibration, so instead of copying the calibration
+# dictionary into every processed entry, the text Processed_data entries hold a reference (the
+# key computed by calibration_key from the content of the calibration) and the calibrations are
+# stored once in a JSON Lines table next to the folder: data/Processed_data/ has its table in
+# data/Processed_data.calibrations.jsonl, one {"key": ..., "calibration": ...} per line.
+# Columnar stores keep their own deduplicated calibrations.jsonl (see Storage_tools). The older
+# entries of a folder, which embed their calibration, are rewritten with a reference when its
+# table is created, since the table is then the only place calibration_table reads.
+
+_TABLE_CACHE = {}
+
+
+def calibration_table_filename(folder):
+    '''calibration_table_filename(folder)
+    Path of the calibration table of a text Processed_data folder.
+    '''
+    return os.path.normpath(folder) + '.calibrations.jsonl'
+
+def calibration_key(calibration):
+    '''calibration_key(calibration)
+    Content hash (16 hex digits) identifying a calibration dictionary, None for None.
+    '''
+    if calibration is None:
+        return None
+    return hashlib.sha256(json.dumps(calibration, sort_keys=True).encode()).hexdigest()[:16]
+
+def load_calibration_table(folder):
+    '''load_calibration_table(folder)
+    Dictionary key -> calibration of the table of folder (empty if it has none), in insertion
+    order. The table is cached until its file changes.
+    '''
+    filename = calibration_table_filename(folder)
+    if not os.path.isfile(filename):
+        return {}
+    file_stat = os.stat(filename)
+    signature = (file_stat.st_mtime_ns, file_stat.st_size)
+    cached = _TABLE_CACHE.get(filename)
+    if cached is None or cached[0] != signature:
+        table = {}
+        with open(filename, 'r') as table_file:
+            for line in table_file:
+                if line.strip():
+                    record = json.loads(line)
+                    table[record['key']] = record['calibration']
+        cached = (signature, table)
+        _TABLE_CACHE[filename] = cached
+    return cached[1]
+
+def add_calibrations(folder, calibrations):
+    '''add_calibrations(folder, calibrations)
+    Appends to the table of folder the calibrations it does not hold yet and returns their keys.
+    '''
+    table = load_calibration_table(folder)
+    keys = []
+    new_records = []
+    for calibration in calibrations:
+        key = calibration_key(calibration)
+        keys.append(key)
+        if key is not None and not key in table and not key in [r['key'] for r in new_records]:
+            new_records.append({'key': key, 'calibration': calibration})
+    if new_records:
+        with open(calibration_table_filename(folder), 'a') as table_file:
+            table_file.write(''.join(json.dumps(record, sort_keys=True) + '\n' for record in new_records))
+    return keys
+
+def resolve_calibration(reference, table):
+    '''resolve_calibration(reference, table)
+    Calibration dictionary of a processed entry, whose 'calibration' is either a key of table
+    or (in entries written before the table existed) the calibration itself.
+    '''
+    if isinstance(reference, str):
+        return table[reference]
+    return reference
+
+def reference_entries(folder, entries):
+    '''reference_entries(folder, entries)
+    Copies of the processed entries with their calibration replaced by its key in the table of
+    folder, the new calibrations being added to the table. The entries written before the table
+    existed are normalized when it is created, so that a folder with a table holds no embedded
+    calibration left (calibration_table only reads the table then).
+    '''
+    if os.path.isdir(folder) and not os.path.isfile(calibration_table_filename(folder)):
+        normalize_processed_folder(folder)
+    keys = add_calibrations(folder, [entry.get('calibration') for entry in entries])
+    referenced = []
+    for entry, key in zip(entries, keys):
+        entry = dict(entry)
+        entry['calibration'] = key
+        referenced.append(entry)
+    return referenced
+
+def calibration_table(folder):
+    '''calibration_table(folder)
+    List of the distinct calibrations of a processed data folder, read from its table (or from
+    the calibrations.jsonl of a columnar store). A text folder without table is scanned instead.
+    '''
+    if storetool.is_store(folder):
+        return [c for c in storetool.load_store(folder)['calibrations'] if c is not None]
+    if os.path.isfile(calibration_table_filename(folder)):
+        return list(load_calibration_table(folder).values())
+    calibrations = {}
+    for circuit_filename in os.listdir(folder):
+        with open(os.path.join(folder, circuit_filename), 'r') as circuit_file:
+            for expe_data_string in circuit_file:
+                try:
+                    calibration = ast.literal_eval(expe_data_string).get('calibration')
+                except SyntaxError:
+                    continue
+                if isinstance(calibration, dict):
+                    calibrations.setdefault(calibration_key(calibration), calibration)
+    return list(calibrations.values())
+
+def normalize_processed_folder(folder):
+    '''normalize_processed_folder(folder)
+    Rewrites the entries of a text Processed_data folder holding a full calibration dictionary
+    with a reference to the table of the folder instead. Returns the number of rewritten entries.
+    '''
+    n_rewritten = 0
+    for circuit_filename in sorted(os.listdir(folder)):
+        filename = os.path.join(folder, circuit_filename)
+        with open(filename, 'r') as circuit_file:
+            lines = circuit_file.readlines()
+        new_lines = []
+        for expe_data_string in lines:
+            try:
+                entry = ast.literal_eval(expe_data_string)
+            except SyntaxError:
+                new_lines.append(expe_data_string)
+                continue
+            if isinstance(entry.get('calibration'), dict):
+                entry['calibration'] = add_calibrations(folder, [entry['calibration']])[0]
+                n_rewritten += 1
+                new_lines.append(str(entry) + '\n')
+            else:
+                new_lines.append(expe_data_string)
+        if new_lines != lines:
+            with open(filename + '.tmp', 'w') as circuit_file:
+                circuit_file.write(''.join(new_lines))
+            os.replace(filename + '.tmp', filename)
+    return n_rewritten
@@ -0,0 +1,276 @@
+import copy
+import math
+import numpy as np
+
+import tools.Experiment_tools as exptool
+import tools.Simulation_tools as simtool
+from tools.Noise_tools import noise_parameters, predict_runs
+
+# Exact noisy predictions with density matrices
+###############################################
+# The Pauli-frame engine of Noise_tools samples shots for one calibration. Here the density
+# matrix of the qubits a circuit uses (at most MAX_QUBITS) is evolved exactly, for a batch of
+# calibration snapshots at once: the state is a (n_calibrations, 2, ..., 2) tensor with one row
+# axis and one column axis per qubit, the gates are contracted on their axes for the whole batch
+# and the noise channels take one parameter per snapshot. The noise follows noisy_schedule:
+# depolarizing errors after the (merged) single qubit gates and the CX with the gateError of the
+# calibration, amplitude damping and dephasing from T1 and T2 on the qubits waiting for their CX
+# partner or for the measurements, and readout bit flips with the readoutError. The predicted
+# outcome distributions are decoded as the experimental counts, which gives the exact expected
+# experimental_distribution_array, stat_dist and post-selection ratio of every circuit under every
+# snapshot, without shot noise. compare_with_sampling checks them against the shots of the
+# Pauli-frame engine (python -m benchmarks.check_density_sampling runs it on a few CIRCUITS).
+
+MAX_QUBITS = 8
+
+_SQRT_HALF = 1/math.sqrt(2)
+GATE_UNITARIES = {'h': np.array([[_SQRT_HALF, _SQRT_HALF], [_SQRT_HALF, -_SQRT_HALF]], dtype=complex),
+                  'x': np.array([[0, 1], [1, 0]], dtype=complex),
+                  'z': np.array([[1, 0], [0, -1]], dtype=complex),
+                  's': np.array([[1, 0], [0, 1j]], dtype=complex)}
+CX_UNITARY = np.eye(4, dtype=complex)[[0, 1, 3, 2]].reshape(2, 2, 2, 2)
+
+
+class BatchedDensityMatrix:
+    '''Density matrices of n_qubits qubits for a batch of n_batch noise settings, all starting in
+    |0...0>. The tensor rho has the axes (batch, row qubit 0..n-1, column qubit 0..n-1).
+    '''
+    def __init__(self, n_qubits, n_batch):
+        if n_qubits > MAX_QUBITS:
+            raise ValueError('The density matrix engine holds at most ' + str(MAX_QUBITS) + ' qubits, not ' + str(n_qubits))
+        self.n_qubits = n_qubits
+        self.n_batch = n_batch
+        self.rho = np.zeros((n_batch,) + (2,)*(2*n_qubits), dtype=complex)
+        self.rho[(slice(None),) + (0,)*(2*n_qubits)] = 1.
+
+    def _batch_shape(self, values, n_axes=None):
+        n_axes = 2*self.n_qubits if n_axes is None else n_axes
+        return np.broadcast_to(np.asarray(values, dtype=float), (self.n_batch,)).reshape((self.n_batch,) + (1,)*n_axes)
+
+    def unitary(self, matrix, qubits):
+        '''unitary(matrix, qubits)
+        Applies the gate matrix (shape (2,)*2k, output axes first) on the k qubits.
+        '''
+        k = len(qubits)
+        rows = [1 + q for q in qubits]
+        cols = [1 + self.n_qubits + q for q in qubits]
+        rho = np.moveaxis(np.tensordot(matrix, self.rho, axes=(list(range(k, 2*k)), rows)), list(range(k)), rows)
+        self.rho = np.moveaxis(np.tensordot(matrix.conj(), rho, axes=(list(range(k, 2*k)), cols)), list(range(k)), cols)
+        return self
+
+    def depolarize(self, qubits, weight):
+        '''depolarize(qubits, weight)
+        rho -> (1 - weight) rho + weight Tr_qubits(rho) I/2^k on the k qubits, weight being one value
+        or one per batch. Depolarizing with probability p (a uniform non-identity Pauli error, as
+        in Noise_tools) is weight 4/3 p on one qubit and 16/15 p on two.
+        '''
+        mixed = self.rho
+        for qubit in qubits:
+            row, col = 1 + qubit, 1 + self.n_qubits + qubit
+            mixed = np.expand_dims(np.trace(mixed, axis1=row, axis2=col), (row, col))
+            mixed = mixed*np.eye(2).reshape([2 if axis in (row, col) else 1 for axis in range(mixed.ndim)])/2
+        weight = self._batch_shape(weight)
+        self.rho = (1 - weight)*self.rho + weight*mixed
+        return self
+
+    def damp(self, qubit, gamma, coherence):
+        '''damp(qubit, gamma, coherence)
+        Amplitude damping of probability gamma, the coherences of the qubit being multiplied by
+        coherence (damping and dephasing together), one value or one per batch each.
+        '''
+        view = np.moveaxis(self.rho, [1 + qubit, 1 + self.n_qubits + qubit], [1, 2])
+        gamma = self._batch_shape(gamma, 2*self.n_qubits - 2)
+        coherence = self._batch_shape(coherence, 2*self.n_qubits - 2)
+        view[:, 0, 0] += gamma*view[:, 1, 1]
+        view[:, 1, 1] *= 1 - gamma
+        view[:, 0, 1] *= coherence
+        view[:, 1, 0] *= coherence
+        return self
+
+    def probabilities(self):
+        '''probabilities()
+        Outcome probabilities of the qubits as a (n_batch, 2, ..., 2) tensor, axis 1 + q for qubit q.
+        '''
+        size = 2**self.n_qubits
+        diagonal = np.diagonal(self.rho.reshape(self.n_batch, size, size), axis1=1, axis2=2)
+        return np.clip(diagonal.real, 0., None).reshape((self.n_batch,) + (2,)*self.n_qubits)
+
+
+# Batched noise parameters
+##########################
+def stacked_noise_parameters(calibrations, qubits, cx_pairs, single_gate_time=None, cx_gate_time=None):
+    '''stacked_noise_parameters(calibrations, qubits, cx_pairs, single_gate_time=None, cx_gate_time=None)
+    noise_parameters of every calibration stacked into arrays over the snapshots: (n, len(qubits))
+    for 'gate_error', 'readout_error', 'T1' and 'T2' of the device qubits, (n,) for the gate times
+    and for 'cx_error'[pair] of every (control, target) of cx_pairs.
+    '''
+    params_list = [noise_parameters(calibration, single_gate_time, cx_gate_time) for calibration in calibrations]
+    stacked = {}
+    for key in ['gate_error', 'readout_error', 'T1', 'T2']:
+        stacked[key] = np.array([[params[key][q] if q < len(params[key]) else (math.inf if key[0] == 'T' else 0.)
+                                  for q in qubits] for params in params_list], dtype=float).reshape(len(params_list), len(qubits))
+    for key in ['single_gate_time', 'cx_gate_time']:
+        stacked[key] = np.array([params[key] for params in params_list], dtype=float)
+    stacked['cx_error'] = {}
+    for pair in cx_pairs:
+        missing = [k for k, params in enumerate(params_list) if pair not in params['cx_error']]
+        if missing:
+            raise ValueError('No CX gate error for the qubits ' + str(list(pair)) + ' in the calibration ' + str(missing[0]))
+        stacked['cx_error'][pair] = np.array([params['cx_error'][pair] for params in params_list], dtype=float)
+    return stacked
+
+
+# Exact evolution of a circuit
+##############################
+def outcome_distributions(ops, measurements, calibrations, single_gate_time=None, cx_gate_time=None):
+    '''outcome_distributions(ops, measurements, calibrations, single_gate_time=None, cx_gate_time=None)
+    Exact (n_calibrations, 32) distributions of the measured classical bits (bit k of the index is
+    the classical bit k) of the circuit of parse_qasm under the noise of every calibration.
+    '''
+    qubits = sorted(set(q for op in ops for q in op[1:]) | set(q for q, _ in measurements))
+    local = {q: k for k, q in enumerate(qubits)}
+    cx_pairs = sorted(set(op[1:] for op in ops if op[0] == 'cx'))
+    params = stacked_noise_parameters(calibrations, qubits, cx_pairs, single_gate_time, cx_gate_time)
+    n_batch = len(calibrations)
+    state = BatchedDensityMatrix(len(qubits), n_batch)
+    clocks = {}
+    pending = set()
+
+    def flush(q):
+        if q in pending:
+            pending.discard(q)
+            state.depolarize([local[q]], 4/3*params['gate_error'][:, local[q]])
+            clocks[q] = clocks.get(q, 0.) + params['single_gate_time']
+
+    def wait(q, until):
+        if q in clocks:
+            duration = np.maximum(until - clocks[q], 0.)
+            T1 = params['T1'][:, local[q]]
+            T2 = params['T2'][:, local[q]]
+            gamma = 1 - np.exp(-duration/T1)
+            state.damp(local[q], gamma, np.minimum(np.exp(-duration/T2), np.sqrt(1 - gamma)))
+        clocks[q] = until
+
+    for op in ops:
+        if op[0] != 'cx':
+            state.unitary(GATE_UNITARIES[op[0]], [local[op[1]]])
+            pending.add(op[1])
+            continue
+        a, b = op[1:]
+        flush(a)
+        flush(b)
+        start = np.maximum(clocks.get(a, 0.), clocks.get(b, 0.))
+        wait(a, start)
+        wait(b, start)
+        state.unitary(CX_UNITARY, [local[a], local[b]])
+        state.depolarize([local[a], local[b]], 16/15*params['cx_error'][(a, b)])
+        clocks[a] = clocks[b] = start + params['cx_gate_time']
+    measured = sorted(set(q for q, _ in measurements))
+    for q in measured:
+        flush(q)
+    end = np.max([np.broadcast_to(clocks.get(q, 0.), (n_batch,)) for q in measured] + [np.zeros(n_batch)], axis=0)
+    for q in measured:
+        wait(q, end)
+
+    probabilities = state.probabilities()
+    for q in measured:
+        error = params['readout_error'][:, local[q]].reshape((n_batch,) + (1,)*len(qubits))
+        probabilities = (1 - error)*probabilities + error*np.flip(probabilities, axis=1 + local[q])
+    clbits = dict(measurements)
+    unmeasured = tuple(1 + local[q] for q in qubits if q not in clbits)
+    probabilities = probabilities.sum(axis=unmeasured) if unmeasured else probabilities
+    grid = np.indices((2,)*len(measured)).reshape(len(measured), -1)
+    index = sum(grid[k] << clbits[q] for k, q in enumerate(measured))
+    distributions = np.zeros((n_batch, 32))
+    distributions[:, index] = probabilities.reshape(n_batch, -1)
+    return distributions
+
+
+# Predicted performance of the suite
+####################################
+def decode_distributions(distributions, name):
+    '''decode_distributions(distributions, name)
+    Decodes (n, 32) outcome distributions of the circuit name as its experimental counts are
+    decoded: returns the (n, 4) 'experimental_distribution_array' (post-selected), the
+    'post_selection_ratio' and the 'stat_dist' to the expected distribution of the circuit.
+    '''
+    circuit_info, version, pair, number_H = exptool.circuit_name_info(name)
+    table = exptool.decoding_table(version, pair, number_H)
+    decoded = distributions @ np.eye(5)[table]
+    valid = decoded[:, :4].sum(axis=1)
+    expected = np.array(circuit_info[2], dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        experimental = decoded[:, :4]/valid[:, None]
+    return {'experimental_distribution_array': experimental,
+            'post_selection_ratio': valid,
+            'stat_dist': .5*np.abs(experimental - expected).sum(axis=1),
+            'expected_distribution_array': expected}
+
+def predict_distributions(quantump, circuit_names, calibrations, single_gate_time=None, cx_gate_time=None):
+    '''predict_distributions(quantump, circuit_names, calibrations, single_gate_time=None, cx_gate_time=None)
+    Exact predictions of every named circuit of quantump under every calibration snapshot of
+    calibrations (e.g. Noise_tools.calibration_snapshots(folder)), computed together for all the
+    snapshots: {name: {'raw_distribution': (n, 32), 'experimental_distribution_array': (n, 4),
+    'post_selection_ratio': (n,), 'stat_dist': (n,), 'expected_distribution_array': (4,)}}.
+    '''
+    predictions = {}
+    for name in circuit_names:
+        qasm = quantump.get_qasm(name)
+        if qasm.startswith('OPENQASM 2.0;'):
+            qasm = qasm[len('OPENQASM 2.0;'):]
+        n_qubits, n_clbits, ops, measurements = simtool.parse_qasm(qasm)
+        if n_clbits > 5:
+            raise ValueError('The decoding tables hold 5 classical bits, not ' + str(n_clbits))
+        distributions = outcome_distributions(ops, measurements, calibrations, single_gate_time, cx_gate_time)
+        predictions[name] = dict(decode_distributions(distributions, name), raw_distribution=distributions)
+    return predictions
+
+
+# Agreement with the Pauli-frame sampling
+#########################################
+def without_idle_noise(calibration):
+    '''without_idle_noise(calibration)
+    Copy of the calibration snapshot with infinite T1 and T2, so that only the gate and readout
+    errors are left. The two engines model these the same way, whereas the idling qubits are
+    damped exactly here and with the Pauli twirl of the damping in Noise_tools.
+    '''
+    calibration = copy.deepcopy(calibration)
+    for param in calibration['qubits']:
+        for key in ['T1', 'T2']:
+            param[key]['value'] = math.inf
+    return calibration
+
+def compare_with_sampling(quantump, circuit_names, calibration, n_runs=20, shots_per_run=8192, n_sigma=5., seed=None):
+    '''compare_with_sampling(quantump, circuit_names, calibration, n_runs=20, shots_per_run=8192, n_sigma=5., seed=None)
+    Compares predict_distributions with the runs of Noise_tools.predict_runs under the calibration
+    snapshot. The decoded outcomes '00', '01', '10', '11' and 'err' of all the runs of a circuit are
+    pooled, every frequency has to be within n_sigma binomial standard deviations of its exact
+    probability and the stat_dist of the pooled post-selected distribution within the deviation
+    these allow of the exact stat_dist. Returns {name: {'stat_dist', 'sampled_stat_dist',
+    'tolerance', 'max_sigma', 'agrees'}}, 'max_sigma' being the largest deviation of a frequency in
+    standard deviations. Only expect agreement on a calibration of without_idle_noise.
+    '''
+    exact = predict_distributions(quantump, circuit_names, [calibration])
+    sampled = predict_runs(quantump, circuit_names, calibration, n_runs, shots_per_run, seed=seed)
+    shots = n_runs*shots_per_run
+    comparison = {}
+    for name in circuit_names:
+        circuit_info, version, pair, number_H = exptool.circuit_name_info(name)
+        table = exptool.decoding_table(version, pair, number_H)
+        probabilities = exact[name]['raw_distribution'][0] @ np.eye(5)[table]
+        frequencies = sampled[name]['counts'][:, :5].sum(axis=0)/shots
+        # A probability 0 has to be sampled 0 times, up to the rounding of the exact one
+        sigma = np.maximum(np.sqrt(probabilities*(1 - probabilities)/shots), 1/shots)
+        deviation = np.abs(frequencies - probabilities)
+        sampled_distribution = frequencies[:4]/frequencies[:4].sum()
+        sampled_stat_dist = float(.5*np.abs(sampled_distribution - exact[name]['expected_distribution_array']).sum())
+        stat_dist = float(exact[name]['stat_dist'][0])
+        # |d stat_dist| <= (|d frequencies[:4]|_1 + |d frequencies[4]|)/(2 post-selection ratio)
+        tolerance = float(.5*n_sigma*sigma.sum()/min(probabilities[:4].sum(), frequencies[:4].sum()))
+        comparison[name] = {'stat_dist': stat_dist,
+                            'sampled_stat_dist': sampled_stat_dist,
+                            'tolerance': tolerance,
+                            'max_sigma': float(np.max(deviation/sigma)),
+                            'agrees': bool(np.all(deviation <= n_sigma*sigma)
+                                           and abs(sampled_stat_dist - stat_dist) <= tolerance)}
+    return comparison
@@ -0,0 +1,109 @@
+import ast
+import json
+import os
+
+import tools.Manifest_tools as manifesttool
+import tools.Profiling_tools as proftool
+
+# Streamable API dumps
+######################
+# A job result of the API is dumped as JSON Lines: the first line is the header record (every
+# field of the job but 'qasms', the calibration among them, plus 'n_qasms'), then one line per
+# qasm result ({'qasm', 'data', ...}). Readers get one result at a time, so decoding a dump needs
+# the memory of one result instead of the whole job. The dumps written before, the str() of the
+# job result in api_dump_<id>.txt, are still read (in one piece) and can be converted.
+
+DUMP_FOLDER = 'data/API_dumps/'
+
+
+def dump_filename(job_id, folder=DUMP_FOLDER):
+    '''dump_filename(job_id, folder=DUMP_FOLDER)
+    Path of the dump of job_id: the JSON Lines dump if it exists, else the legacy text dump if it
+    exists, else the path a new (JSON Lines) dump is written to.
+    '''
+    filename = os.path.join(folder, 'api_dump_' + job_id + '.jsonl')
+    if not os.path.isfile(filename) and os.path.isfile(filename[:-len('.jsonl')] + '.txt'):
+        return filename[:-len('.jsonl')] + '.txt'
+    return filename
+
+def write_dump(filename, job_result):
+    '''write_dump(filename, job_result)
+    Writes the job result of the API as a JSON Lines dump. The dump is written to a temporary file
+    and renamed, so that a dump is complete whenever it exists.
+    '''
+    header = {key: value for key, value in job_result.items() if key != 'qasms'}
+    header['n_qasms'] = len(job_result.get('qasms', []))
+    with proftool.stage('write_dump'):
+        with open(filename + '.part', 'w') as dump_file:
+            dump_file.write(json.dumps(header) + '\n')
+            for res in job_result.get('qasms', []):
+                dump_file.write(json.dumps(res) + '\n')
+        os.replace(filename + '.part', filename)
+    proftool.count('write_dump', items=header['n_qasms'], bytes_written=os.path.getsize(filename))
+
+def iter_dump(filename):
+    '''iter_dump(filename)
+    Generator over a dump: yields its header record first, then its qasm results one by one.
+    Legacy text dumps are parsed whole and yielded the same way.
+    '''
+    proftool.count('parse_dump', bytes_read=os.path.getsize(filename))
+    if not filename.endswith('.jsonl'):
+        with proftool.stage('parse_dump'):
+            with open(filename, 'r') as dump_file:
+                job_result = ast.literal_eval(dump_file.read())
+            results = job_result.pop('qasms', [])
+            job_result['n_qasms'] = len(results)
+        proftool.count('parse_dump', items=len(results))
+        yield job_result
+        yield from results
+        return
+    with open(filename, 'r') as dump_file:
+        lines = (line for line in dump_file if line.strip())
+        header_line = next(lines, None)
+        if header_line is None:
+            return
+        with proftool.stage('parse_dump'):
+            header = json.loads(header_line)
+        yield header
+        for line in lines:
+            with proftool.stage('parse_dump'):
+                res = json.loads(line)
+            proftool.count('parse_dump', items=1)
+            yield res
+
+def read_dump(filename):
+    '''read_dump(filename)
+    Job result dictionary of a dump (JSON Lines or legacy), as returned by the API.
+    '''
+    records = iter_dump(filename)
+    job_result = next(records)
+    del job_result['n_qasms']
+    job_result['qasms'] = list(records)
+    return job_result
+
+def convert_literal_dump(filename, manifest=None):
+    '''convert_literal_dump(filename, manifest=None)
+    Converts a legacy api_dump_<id>.txt into api_dump_<id>.jsonl and removes it. With a manifest
+    connection the hash of the dump of a processed (or duplicate) job is updated to the new file,
+    so that the conversion does not make it look changed. Returns the new filename.
+    '''
+    new_filename = filename[:-len('.txt')] + '.jsonl'
+    write_dump(new_filename, read_dump(filename))
+    if manifest is not None:
+        job_id = os.path.basename(filename)[len('api_dump_'):-len('.txt')]
+        row = manifesttool.get_job(manifest, job_id)
+        if row is not None and row['dump_hash'] is not None:
+            manifesttool.set_job_status(manifest, job_id, row['status'], new_filename)
+    os.remove(filename)
+    return new_filename
+
+def convert_dump_folder(folder=DUMP_FOLDER, manifest=None):
+    '''convert_dump_folder(folder=DUMP_FOLDER, manifest=None)
+    Converts every legacy dump of folder with convert_literal_dump. Returns the number converted.
+    '''
+    n_converted = 0
+    for name in sorted(os.listdir(folder)):
+        if name.startswith('api_dump_') and name.endswith('.txt'):
+            convert_literal_dump(os.path.join(folder, name), manifest)
+            n_converted += 1
+    return n_converted
@@ -8,15 +8,33 @@
 ###########################################################################################
 
 import ast
+import collections
+import concurrent.futures
+import functools
+import json
+import os
+import pickle
+import tempfile
 import time
 import numpy as np
-from qiskit import QISKitError
+import tools.Storage_tools as storetool
+import tools.Manifest_tools as manifesttool
+import tools.Calibration_tools as calibtool
+import tools.Dump_tools as dumptool
+import tools.Profiling_tools as proftool
+import tools.Timeline_tools as timetool
+import tools.Archive_tools as archivetool
 
 # Functions that create all the circuits inside a given QuantumProgram module
 #############################################################################
 
 # Misc aux circuits
 ###################
+# The circuits are written on the qubits 0 to 4 of ibmqx4 (the template qubits). A placement (the
+# list of the device qubit of every template qubit, see Mapping_tools) moves the encoded
+# preparations and the measurements to other qubits of a device.
+TEMPLATE_QUBITS = [0, 1, 2, 3, 4]
+
 def swap_circuit(pair, quantump, qri=0):
     '''swap_circuit(pair, quantump, qri=0)
     Creates the swap circuit in the QuantumProgram quantump
@@ -34,84 +52,103 @@ def swap_circuit(pair, quantump, qri=0):
     qcircuitswap.cx(qrs[qri][pair[0]], qrs[qri][pair[1]])
     return qcircuitswap
 
-def measure_all(quantump, qri=0, cri=0):
-    '''measure_all(quantump, qri=0, cri=0)
-    Creates the circuit measuring all outputs.
+def measure_all(quantump, qri=0, cri=0, placement=None):
+    '''measure_all(quantump, qri=0, cri=0, placement=None)
+    Creates the circuit measuring all outputs. With a placement the qubit placement[k] is measured
+    into the bit k, so that the outcomes read as on the template qubits.
     '''
     qrs = [quantump.get_quantum_register(qrn) for qrn in quantump.get_quantum_register_names()]
     crs = [quantump.get_classical_register(crn) for crn in quantump.get_classical_register_names()]
+    p = placement or TEMPLATE_QUBITS
     qcircuitmeasure = quantump.create_circuit("Measure all", qrs, crs)
-    qcircuitmeasure.measure(qrs[qri][0], crs[cri][0])
-    qcircuitmeasure.measure(qrs[qri][1], crs[cri][1])
-    qcircuitmeasure.measure(qrs[qri][2], crs[cri][2])
-    qcircuitmeasure.measure(qrs[qri][3], crs[cri][3])
-    qcircuitmeasure.measure(qrs[qri][4], crs[cri][4])
+    qcircuitmeasure.measure(qrs[qri][p[0]], crs[cri][0])
+    qcircuitmeasure.measure(qrs[qri][p[1]], crs[cri][1])
+    qcircuitmeasure.measure(qrs[qri][p[2]], crs[cri][2])
+    qcircuitmeasure.measure(qrs[qri][p[3]], crs[cri][3])
+    qcircuitmeasure.measure(qrs[qri][p[4]], crs[cri][4])
+    return qcircuitmeasure
+
+def measure_pair(device_pair, pair, quantump, qri=0, cri=0):
+    '''measure_pair(device_pair, pair, quantump, qri=0, cri=0)
+    Creates the circuit measuring the qubits of device_pair into the bits of the template pair,
+    for the bare circuits placed on a pair of their own (see all_circuits).
+    '''
+    qrs = [quantump.get_quantum_register(qrn) for qrn in quantump.get_quantum_register_names()]
+    crs = [quantump.get_classical_register(crn) for crn in quantump.get_classical_register_names()]
+    qcircuitmeasure = quantump.create_circuit("Measure"+str(list(device_pair))+str(list(pair)), qrs, crs)
+    qcircuitmeasure.measure(qrs[qri][device_pair[0]], crs[cri][pair[0]])
+    qcircuitmeasure.measure(qrs[qri][device_pair[1]], crs[cri][pair[1]])
     return qcircuitmeasure
 
 # The encoded preparations
 ##########################
-def encoded_00_prep_ftv1(quantump, qri=0):
+def encoded_00_prep_ftv1(quantump, qri=0, placement=None):
     qrs = [quantump.get_quantum_register(qrn) for qrn in quantump.get_quantum_register_names()]
     crs = [quantump.get_classical_register(crn) for crn in quantump.get_classical_register_names()]
+    p = placement or TEMPLATE_QUBITS
     qc_ftv1 = quantump.create_circuit("e|00>ftv1", qrs, crs)
-    qc_ftv1.h(qrs[qri][2])
-    qc_ftv1.cx(qrs[qri][2], qrs[qri][0])
-    qc_ftv1.cx(qrs[qri][2], qrs[qri][1])
-    qc_ftv1.h(qrs[qri][2])
-    qc_ftv1.h(qrs[qri][3])
-    qc_ftv1.cx(qrs[qri][3], qrs[qri][2])
-    qc_ftv1.h(qrs[qri][2])
-    qc_ftv1.h(qrs[qri][3])
-    qc_ftv1.cx(qrs[qri][2], qrs[qri][4])
-    qc_ftv1.cx(qrs[qri][2], qrs[qri][0])
+    qc_ftv1.h(qrs[qri][p[2]])
+    qc_ftv1.cx(qrs[qri][p[2]], qrs[qri][p[0]])
+    qc_ftv1.cx(qrs[qri][p[2]], qrs[qri][p[1]])
+    qc_ftv1.h(qrs[qri][p[2]])
+    qc_ftv1.h(qrs[qri][p[3]])
+    qc_ftv1.cx(qrs[qri][p[3]], qrs[qri][p[2]])
+    qc_ftv1.h(qrs[qri][p[2]])
+    qc_ftv1.h(qrs[qri][p[3]])
+    qc_ftv1.cx(qrs[qri][p[2]], qrs[qri][p[4]])
+    qc_ftv1.cx(qrs[qri][p[2]], qrs[qri][p[0]])
     return qc_ftv1
 
-def encoded_00_prep_nftv1(quantump, qri=0):
+def encoded_00_prep_nftv1(quantump, qri=0, placement=None):
     qrs = [quantump.get_quantum_register(qrn) for qrn in quantump.get_quantum_register_names()]
     crs = [quantump.get_classical_register(crn) for crn in quantump.get_classical_register_names()]
+    p = placement or TEMPLATE_QUBITS
     qc_nftv1 = quantump.create_circuit("e|00>nftv1", qrs, crs)
-    qc_nftv1.h(qrs[qri][3])
-    qc_nftv1.cx(qrs[qri][3], qrs[qri][4])
-    qc_nftv1.cx(qrs[qri][3], qrs[qri][2])
-    qc_nftv1.cx(qrs[qri][2], qrs[qri][1])
+    qc_nftv1.h(qrs[qri][p[3]])
+    qc_nftv1.cx(qrs[qri][p[3]], qrs[qri][p[4]])
+    qc_nftv1.cx(qrs[qri][p[3]], qrs[qri][p[2]])
+    qc_nftv1.cx(qrs[qri][p[2]], qrs[qri][p[1]])
     return qc_nftv1
 
-def encoded_00_prep_ftv2(quantump, qri=0):
+def encoded_00_prep_ftv2(quantump, qri=0, placement=None):
     qrs = [quantump.get_quantum_register(qrn) for qrn in quantump.get_quantum_register_names()]
     crs = [quantump.get_classical_register(crn) for crn in quantump.get_classical_register_names()]
+    p = placement or TEMPLATE_QUBITS
     qc_ftv2 = quantump.create_circuit("e|00>ftv2", qrs, crs)
-    qc_ftv2.h(qrs[qri][3])
-    qc_ftv2.cx(qrs[qri][3], qrs[qri][2])
-    qc_ftv2.h(qrs[qri][2])
-    qc_ftv2.h(qrs[qri][3])
-    qc_ftv2.cx(qrs[qri][2], qrs[qri][1])
-    qc_ftv2.cx(qrs[qri][3], qrs[qri][4])
-    qc_ftv2.h(qrs[qri][4])
-    qc_ftv2.extend(swap_circuit([2, 4], quantump))
-    qc_ftv2.cx(qrs[qri][2], qrs[qri][0])
-    qc_ftv2.cx(qrs[qri][1], qrs[qri][0])
-    qc_ftv2.h(qrs[qri][4])
+    qc_ftv2.h(qrs[qri][p[3]])
+    qc_ftv2.cx(qrs[qri][p[3]], qrs[qri][p[2]])
+    qc_ftv2.h(qrs[qri][p[2]])
+    qc_ftv2.h(qrs[qri][p[3]])
+    qc_ftv2.cx(qrs[qri][p[2]], qrs[qri][p[1]])
+    qc_ftv2.cx(qrs[qri][p[3]], qrs[qri][p[4]])
+    qc_ftv2.h(qrs[qri][p[4]])
+    qc_ftv2.extend(swap_circuit([p[2], p[4]], quantump))
+    qc_ftv2.cx(qrs[qri][p[2]], qrs[qri][p[0]])
+    qc_ftv2.cx(qrs[qri][p[1]], qrs[qri][p[0]])
+    qc_ftv2.h(qrs[qri][p[4]])
     return qc_ftv2
 
-def encoded_0p_prep(quantump, qri=0):
+def encoded_0p_prep(quantump, qri=0, placement=None):
     qrs = [quantump.get_quantum_register(qrn) for qrn in quantump.get_quantum_register_names()]
     crs = [quantump.get_classical_register(crn) for crn in quantump.get_classical_register_names()]
+    p = placement or TEMPLATE_QUBITS
     qc_0p = quantump.create_circuit("e|0+>", qrs, crs)
-    qc_0p.h(qrs[qri][1])
-    qc_0p.h(qrs[qri][3])
-    qc_0p.cx(qrs[qri][3], qrs[qri][2])
-    qc_0p.extend(swap_circuit([2,1], quantump))
-    qc_0p.cx(qrs[qri][2], qrs[qri][4])
+    qc_0p.h(qrs[qri][p[1]])
+    qc_0p.h(qrs[qri][p[3]])
+    qc_0p.cx(qrs[qri][p[3]], qrs[qri][p[2]])
+    qc_0p.extend(swap_circuit([p[2], p[1]], quantump))
+    qc_0p.cx(qrs[qri][p[2]], qrs[qri][p[4]])
     return qc_0p
 
-def encoded_2cat_prep(quantump, qri=0, cri=0):
+def encoded_2cat_prep(quantump, qri=0, cri=0, placement=None):
     qrs = [quantump.get_quantum_register(qrn) for qrn in quantump.get_quantum_register_names()]
     crs = [quantump.get_classical_register(crn) for crn in quantump.get_classical_register_names()]
+    p = placement or TEMPLATE_QUBITS
     qc_2cat = quantump.create_circuit("e|00>+|11>", qrs, crs)
-    qc_2cat.h(qrs[qri][2])
-    qc_2cat.h(qrs[qri][3])
-    qc_2cat.cx(qrs[qri][2], qrs[qri][1])
-    qc_2cat.cx(qrs[qri][3], qrs[qri][4])
+    qc_2cat.h(qrs[qri][p[2]])
+    qc_2cat.h(qrs[qri][p[3]])
+    qc_2cat.cx(qrs[qri][p[2]], qrs[qri][p[1]])
+    qc_2cat.cx(qrs[qri][p[3]], qrs[qri][p[4]])
     return qc_2cat
 
 # The bare preparations
@@ -298,74 +335,262 @@ CIRCUIT_NAMES = [CIRCUIT_NAMES[j] for j in QASM_BARE_ORDER]
 ENCODED_VERSION_LIST = ['ftv1', 'ftv2', 'nftv1']
 MAPPING = [3, 2, 1, 4]
 CODEWORDS = [['0000', '1111'], ['1100', '0011'], ['1010', '0101'], ['1001', '0110']]
-MAPPED_CODEWORDS = [[], [], [], []]
-for i, cl in enumerate(CODEWORDS):
-    for c in cl:
-        MAPPED_CODEWORDS[i].append(''.join(list(reversed([c[j-1] for j in MAPPING])))+'0')
+
+def mapped_codewords(mapping=MAPPING, n_bits=5):
+    '''mapped_codewords(mapping=MAPPING, n_bits=5)
+    Outcome strings (bit k of the string read from the right is the clbit k) of the codewords of
+    every logical outcome, the bit k of a codeword being on the qubit mapping[k] and the other bits 0.
+    '''
+    codewords = [[], [], [], []]
+    for i, cl in enumerate(CODEWORDS):
+        for c in cl:
+            bits = ['0']*n_bits
+            for k, qubit in enumerate(mapping):
+                bits[n_bits-1-qubit] = c[k]
+            codewords[i].append(''.join(bits))
+    return codewords
+
+MAPPED_CODEWORDS = mapped_codewords(MAPPING)
+
+# Registry of the circuit names
+###############################
+# Every generated name ('bM'+circuit_string+str(pair) or 'eM'+circuit_string+version) maps to a
+# CircuitRecord built once: the position of its circuit in CIRCUITS, gates, input state, expected
+# distribution, version ('bare' or 'encoded'), encoded version of the |00> preparation, pair,
+# number of HHS gates, plot label and its index in PLOT_LABELS, and position (starting at 1) in
+# CIRCUIT_NAMES. The names of the bare pairs of PLOT_LABELS are registered at import and the other
+# ones when all_circuits creates them or on their first lookup. The circuits of a generated suite
+# (see Suite_tools) are added after the ones of CIRCUITS by add_circuits, their positions in
+# CIRCUIT_NAMES continuing after its end.
+BARE_PAIRS = [[1, 0], [2, 0], [2, 1], [2, 4], [3, 2], [3, 4]]
+PLOT_LABELS = (['bare' + str(pair) for pair in BARE_PAIRS]
+               + ['encoded|00>' + v for v in ENCODED_VERSION_LIST]
+               + ['encoded|0+>', 'encoded|00>+|11>'])
+
+CircuitRecord = collections.namedtuple('CircuitRecord', ['name', 'circuit', 'gates', 'state', 'expected', 'version',
+                                                         'encoded_version', 'pair', 'number_H', 'label',
+                                                         'label_index', 'circuit_index'])
+
+_REGISTERED_CIRCUITS = list(CIRCUITS)
+_CIRCUIT_STRINGS = {'-'.join(reversed(c[0]))+c[1]: k for k, c in enumerate(CIRCUITS)}
+_CIRCUIT_NAME_INDEX = {name: l+1 for l, name in enumerate(CIRCUIT_NAMES)}
+_LABEL_INDEX = {label: k for k, label in enumerate(PLOT_LABELS)}
+CIRCUIT_REGISTRY = {}
+
+def register_circuit(circuit, version, pair=None, encoded_version=''):
+    '''register_circuit(circuit, version, pair=None, encoded_version='')
+    Registers (if needed) and returns the record of the circuit CIRCUITS[circuit] (or of the
+    circuit added at that position by add_circuits) in version 'bare' on pair or 'encoded' with
+    the encoded_version of its preparation.
+    '''
+    gates, state, expected = _REGISTERED_CIRCUITS[circuit]
+    circuit_string = '-'.join(reversed(gates))+state
+    if version == 'bare':
+        name = 'bM' + circuit_string + str(list(pair))
+        label = 'bare' + str(list(pair))
+    else:
+        name = 'eM' + circuit_string + encoded_version
+        label = 'encoded' + state + (encoded_version if state == '|00>' else '')
+    record = CIRCUIT_REGISTRY.get(name)
+    if record is None:
+        record = CircuitRecord(name, circuit, gates, state, expected, version, encoded_version,
+                               None if pair is None else tuple(pair), gates.count('HHS'), label,
+                               _LABEL_INDEX.get(label),
+                               _CIRCUIT_NAME_INDEX.get('M' + circuit_string, circuit + 1))
+        CIRCUIT_REGISTRY[name] = record
+    return record
+
+def add_circuits(circuits):
+    '''add_circuits(circuits)
+    Adds the CIRCUITS-like entries [gates, state, expected] of a generated suite to the registry,
+    so that the names all_circuits creates for them are registered and decoded. The entries
+    already known are kept, an entry of a known circuit with another expected distribution raises
+    a ValueError. Returns their positions for register_circuit.
+    '''
+    positions = []
+    for gates, state, expected in circuits:
+        circuit_string = '-'.join(reversed(gates))+state
+        k = _CIRCUIT_STRINGS.get(circuit_string)
+        if k is None:
+            k = len(_REGISTERED_CIRCUITS)
+            _REGISTERED_CIRCUITS.append([list(gates), state, list(expected)])
+            _CIRCUIT_STRINGS[circuit_string] = k
+        elif [float(p) for p in _REGISTERED_CIRCUITS[k][2]] != [float(p) for p in expected]:
+            raise ValueError('Expected distribution ' + str(expected) + ' of ' + circuit_string
+                             + ' differs from the registered ' + str(_REGISTERED_CIRCUITS[k][2]))
+        positions.append(k)
+    return positions
+
+def circuit_record(name):
+    '''circuit_record(name)
+    CircuitRecord of a generated circuit name (a circuit filename name + '.txt' is accepted too).
+    Raises a ValueError for a name that is not a generated one.
+    '''
+    record = CIRCUIT_REGISTRY.get(name)
+    if record is not None:
+        return record
+    if name.endswith('.txt'):
+        return circuit_record(name[:-len('.txt')])
+    if name[:2] == 'bM' and name.endswith(']') and '[' in name:
+        split = name.rindex('[')
+        if name[2:split] in _CIRCUIT_STRINGS:
+            pair = [int(q) for q in name[split+1:-1].split(',')]
+            return register_circuit(_CIRCUIT_STRINGS[name[2:split]], 'bare', pair)
+    elif name[:2] == 'eM':
+        for v in sorted(ENCODED_VERSION_LIST, key=len, reverse=True) + ['']:
+            if name.endswith(v) and name[2:len(name)-len(v)] in _CIRCUIT_STRINGS:
+                return register_circuit(_CIRCUIT_STRINGS[name[2:len(name)-len(v)]], 'encoded', encoded_version=v)
+    raise ValueError('Not a generated circuit name: ' + name)
+
+for _k, _c in enumerate(CIRCUITS):
+    for _pair in BARE_PAIRS:
+        register_circuit(_k, 'bare', _pair)
+    for _v in (ENCODED_VERSION_LIST if _c[1] == '|00>' else ['']):
+        register_circuit(_k, 'encoded', encoded_version=_v)
+
+# Cache of the circuit fragments
+################################
+# The preparation, gate and measurement fragments only depend on the factory, its pair or
+# mapping and the registers of the program, so each one is built once and reused by all_circuits.
+_FRAGMENT_CACHE = {}
+
+def register_layout(quantump):
+    '''register_layout(quantump)
+    Names and sizes of the quantum and classical registers of the QuantumProgram quantump.
+    '''
+    return (tuple((qrn, quantump.get_quantum_register(qrn).size) for qrn in quantump.get_quantum_register_names()),
+            tuple((crn, quantump.get_classical_register(crn).size) for crn in quantump.get_classical_register_names()))
+
+def cached_fragment(factory, args, quantump, layout=None, placement=None):
+    '''cached_fragment(factory, args, quantump, layout=None, placement=None)
+    Returns the circuit factory(*args, quantump) (factory(*args, quantump, placement=placement) if
+    a placement is given), building it only the first time it is asked for with these arguments
+    and this register layout.
+    '''
+    if layout is None:
+        layout = register_layout(quantump)
+    key = (factory, tuple(tuple(arg) if isinstance(arg, list) else arg for arg in args), layout,
+           None if placement is None else tuple(placement))
+    fragment = _FRAGMENT_CACHE.get(key)
+    if fragment is None:
+        if placement is None:
+            fragment = factory(*args, quantump)
+        else:
+            fragment = factory(*args, quantump, placement=placement)
+        _FRAGMENT_CACHE[key] = fragment
+    return fragment
+
+def clear_fragment_cache():
+    _FRAGMENT_CACHE.clear()
 
 # Function that assembles all circuits within a given QuantumProgram module
 ###########################################################################
+def bare_gate_keys(gates):
+    '''bare_gate_keys(gates)
+    Keys in DICT_BARE of the bare gates implementing the list of encoded gates: every HHS swaps
+    the roles of the two qubits of the pair for the following X and Z gates.
+    '''
+    keys = []
+    number_swap = 0
+    for g in gates:
+        if g[0] == 'X' or g[0] == 'Z':
+            keys.append('b'+g[0]+str(((int(g[1]) - 1 + number_swap) % 2) + 1))
+        elif g[0] == 'H':
+            number_swap += 1
+            keys.append('b'+g)
+        else:
+            keys.append('b'+g)
+    return keys
+
 def all_circuits(quantump,
                  possible_pairs,
                  mapping=MAPPING,
                  circuits=CIRCUITS,
                  dict_bare=DICT_BARE,
                  dict_encoded=DICT_ENCODED,
-                 encoded_version_list=ENCODED_VERSION_LIST):
+                 encoded_version_list=ENCODED_VERSION_LIST,
+                 placement=None,
+                 bare_pairs=None):
+    '''all_circuits(quantump, possible_pairs, mapping=MAPPING, circuits=CIRCUITS, dict_bare=DICT_BARE,
+                 dict_encoded=DICT_ENCODED, encoded_version_list=ENCODED_VERSION_LIST, placement=None,
+                 bare_pairs=None)
+    Creates in quantump the bare version of every circuit for every pair and its encoded versions,
+    assembled from cached fragments. Returns the list of the created circuit names.
+    With a placement (see Mapping_tools.best_placement) the pairs and the mapping are given on the
+    template qubits and every circuit runs on the device qubits placement[q] instead of q, the
+    measured bits staying the ones of the template qubits: names, MAPPED_CODEWORDS and the decoding
+    are unchanged. With bare_pairs ({template pair: device pair}, see Mapping_tools.best_placement)
+    the bare circuits of every template pair run on its device pair instead, only that pair being
+    measured, into the bits of the template pair.
+    The names of circuits not in CIRCUITS are registered when their entries were
+    added with add_circuits first (see Suite_tools.generate_suite).
+    '''
     qrs = [quantump.get_quantum_register(qrn) for qrn in quantump.get_quantum_register_names()]
     crs = [quantump.get_classical_register(crn) for crn in quantump.get_classical_register_names()]
+    layout = register_layout(quantump)
+    measure = cached_fragment(measure_all, (), quantump, layout, placement)
+    if placement is not None:
+        device_pairs = {tuple(pair): [placement[q] for q in pair] for pair in possible_pairs}
+        device_mapping = [placement[q] for q in mapping]
+    else:
+        device_pairs = {tuple(pair): pair for pair in possible_pairs}
+        device_mapping = mapping
+    bare_measures = {tuple(pair): measure for pair in possible_pairs}
+    if bare_pairs is not None:
+        device_pairs = {tuple(pair): list(bare_pairs[tuple(pair)]) for pair in possible_pairs}
+        bare_measures = {tuple(pair): cached_fragment(measure_pair, (device_pairs[tuple(pair)], pair), quantump, layout)
+                         for pair in possible_pairs}
     circuit_names = []
     for lc in circuits:
+        circuit_string = '-'.join(reversed(lc[0]))+lc[1]
+        bare_keys = bare_gate_keys(lc[0])
+        registered = circuit_string in _CIRCUIT_STRINGS
         for pair in possible_pairs:
-            qcirc = quantump.create_circuit('bM'+'-'.join(reversed(lc[0]))+lc[1]+str(pair), qrs, crs)
-            circuit_names.append('bM'+'-'.join(reversed(lc[0]))+lc[1]+str(pair))
-            qcirc.extend(dict_bare['b'+lc[1]](pair, quantump))
-            number_swap = 0
-            for g in lc[0]:
-                if g[0] == 'X' or g[0] == 'Z':
-                    key = 'b'+g[0]+str(((int(g[1]) - 1 + number_swap) % 2) + 1)
-                elif g[0] == 'H':
-                    number_swap += 1
-                    key = 'b'+g
-                else:
-                    key = 'b'+g
-                qcirc.extend(dict_bare[key](pair, quantump))
-            qcirc.extend(measure_all(quantump))
+            qcirc = quantump.create_circuit('bM'+circuit_string+str(pair), qrs, crs)
+            circuit_names.append('bM'+circuit_string+str(pair))
+            if registered:
+                register_circuit(_CIRCUIT_STRINGS[circuit_string], 'bare', pair)
+            qcirc.extend(cached_fragment(dict_bare['b'+lc[1]], (device_pairs[tuple(pair)],), quantump, layout))
+            for key in bare_keys:
+                qcirc.extend(cached_fragment(dict_bare[key], (device_pairs[tuple(pair)],), quantump, layout))
+            qcirc.extend(bare_measures[tuple(pair)])
         if lc[1] == '|00>':
-            for v in encoded_version_list:
-                qcirc = quantump.create_circuit('eM'+'-'.join(reversed(lc[0]))+lc[1]+v, qrs, crs)
-                circuit_names.append('eM'+'-'.join(reversed(lc[0]))+lc[1]+v)
-                qcirc.extend(dict_encoded['e'+lc[1]+v](quantump))
-                for g in lc[0]:
-                    qcirc.extend(dict_encoded['e'+g](mapping, quantump))
-                qcirc.extend(measure_all(quantump))
+            versions = encoded_version_list
         else:
-            qcirc = quantump.create_circuit('eM'+'-'.join(reversed(lc[0]))+lc[1], qrs, crs)
-            circuit_names.append('eM'+'-'.join(reversed(lc[0]))+lc[1])
-            qcirc.extend(dict_encoded['e'+lc[1]](quantump))
-            for gate in lc[0]:
-                qcirc.extend(dict_encoded['e'+gate](mapping, quantump))
-            qcirc.extend(measure_all(quantump))
+            versions = ['']
+        encoded_gates = [cached_fragment(dict_encoded['e'+g], (device_mapping,), quantump, layout) for g in lc[0]]
+        for v in versions:
+            qcirc = quantump.create_circuit('eM'+circuit_string+v, qrs, crs)
+            circuit_names.append('eM'+circuit_string+v)
+            if registered:
+                register_circuit(_CIRCUIT_STRINGS[circuit_string], 'encoded', encoded_version=v)
+            qcirc.extend(cached_fragment(dict_encoded['e'+lc[1]+v], (), quantump, layout, placement))
+            for gate in encoded_gates:
+                qcirc.extend(gate)
+            qcirc.extend(measure)
     return circuit_names
 
 
 # Callback function for the run circuits
 ########################################
+def qiskit_error():
+    '''qiskit_error()
+    QISKitError class, imported on first use only (in an except clause it is only evaluated once
+    an exception is raised) so that analysis code importing this module does not load qiskit.
+    '''
+    from qiskit import QISKitError
+    return QISKitError
+
 def post_treatment(res):
-    '''Callback function to write the results into a file after the jobs are finished.
+    '''Callback function to write the results into the raw counts archive after the jobs are finished.
     '''
     with open('data/callback.log', 'a') as logfile:
         logfile.write(str(time.asctime(time.localtime(time.time())))+':'+res.get_status()+' - id: '+res.get_job_id()+'\n')
-    circuit_names = res.get_names()
     try:
-        for circuit_name in circuit_names:
-            circuit_data = res.get_data(circuit_name)
-            filename = 'data/Raw_counts/' + circuit_name + '_' + circuit_data['date']+'.txt'
-            with open(filename, 'w') as data_file:
-                data_file.write(str(circuit_data['counts']))
+        archivetool.append_result(res)
         with open('data/completed.txt', 'a') as completed_file:
             completed_file.write(res.get_job_id()+'\n')
-    except QISKitError as qiskit_err:
+    except qiskit_error() as qiskit_err:
         print(qiskit_err)
         if str(qiskit_err) == '\'Time Out\'':
             with open('data/timed_out.txt', 'a') as timed_out_file:
@@ -373,28 +598,29 @@ def post_treatment(res):
 
 
 def post_treatment_list(results):
-    '''Callback function to write the results into a file after the jobs are finished.
+    '''Callback function to write the results into the raw counts archive after the jobs are finished.
+    The histograms of all the circuits of a job are appended together (see Archive_tools).
     '''
     for res in results:
         with open('data/callback.log', 'a') as logfile:
             logfile.write(str(time.asctime(time.localtime(time.time())))+':'+res.get_status()+' - id: '+res.get_job_id()+'\n')
-        circuit_names = res.get_names()
         try:
-            for circuit_name in circuit_names:
-                circuit_data = res.get_data(circuit_name)
-                filename = 'data/Raw_counts/' + circuit_name + '_' + circuit_data['date']+'.txt'
-                with open(filename, 'w') as data_file:
-                    data_file.write(str(circuit_data['counts']))
+            with proftool.stage('post_treatment'):
+                n_circuits = archivetool.append_result(res)
+            proftool.count('post_treatment', items=n_circuits,
+                           bytes_written=n_circuits*(32*archivetool.COUNTS_DTYPE.itemsize + archivetool.INDEX_DTYPE.itemsize))
+            proftool.count_circuits('post_treatment', res.get_names())
             with open('data/completed.txt', 'a') as completed_file:
                 completed_file.write(res.get_job_id()+'\n')
-        except QISKitError as qiskit_err:
+        except qiskit_error() as qiskit_err:
             if str(qiskit_err) == '\'Time Out\'':
                 with open('data/timed_out.txt', 'a') as timed_out_file:
                     timed_out_file.write(res.get_job_id()+'\n')
 
 # Function to fetch previously timed out results
-def fetch_previous(filename, api):
+def fetch_previous(filename, api, manifest=None):
     '''Function that fetch previously ran experiements whose ids are stored in data/filename
+    With a manifest connection the job statuses and the dump hashes are recorded in it as well.
     '''
     new = 0
     with open('data/'+filename, 'r') as ids_file_read:
@@ -402,15 +628,35 @@ def fetch_previous(filename, api):
     with open('data/'+filename, 'w') as ids_file_write:
         for id_line in id_lines:
             id_string = id_line.rstrip()
-            job_result = api.get_job(id_string)
+            with proftool.stage('fetch_job'):
+                job_result = api.get_job(id_string)
+            proftool.count('fetch_job', items=1)
             if not job_result['status'] == 'COMPLETED':
                 ids_file_write.write(id_line)
             else:
                 new += 1
                 with open('data/completed_'+filename, 'a') as comp_file:
                     comp_file.write(id_line)
-                with open('data/API_dumps/api_dump_'+id_string+'.txt', 'w') as data_file:
-                    data_file.write(str(job_result))
+                dumptool.write_dump(dumptool.dump_filename(id_string), job_result)
+                if manifest is not None:
+                    manifesttool.set_job_status(manifest, id_string, 'dumped', dumptool.dump_filename(id_string))
+    return new
+
+def fetch_pending(api, manifest):
+    '''fetch_pending(api, manifest)
+    Polls every job of the manifest with status 'submitted', 'timed_out' or 'completed' and writes the API dump
+    of the ones that are now completed, recording them as 'dumped'. No id file is rewritten.
+    Returns the number of new dumps.
+    '''
+    new = 0
+    for id_string in manifesttool.jobs_with_statuses(manifest, ['submitted', 'timed_out', 'completed']):
+        with proftool.stage('fetch_job'):
+            job_result = api.get_job(id_string)
+        proftool.count('fetch_job', items=1)
+        if job_result['status'] == 'COMPLETED':
+            new += 1
+            dumptool.write_dump(dumptool.dump_filename(id_string), job_result)
+            manifesttool.set_job_status(manifest, id_string, 'dumped', dumptool.dump_filename(id_string))
     return new
 
 
@@ -419,96 +665,383 @@ def fetch_previous(filename, api):
 
 # Function to get the dictionary of qasm vs circuit name
 def get_qasm_name_dict(compiled_qobj_list):
+    '''get_qasm_name_dict(compiled_qobj_list)
+    Dictionary compiled qasm -> names of the circuits of the compiled qobjs. To process dumps in
+    later sessions, index them once with Qasm_index_tools.add_compiled_qobjs instead.
+    '''
     dictionary = {}
-    for n, v in zip(sum([[circuit['compiled_circuit_qasm'] for circuit in batch['circuits']] for batch in compiled_qobj_list],[]),
-                    sum([[circuit['name'] for circuit in batch['circuits']] for batch in compiled_qobj_list],[])):
-        dictionary.setdefault(n, []).append(v)
+    for batch in compiled_qobj_list:
+        for circuit in batch['circuits']:
+            dictionary.setdefault(circuit['compiled_circuit_qasm'], []).append(circuit['name'])
     return dictionary
 
-def api_data_to_dict(res, name):
-    data_dict = {'name' : name}
-    data_dict.setdefault('raw_counts', {}).update(res['data']['counts'])
-    data_dict['counts'] = {'00' : 0, '01' : 0, '10' : 0, '11' : 0, 'err' : 0, 'total_valid' : 0}
-    data_dict['qasm_count'] = len([q_instr for q_instr in res['qasm'].split('\n') if len(q_instr) > 0]) - 3
-    n = len(name)
-    number_H = name.count('H')/2
-
-    if name[0] == 'b':
-        circuit_info = [c for c in CIRCUITS if '-'.join(reversed(c[0]))+c[1] == name[2:n-6]][0]
-        data_dict['expected_distribution_array'] = np.array(circuit_info[2], dtype=float)
-        pair = ast.literal_eval(name[n-6:n])
-        data_dict['version'] = 'bare'
+def save_qasm_name_dict(dict_qasm_name, filename='data/qasm_names.json'):
+    '''save_qasm_name_dict(dict_qasm_name, filename='data/qasm_names.json')
+    Saves the dictionary of get_qasm_name_dict as JSON, so that the dumps can be processed
+    without the compiled qobjs (see Pipeline_tools).
+    '''
+    with open(filename + '.part', 'w') as names_file:
+        json.dump(dict_qasm_name, names_file, sort_keys=True)
+    os.replace(filename + '.part', filename)
+
+def load_qasm_name_dict(filename='data/qasm_names.json'):
+    with open(filename, 'r') as names_file:
+        return json.load(names_file)
+
+def circuit_label(name):
+    '''circuit_label(name)
+    Returns the plot label ('bare[1, 0]', 'encoded|00>ftv1', ...) a processed circuit name belongs to.
+    '''
+    return circuit_record(name).label
+
+def circuit_name_info(name):
+    '''circuit_name_info(name)
+    Returns the entry in CIRCUITS (or added by add_circuits) of a generated circuit name, its
+    version ('bare' or 'encoded'), its qubit pair (None for encoded circuits) and its number of
+    HHS gates, from its CircuitRecord.
+    '''
+    record = circuit_record(name)
+    return _REGISTERED_CIRCUITS[record.circuit], record.version, record.pair, record.number_H
+
+# Vectorized decoding of the raw outcomes
+#########################################
+@functools.lru_cache(maxsize=None)
+def decoding_table(version, pair=None, number_H=0):
+    '''decoding_table(version, pair=None, number_H=0)
+    Returns the 32 entries array mapping every 5 bits outcome (as an integer) to the index
+    of the logical outcome '00', '01', '10', '11' it decodes to, or to 4 for the 'err' bucket.
+    '''
+    table = np.full(32, 4, dtype=np.intp)
+    if version == 'bare':
+        pair = list(pair)
         if number_H % 2 == 1:
             pair.reverse()
-        for key in res['data']['counts']:
-            data_dict['counts'][''.join([key[4-j] for j in reversed(pair)])] += res['data']['counts'][key]
-            data_dict['counts']['total_valid'] += res['data']['counts'][key]
-
-    elif name[0] == 'e':
-        if 'nftv' in name[n-5:n]:
-            circuit_info = [c for c in CIRCUITS if '-'.join(reversed(c[0]))+c[1] == name[2:n-5]][0]
-        elif 'ftv' in name[n-5:n]:
-            circuit_info = [c for c in CIRCUITS if '-'.join(reversed(c[0]))+c[1] == name[2:n-4]][0]
-        else:
-            circuit_info = [c for c in CIRCUITS if '-'.join(reversed(c[0]))+c[1] == name[2:n]][0]
-        data_dict['expected_distribution_array'] = np.array(circuit_info[2], dtype=float)
-        data_dict['version'] = 'encoded'
-        for key in res['data']['counts']:
-            found = False
-            for i, codeword_list in enumerate(MAPPED_CODEWORDS):
-                if key in codeword_list:
-                    data_dict['counts']["{0:02b}".format(i)] += res['data']['counts'][key]
-                    data_dict['counts']['total_valid'] += res['data']['counts'][key]
-                    found = True
-                    break
-            if not found:
-                data_dict['counts']['err'] += res['data']['counts'][key]
-
-    data_dict['experimental_distribution_array'] = np.array([data_dict['counts'][s]/data_dict['counts']['total_valid']
-                                                             for s in ['00', '01', '10', '11']],dtype=float)
-    data_dict['post_selection_ratio'] = data_dict['counts']['total_valid']/(data_dict['counts']['err']+data_dict['counts']['total_valid'])
-    data_dict['stat_dist'] = .5*sum(np.abs(data_dict['experimental_distribution_array']-data_dict['expected_distribution_array']))
-    data_dict['stand_dev'] = np.sqrt(data_dict['experimental_distribution_array']
-                                     *(1-data_dict['experimental_distribution_array'])
-                                     /data_dict['counts']['total_valid'])
-    stat_dist_stand_dev = 0
-    for j in range(0, 4):
-        stat_dist_stand_dev += data_dict['experimental_distribution_array'][j]*(1-data_dict['experimental_distribution_array'][j])/(4*data_dict['counts']['total_valid'])
-    for i in range(0, 4):
-        for j in range(0, 4):
-            if i != j:
-                stat_dist_stand_dev += data_dict['experimental_distribution_array'][i]*data_dict['experimental_distribution_array'][j]/(4*data_dict['counts']['total_valid'])
-    stat_dist_stand_dev = np.sqrt(stat_dist_stand_dev)
-    data_dict['stat_dist_stand_dev'] = stat_dist_stand_dev
-    data_dict['stand_dev'] = list(data_dict['stand_dev'])
-    data_dict['experimental_distribution_array'] = list(data_dict['experimental_distribution_array'])
-    data_dict['expected_distribution_array'] = list(data_dict['expected_distribution_array'])
+        for outcome in range(32):
+            table[outcome] = 2*((outcome >> pair[1]) & 1) + ((outcome >> pair[0]) & 1)
+    else:
+        for i, codeword_list in enumerate(MAPPED_CODEWORDS):
+            for codeword in codeword_list:
+                table[int(codeword, 2)] = i
+    table.setflags(write=False)
+    return table
+
+def counts_matrix(counts_list):
+    '''counts_matrix(counts_list)
+    Stacks a list of counts dictionaries {'01101': n, ...} into a (len(counts_list), 32) array.
+    '''
+    matrix = np.zeros((len(counts_list), 32), dtype=np.int64)
+    for k, counts in enumerate(counts_list):
+        for key, value in counts.items():
+            matrix[k, int(key, 2)] += value
+    return matrix
+
+def decode_counts(raw_counts, tables, expected_distributions):
+    '''decode_counts(raw_counts, tables, expected_distributions)
+    Decodes a batch of raw outcome histograms in one vectorized pass.
+    raw_counts is (n, 32), tables is (n, 32) (rows of decoding_table) and expected_distributions
+    is (n, 4). Returns a dictionary of arrays: 'counts' (n, 6) ordered as '00', '01', '10', '11',
+    'err', 'total_valid', and the derived 'experimental_distribution_array', 'post_selection_ratio',
+    'stat_dist', 'stand_dev' and 'stat_dist_stand_dev'.
+    '''
+    raw_counts = np.asarray(raw_counts)
+    n_res = raw_counts.shape[0]
+    flat_index = (np.asarray(tables) + 5*np.arange(n_res)[:, None]).ravel()
+    decoded = np.bincount(flat_index, weights=raw_counts.ravel(), minlength=5*n_res).reshape(n_res, 5)
+    decoded = np.rint(decoded).astype(np.int64)
+    total_valid = decoded[:, :4].sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        distributions = decoded[:, :4]/total_valid[:, None]
+        post_selection_ratio = total_valid/(decoded[:, 4] + total_valid)
+        stand_dev = np.sqrt(distributions*(1 - distributions)/total_valid[:, None])
+        sum_p = distributions.sum(axis=1)
+        sum_p2 = (distributions**2).sum(axis=1)
+        stat_dist_stand_dev = np.sqrt((sum_p - sum_p2 + sum_p**2 - sum_p2)/(4*total_valid))
+    return {'counts': np.column_stack([decoded, total_valid]),
+            'experimental_distribution_array': distributions,
+            'post_selection_ratio': post_selection_ratio,
+            'stat_dist': .5*np.abs(distributions - expected_distributions).sum(axis=1),
+            'stand_dev': stand_dev,
+            'stat_dist_stand_dev': stat_dist_stand_dev}
+
+def api_data_to_arrays(results, names):
+    '''api_data_to_arrays(results, names)
+    Batch version of api_data_to_dict: decodes the API results res (one per name) together
+    and returns the fields of api_data_to_dict as arrays over the batch.
+    '''
+    infos = [circuit_name_info(name) for name in names]
+    tables = np.array([decoding_table(version, pair, number_H) for _, version, pair, number_H in infos])
+    expected = np.array([circuit_info[2] for circuit_info, _, _, _ in infos], dtype=float).reshape(-1, 4)
+    arrays = decode_counts(counts_matrix([res['data']['counts'] for res in results]).reshape(-1, 32),
+                           tables.reshape(-1, 32), expected)
+    arrays['name'] = list(names)
+    arrays['version'] = [version for _, version, _, _ in infos]
+    arrays['expected_distribution_array'] = expected
+    arrays['qasm_count'] = np.array([len([q_instr for q_instr in res['qasm'].split('\n') if len(q_instr) > 0]) - 3
+                                     for res in results], dtype=np.int64)
+    return arrays
+
+def arrays_row_to_dict(arrays, k, res):
+    '''arrays_row_to_dict(arrays, k, res)
+    Builds the api_data_to_dict dictionary of row k of api_data_to_arrays, res being its API result.
+    '''
+    data_dict = {'name' : arrays['name'][k]}
+    data_dict['raw_counts'] = dict(res['data']['counts'])
+    data_dict['counts'] = dict(zip(storetool.COUNT_KEYS, arrays['counts'][k].tolist()))
+    data_dict['qasm_count'] = int(arrays['qasm_count'][k])
+    data_dict['expected_distribution_array'] = arrays['expected_distribution_array'][k].tolist()
+    data_dict['version'] = arrays['version'][k]
+    data_dict['experimental_distribution_array'] = arrays['experimental_distribution_array'][k].tolist()
+    for field in ['post_selection_ratio', 'stat_dist', 'stat_dist_stand_dev']:
+        data_dict[field] = float(arrays[field][k])
+    data_dict['stand_dev'] = arrays['stand_dev'][k].tolist()
+    data_dict['date'] = res['data'].get('date')
     return data_dict
 
+def api_data_to_dict(res, name):
+    return arrays_row_to_dict(api_data_to_arrays([res], [name]), 0, res)
+
+
+DECODE_BATCH_SIZE = 64
 
-def process_api_dump(filename, dict_qasm_name, dict_res={}):
-    with open(filename, 'r') as api_dump_file:
-        job_results = ast.literal_eval(api_dump_file.read())
-    for res in job_results['qasms']:
-        names = dict_qasm_name['OPENQASM 2.0;'+res['qasm']]
-        for name in names:
-            res_entry = api_data_to_dict(res, name)
-            res_entry['calibration'] = job_results['calibration']
-            dict_res.setdefault(name, []).append(res_entry)
+def iter_decoded_batches(filename, dict_qasm_name, batch_size=DECODE_BATCH_SIZE):
+    '''iter_decoded_batches(filename, dict_qasm_name, batch_size=DECODE_BATCH_SIZE)
+    Streams an API dump and yields its processed entries by lists of about batch_size, each list
+    being decoded in one vectorized pass, so that only one batch of results is held in memory.
+    '''
+    records = dumptool.iter_dump(filename)
+    calibration = next(records).get('calibration')
+    results = []
+    names = []
+
+    def decode_batch():
+        with proftool.stage('decode'):
+            arrays = api_data_to_arrays(results, names)
+            entries = []
+            for k, res in enumerate(results):
+                res_entry = arrays_row_to_dict(arrays, k, res)
+                res_entry['calibration'] = calibration
+                entries.append(res_entry)
+        proftool.count('decode', items=len(entries))
+        proftool.count_circuits('decode', names)
+        return entries
+
+    for res in records:
+        for name in dict_qasm_name['OPENQASM 2.0;'+res['qasm']]:
+            results.append(res)
+            names.append(name)
+        if len(results) >= batch_size:
+            yield decode_batch()
+            results = []
+            names = []
+    if results:
+        yield decode_batch()
+
+def decode_api_dump(filename, dict_qasm_name):
+    '''decode_api_dump(filename, dict_qasm_name)
+    Reads an API dump and returns the list of its processed entries, without writing them.
+    The whole dump is held in memory: process_api_dump streams it by batches instead.
+    '''
+    return [res_entry for entries in iter_decoded_batches(filename, dict_qasm_name) for res_entry in entries]
+
+def write_processed_entries(entries, store_folder=None, timeline=None):
+    '''write_processed_entries(entries, store_folder=None, timeline=None)
+    Appends processed entries to data/Processed_data/<name>.txt, or to the columnar store in
+    store_folder when one is given. Each circuit file gets all its new lines in a single write.
+    The text entries hold a reference to their calibration, stored in the calibration table.
+    With a timeline connection (see Timeline_tools.open_timeline) the entries are indexed by date too.
+    '''
+    if timeline is not None:
+        timetool.index_entries(timeline, entries)
+    if store_folder:
+        with proftool.stage('write_processed'):
+            storetool.append_to_store(store_folder, entries)
+        proftool.count('write_processed', items=len(entries))
+        return
+    lines = {}
+    with proftool.stage('write_processed'):
+        for res_entry in calibtool.reference_entries('data/Processed_data/', entries):
+            lines.setdefault(res_entry['name'], []).append(str(res_entry) + '\n')
+        for name, name_lines in lines.items():
             with open('data/Processed_data/' + name + '.txt', 'a') as circuit_file:
-                circuit_file.write(str(res_entry) + '\n')
+                n_written = circuit_file.write(''.join(name_lines))
+            proftool.count('write_processed', items=len(name_lines), bytes_written=n_written, circuit=name)
+
+def process_api_dump(filename, dict_qasm_name, dict_res=None, store_folder=None, timeline=None):
+    '''process_api_dump(filename, dict_qasm_name, dict_res=None, store_folder=None, timeline=None)
+    Decodes every result of an API dump and appends it to data/Processed_data/<name>.txt,
+    or to the columnar store in store_folder when one is given, and to the timeline if given.
+    The dump is streamed and written by batches of iter_decoded_batches. The entries are also
+    collected by name into dict_res, which is returned, only when a dictionary is given.
+    '''
+    n_entries = 0
+    with proftool.stage('process_api_dump'):
+        for entries in iter_decoded_batches(filename, dict_qasm_name):
+            if dict_res is not None:
+                for res_entry in entries:
+                    dict_res.setdefault(res_entry['name'], []).append(res_entry)
+            write_processed_entries(entries, store_folder, timeline)
+            n_entries += len(entries)
+    proftool.count('process_api_dump', items=n_entries)
     return dict_res
 
-def process_all_api_dumps(file_of_files_to_process, file_of_already_processed_files, dict_qasm_name):
+# Parallel processing of the API dumps
+######################################
+_WORKER_DICT_QASM_NAME = {}
+
+def _init_dump_worker(dict_qasm_name):
+    global _WORKER_DICT_QASM_NAME
+    _WORKER_DICT_QASM_NAME = dict_qasm_name
+
+def _decode_dump_worker(filename):
+    # Spools the decoded batches of the dump to a temporary file, one pickle per batch, and
+    # returns its name: neither the worker nor the parent holds more than one batch
+    spool_fd, spool_name = tempfile.mkstemp(prefix='decoded_', suffix='.pkl')
+    try:
+        with os.fdopen(spool_fd, 'wb') as spool_file:
+            for entries in iter_decoded_batches(filename, _WORKER_DICT_QASM_NAME):
+                pickle.dump(entries, spool_file, protocol=pickle.HIGHEST_PROTOCOL)
+    except BaseException:
+        os.remove(spool_name)
+        raise
+    return spool_name
+
+def _iter_spooled_batches(spool_name):
+    # Batches of a spool file of _decode_dump_worker, the file being removed once read
+    try:
+        with open(spool_name, 'rb') as spool_file:
+            while True:
+                try:
+                    yield pickle.load(spool_file)
+                except EOFError:
+                    return
+    finally:
+        os.remove(spool_name)
+
+@proftool.profiled('process_all_api_dumps')
+def remove_processed_runs(keys, folder='data/Processed_data/'):
+    '''remove_processed_runs(keys, folder='data/Processed_data/')
+    Removes from the text Processed_data folder the entries whose (name, date) is in keys, only
+    the files of these names being rewritten. Returns the number of removed entries.
+    '''
+    n_removed = 0
+    for name in sorted(set(name for name, date in keys)):
+        filename = os.path.join(folder, name + '.txt')
+        if not os.path.isfile(filename):
+            continue
+        with open(filename, 'r') as circuit_file:
+            lines = circuit_file.readlines()
+        new_lines = []
+        for expe_data_string in lines:
+            try:
+                entry = ast.literal_eval(expe_data_string)
+            except SyntaxError:
+                new_lines.append(expe_data_string)
+                continue
+            if (entry.get('name', name), entry.get('date')) in keys:
+                n_removed += 1
+            else:
+                new_lines.append(expe_data_string)
+        if len(new_lines) != len(lines):
+            with open(filename + '.tmp', 'w') as circuit_file:
+                circuit_file.write(''.join(new_lines))
+            os.replace(filename + '.tmp', filename)
+    return n_removed
+
+def reprocess_changed(manifest, dict_qasm_name, timeline=None):
+    '''reprocess_changed(manifest, dict_qasm_name, timeline=None)
+    Processes again the dumps of the jobs marked 'changed' in the manifest (see
+    Manifest_tools.dump_needs_processing). A changed dump holds the runs of its job fetched again,
+    so the runs of data/Processed_data/ and of the timeline with the name and date of one of its
+    results are removed before its results are written. Results without date cannot be matched
+    and are left as they are. The columnar stores are append only: rebuild them instead.
+    Returns the number of reprocessed dumps.
+    '''
+    n_reprocessed = 0
+    for job_id in manifesttool.jobs_with_status(manifest, 'changed'):
+        filename = dumptool.dump_filename(job_id)
+        keys = set()
+        for entries in iter_decoded_batches(filename, dict_qasm_name):
+            keys.update((res_entry['name'], res_entry['date']) for res_entry in entries
+                        if res_entry.get('date') is not None)
+        n_removed = remove_processed_runs(keys)
+        if timeline is not None:
+            timetool.remove_runs(timeline, keys)
+        process_api_dump(filename, dict_qasm_name, timeline=timeline)
+        manifesttool.set_job_status(manifest, job_id, 'processed', filename)
+        print('Reprocessed the changed dump of', job_id, ':', n_removed, 'earlier runs replaced')
+        n_reprocessed += 1
+    return n_reprocessed
+
+def process_all_api_dumps(file_of_files_to_process, file_of_already_processed_files, dict_qasm_name,
+                          store_folder=None, n_workers=1, manifest=None, timeline=None):
+    '''process_all_api_dumps(file_of_files_to_process, file_of_already_processed_files, dict_qasm_name,
+                          store_folder=None, n_workers=1, manifest=None, timeline=None)
+    Processes every dump listed in file_of_files_to_process and not yet in file_of_already_processed_files.
+    With a manifest connection (see Manifest_tools.open_manifest), already processed, unchanged and
+    duplicate dumps are found from the manifest instead; file_of_already_processed_files may then be
+    None and file_of_files_to_process None to take every job with status 'dumped'. The changed dumps
+    of processed jobs are only marked 'changed', reprocess_changed processes them again.
+    With n_workers > 1 the dumps are read and decoded in a pool of worker processes while the parent
+    alone writes the results, so that output files only ever receive whole lines. The workers spool
+    the decoded batches to temporary files that the parent writes out batch by batch. A dump is
+    recorded as processed only once its results are written: dumps whose worker failed are reported
+    and left for the next run.
+    With a timeline connection (see Timeline_tools.open_timeline) the results are indexed by date as well.
+    '''
     n_processed = 0
-    with open(file_of_already_processed_files, 'r') as file_processed:
-        processed = file_processed.readlines()
-    with open(file_of_files_to_process, 'r') as file_to_process:
-        to_process = file_to_process.readlines()
-    with open(file_of_already_processed_files, 'a') as file_processed:
-        for filename in to_process:
-            if not filename in processed:
+    if file_of_files_to_process:
+        with open(file_of_files_to_process, 'r') as file_to_process:
+            to_process = file_to_process.readlines()
+    else:
+        to_process = [job_id + '\n' for job_id in manifesttool.jobs_with_status(manifest, 'dumped')]
+    pending_hashes = {}
+    if manifest is not None:
+        to_process = [filename for filename in dict.fromkeys(to_process)
+                      if manifesttool.dump_needs_processing(manifest, filename.rstrip(),
+                                                            dumptool.dump_filename(filename.rstrip()),
+                                                            pending_hashes)]
+    elif file_of_already_processed_files:
+        with open(file_of_already_processed_files, 'r') as file_processed:
+            processed = set(file_processed.readlines())
+        to_process = [filename for filename in dict.fromkeys(to_process) if not filename in processed]
+    file_processed = open(file_of_already_processed_files, 'a') if file_of_already_processed_files else None
+
+    dump_hashes = {job_id: dump_hash for dump_hash, job_id in pending_hashes.items()}
+
+    def mark_processed(filename):
+        if file_processed:
+            file_processed.write(filename)
+            file_processed.flush()
+        if manifest is not None:
+            manifesttool.set_job_status(manifest, filename.rstrip(), 'processed',
+                                        dumptool.dump_filename(filename.rstrip()),
+                                        dump_hash=dump_hashes.get(filename.rstrip()))
+
+    try:
+        if n_workers <= 1:
+            for filename in to_process:
+                n_processed += 1
+                process_api_dump(dumptool.dump_filename(filename.rstrip()), dict_qasm_name,
+                                 store_folder=store_folder, timeline=timeline)
+                mark_processed(filename)
+            return n_processed
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers,
+                                                    initializer=_init_dump_worker,
+                                                    initargs=(dict_qasm_name,)) as pool:
+            futures = {pool.submit(_decode_dump_worker, dumptool.dump_filename(filename.rstrip())): filename
+                       for filename in to_process}
+            for future in concurrent.futures.as_completed(futures):
+                filename = futures[future]
+                try:
+                    spool_name = future.result()
+                except Exception as worker_err:
+                    print('Failed to process', filename.rstrip(), ':', repr(worker_err))
+                    continue
+                for entries in _iter_spooled_batches(spool_name):
+                    write_processed_entries(entries, store_folder, timeline)
+                mark_processed(filename)
                 n_processed += 1
-                process_api_dump('data/API_dumps/api_dump_' + filename.rstrip() + '.txt', dict_qasm_name)
-                file_processed.write(filename)
+    finally:
+        if file_processed:
+            file_processed.close()
     return n_processed
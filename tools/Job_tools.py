@@ -0,0 +1,288 @@
+import asyncio
+import functools
+import hashlib
+import random
+import time
+
+import tools.Manifest_tools as manifesttool
+import tools.Dump_tools as dumptool
+import tools.Experiment_tools as exptool
+import tools.Qasm_index_tools as qasmindextool
+
+# Asynchronous submission and polling of the jobs
+#################################################
+# The JobManager replaces run_batch_async(..., callback=post_treatment_list) and the sequential
+# polling of fetch_previous: it submits the compiled batches and polls every outstanding job
+# concurrently, with at most max_concurrent API calls in flight and a polling interval growing
+# geometrically per job. The API dump of a job (see Dump_tools) is written as soon as it completes. The state lives
+# in the manifest (batch -> job id, job statuses), so a restarted manager given the same compiled
+# batches resubmits none that was already submitted and resumes polling the jobs that were still
+# pending, while the batches of a new compile of the suite are new jobs (more runs).
+#
+# The manager talks to the API through a client with two coroutines, run_job(qasms, backend,
+# shots, max_credits) and get_job(job_id), returning the dictionaries of the QISKit API.
+# ThreadedApiClient wraps the blocking API of QISKit; any object with these coroutines (a stand-in
+# server for tests or load tests, an HTTP client...) can be used instead.
+
+PENDING_STATUSES = ['submitted', 'timed_out', 'completed']
+FAILED_API_STATUSES = ['ERROR_CREATING_JOB', 'ERROR_RUNNING_JOB', 'ERROR', 'CANCELLED']
+
+
+class ThreadedApiClient:
+    '''Asynchronous client over a blocking API object (the one of QuantumProgram.get_api()),
+    every call running in a thread of executor (the default executor of the loop if None).
+    '''
+    def __init__(self, api, executor=None):
+        self.api = api
+        self.executor = executor
+
+    async def run_job(self, qasms, backend, shots, max_credits):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(
+            self.api.run_job, qasms, backend, shots=shots, max_credits=max_credits))
+
+    async def get_job(self, job_id):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.api.get_job, job_id)
+
+
+def batch_qasms(qobj):
+    '''batch_qasms(qobj)
+    List of {'qasm': compiled qasm} of a compiled batch, as sent to the API.
+    '''
+    return [{'qasm': circuit['compiled_circuit_qasm']} for circuit in qobj['circuits']]
+
+def batch_hash(qobj):
+    '''batch_hash(qobj)
+    SHA-256 identifying a compiled batch: its id (unique per compile, see schedule_batches), backend,
+    shots and compiled circuits. Compiling the same circuits again gives new batches, which are
+    submitted again to gather more runs.
+    '''
+    digest = hashlib.sha256()
+    digest.update(repr((qobj['id'], qobj['config']['backend'], qobj['config']['shots'])).encode())
+    for qasm in batch_qasms(qobj):
+        digest.update(qasm['qasm'].encode())
+    return digest.hexdigest()
+
+
+# Deduplicated, interleaved batches
+###################################
+# Several circuit names compile to the same qasm (e.g. bare circuits whose gates cancel out), so
+# the suite is compiled once, every distinct compiled qasm is submitted once, and the result of
+# that experiment is given to all its names when the dumps are processed: the dictionary of
+# get_qasm_name_dict holds every alias of a qasm and iter_decoded_batches decodes a result once
+# per name. The distinct experiments of a circuit of CIRCUITS (its bare version on every pair and
+# its encoded versions) are kept in the same batch and alternate bare/encoded in it, so that they
+# run within minutes of each other and see the same drift of the device.
+
+def experiment_groups(dict_qasm_name):
+    '''experiment_groups(dict_qasm_name)
+    Groups the distinct qasms of dict_qasm_name by the circuit of CIRCUITS of their first name.
+    Returns the list of (bare qasms, encoded qasms) of every circuit.
+    '''
+    groups = {}
+    for qasm, names in dict_qasm_name.items():
+        record = exptool.circuit_record(names[0])
+        group = groups.setdefault(record.circuit, ([], []))
+        group[0 if record.version == 'bare' else 1].append(qasm)
+    return [groups[key] for key in sorted(groups)]
+
+def interleave(bare_qasms, encoded_qasms, rng):
+    '''interleave(bare_qasms, encoded_qasms, rng)
+    Shuffles both lists and merges them alternating bare and encoded experiments, the extra
+    experiments of the longer list being spread evenly between the others.
+    '''
+    bare_qasms = rng.sample(bare_qasms, len(bare_qasms))
+    encoded_qasms = rng.sample(encoded_qasms, len(encoded_qasms))
+    positions = [(k + .5)/len(bare_qasms) for k in range(len(bare_qasms))]
+    positions += [(k + .5)/len(encoded_qasms) for k in range(len(encoded_qasms))]
+    return [qasm for _, qasm in sorted(zip(positions, bare_qasms + encoded_qasms), key=lambda pair: pair[0])]
+
+def pack_batches(groups, max_experiments, rng):
+    '''pack_batches(groups, max_experiments, rng)
+    Packs the interleaved groups (lists of qasms) into batches of at most max_experiments, first fit
+    by decreasing size with ties in random order, a group larger than a batch being split.
+    '''
+    batches = []
+    for group in sorted(rng.sample(groups, len(groups)), key=len, reverse=True):
+        for first in range(0, len(group), max_experiments):
+            chunk = group[first:first+max_experiments]
+            for batch in batches:
+                if len(batch) + len(chunk) <= max_experiments:
+                    batch.extend(chunk)
+                    break
+            else:
+                batches.append(list(chunk))
+    return rng.sample(batches, len(batches))
+
+def schedule_batches(quantump, circuit_names, backend='ibmqx4', shots=8192, max_credits=5,
+                     max_experiments=50, seed=None, qasm_index=None, **compile_kwargs):
+    '''schedule_batches(quantump, circuit_names, backend='ibmqx4', shots=8192, max_credits=5,
+                     max_experiments=50, seed=None, qasm_index=None, **compile_kwargs)
+    Compiles circuit_names once, keeps one experiment per distinct compiled qasm and packs them
+    into compiled batches of at most max_experiments (the limit of the backend per job), every
+    circuit having its bare and encoded experiments interleaved in one batch. Returns the list of
+    batches (for run_batches) and the dictionary qasm -> all the names it stands for (for
+    process_all_api_dumps, to be saved with save_qasm_name_dict). With a qasm_index connection (see
+    Qasm_index_tools.open_qasm_index) every name is also appended to the persistent index.
+    '''
+    rng = random.Random(seed)
+    qobj = quantump.compile(circuit_names, backend=backend, shots=shots, max_credits=max_credits, **compile_kwargs)
+    dict_qasm_name = exptool.get_qasm_name_dict([qobj])
+    if qasm_index is not None:
+        qasmindextool.add_compiled_qobjs(qasm_index, [qobj])
+    representatives = {}
+    for circuit in qobj['circuits']:
+        representatives.setdefault(circuit['compiled_circuit_qasm'], circuit)
+    groups = [interleave(bare_qasms, encoded_qasms, rng) for bare_qasms, encoded_qasms in experiment_groups(dict_qasm_name)]
+    compiled_qobj_list = []
+    for k, batch in enumerate(pack_batches(groups, max_experiments, rng)):
+        compiled_qobj_list.append({'id': '{}_{}'.format(qobj['id'], k),
+                                   'config': dict(qobj['config']),
+                                   'circuits': [representatives[qasm] for qasm in batch]})
+    print('{} circuits, {} distinct experiments in {} batches'.format(len(qobj['circuits']), len(representatives),
+                                                                      len(compiled_qobj_list)))
+    return compiled_qobj_list, dict_qasm_name
+
+
+class JobManager:
+    '''Submits compiled batches and polls their jobs concurrently, see run and resume.
+    manifest is an open_manifest connection, only used from the thread running the event loop.
+    Polling starts every poll_interval seconds and is multiplied by backoff after every poll up to
+    max_poll_interval. A job still pending after timeout seconds (no limit if None) is marked
+    'timed_out' and left for a later resume.
+    '''
+    def __init__(self, client, manifest, dump_folder='data/API_dumps/', max_concurrent=5,
+                 poll_interval=2., max_poll_interval=60., backoff=1.5, timeout=None,
+                 log_filename='data/callback.log'):
+        self.client = client
+        self.manifest = manifest
+        self.dump_folder = dump_folder
+        self.max_concurrent = max_concurrent
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.backoff = backoff
+        self.timeout = timeout
+        self.log_filename = log_filename
+        self._semaphore = None
+        self._waits = {}
+
+    def _log(self, message):
+        if self.log_filename:
+            with open(self.log_filename, 'a') as logfile:
+                logfile.write(str(time.asctime(time.localtime(time.time())))+':'+message+'\n')
+
+    async def _call(self, coroutine_function, *args):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        async with self._semaphore:
+            return await coroutine_function(*args)
+
+    async def submit(self, qobj):
+        '''submit(qobj)
+        Submits a compiled batch unless the manifest knows it already (the same batch of the same
+        compile, see batch_hash). Returns its job id, or None if the API refused it.
+        '''
+        key = batch_hash(qobj)
+        job_id = manifesttool.get_batch_job(self.manifest, key)
+        if job_id is not None:
+            return job_id
+        try:
+            output = await self._call(self.client.run_job, batch_qasms(qobj), qobj['config']['backend'],
+                                      qobj['config']['shots'], qobj['config']['max_credits'])
+        except Exception as api_err:
+            self._log('submission failed - ' + repr(api_err))
+            return None
+        if 'error' in output or not 'id' in output:
+            self._log('submission refused - ' + str(output.get('error', output)))
+            return None
+        manifesttool.record_batch(self.manifest, key, output['id'])
+        self._log('SUBMITTED - id: ' + output['id'])
+        return output['id']
+
+    async def _write_dump(self, job_id, job_result):
+        filename = dumptool.dump_filename(job_id, self.dump_folder)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, dumptool.write_dump, filename, job_result)
+        manifesttool.set_job_status(self.manifest, job_id, 'dumped', filename)
+
+    async def wait(self, job_id):
+        '''wait(job_id)
+        Polls job_id until it completes (its dump is then written), fails or times out and returns
+        its final manifest status. A job which is not pending in the manifest is not polled, and
+        concurrent waits on the same job share one polling loop.
+        '''
+        row = manifesttool.get_job(self.manifest, job_id)
+        if row is not None and not row['status'] in PENDING_STATUSES:
+            return row['status']
+        if not job_id in self._waits:
+            self._waits[job_id] = asyncio.ensure_future(self._poll(job_id))
+        return await self._waits[job_id]
+
+    async def _poll(self, job_id):
+        start = time.monotonic()
+        delay = self.poll_interval
+        while True:
+            try:
+                job_result = await self._call(self.client.get_job, job_id)
+                status = job_result.get('status')
+            except Exception as api_err:
+                self._log('polling failed - id: ' + job_id + ' - ' + repr(api_err))
+                status = None
+            if status == 'COMPLETED':
+                await self._write_dump(job_id, job_result)
+                self._log(status + ' - id: ' + job_id)
+                return 'dumped'
+            if status in FAILED_API_STATUSES:
+                manifesttool.set_job_status(self.manifest, job_id, 'failed')
+                self._log(status + ' - id: ' + job_id)
+                return 'failed'
+            if self.timeout is not None and time.monotonic() - start + delay > self.timeout:
+                manifesttool.set_job_status(self.manifest, job_id, 'timed_out')
+                self._log('Time Out - id: ' + job_id)
+                return 'timed_out'
+            await asyncio.sleep(delay)
+            delay = min(delay*self.backoff, self.max_poll_interval)
+
+    async def _submit_and_wait(self, qobj):
+        job_id = await self.submit(qobj)
+        if job_id is None:
+            return None, None
+        return job_id, await self.wait(job_id)
+
+    async def run(self, compiled_qobj_list, resume=True):
+        '''run(compiled_qobj_list, resume=True)
+        Submits the batches and waits for all their jobs, and for the pending jobs of the manifest
+        if resume. Returns {job_id: final status}. The pending jobs are polled from the start,
+        concurrently with the submissions, so that the ones already finished are dumped at once;
+        a batch resolving to one of them shares its polling loop (see wait).
+        '''
+        to_resume = manifesttool.jobs_with_statuses(self.manifest, PENDING_STATUSES) if resume else []
+        results = await asyncio.gather(*([self._submit_and_wait(qobj) for qobj in compiled_qobj_list]
+                                          + [self.wait(job_id) for job_id in to_resume]))
+        batch_jobs = dict(zip(to_resume, results[len(compiled_qobj_list):]))
+        batch_jobs.update(pair for pair in results[:len(compiled_qobj_list)] if pair[0] is not None)
+        return batch_jobs
+
+    async def resume(self):
+        '''resume()
+        Waits for every pending job of the manifest. Returns {job_id: final status}.
+        '''
+        return await self.run([], resume=True)
+
+
+def run_batches(client, manifest, compiled_qobj_list, **kwargs):
+    '''run_batches(client, manifest, compiled_qobj_list, **kwargs)
+    Blocking entry point: runs a JobManager(client, manifest, **kwargs) over the batches and the
+    pending jobs of the manifest. client may be a raw QISKit API, it is then wrapped in a
+    ThreadedApiClient.
+    '''
+    if not asyncio.iscoroutinefunction(getattr(client, 'get_job', None)):
+        client = ThreadedApiClient(client)
+    return asyncio.run(JobManager(client, manifest, **kwargs).run(compiled_qobj_list))
+
+def resume_jobs(client, manifest, **kwargs):
+    '''resume_jobs(client, manifest, **kwargs)
+    Blocking entry point polling the pending jobs of the manifest, as fetch_pending but concurrently.
+    '''
+    return run_batches(client, manifest, [], **kwargs)
@@ -0,0 +1,171 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+# Persistent manifest of the jobs and of their API dumps
+########################################################
+# One row per job id with its status, the hash, size and modification time of its dump
+# and the time it was last processed. It replaces the scans of the text id lists
+# (timed_out.txt, completed.txt, already_processed.txt) by indexed lookups. The batches table
+# records the job id every submitted batch got, so that an interrupted submission resumes.
+# A dump that changed after its job was processed is not processed again as a new dump (its first
+# results would be counted twice): the job is marked 'changed' and reported, and
+# Experiment_tools.reprocess_changed replaces its earlier runs by the ones of the new dump.
+
+MANIFEST_FILENAME = 'data/manifest.sqlite'
+JOB_STATUSES = ['submitted', 'timed_out', 'completed', 'failed', 'dumped', 'processed', 'duplicate', 'changed']
+
+
+def open_manifest(filename=MANIFEST_FILENAME):
+    '''open_manifest(filename=MANIFEST_FILENAME)
+    Opens (and creates if needed) the manifest database, returns the sqlite3 connection.
+    '''
+    conn = sqlite3.connect(filename)
+    conn.row_factory = sqlite3.Row
+    conn.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                 'job_id TEXT PRIMARY KEY, '
+                 'status TEXT NOT NULL, '
+                 'dump_hash TEXT, '
+                 'dump_size INTEGER, '
+                 'dump_mtime_ns INTEGER, '
+                 'processed_at REAL, '
+                 'updated_at REAL)')
+    conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)')
+    conn.execute('CREATE INDEX IF NOT EXISTS jobs_dump_hash ON jobs (dump_hash)')
+    conn.execute('CREATE TABLE IF NOT EXISTS batches ('
+                 'batch_hash TEXT PRIMARY KEY, '
+                 'job_id TEXT NOT NULL, '
+                 'submitted_at REAL)')
+    conn.commit()
+    return conn
+
+def file_hash(filename, block_size=1 << 20):
+    '''file_hash(filename, block_size=1 << 20)
+    SHA-256 of the content of filename, read by blocks.
+    '''
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as hashed_file:
+        for block in iter(lambda: hashed_file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def get_job(conn, job_id):
+    '''get_job(conn, job_id)
+    Returns the manifest row of job_id as a dictionary, or None if the job is unknown.
+    '''
+    row = conn.execute('SELECT * FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+    if row is None:
+        return None
+    return dict(row)
+
+def jobs_with_status(conn, status):
+    '''jobs_with_status(conn, status)
+    Returns the ids of the jobs currently having the given status.
+    '''
+    return [row['job_id'] for row in conn.execute('SELECT job_id FROM jobs WHERE status = ? ORDER BY job_id', (status,))]
+
+def jobs_with_statuses(conn, statuses):
+    '''jobs_with_statuses(conn, statuses)
+    Returns the ids of the jobs currently having one of the given statuses.
+    '''
+    return [row['job_id'] for row in conn.execute('SELECT job_id FROM jobs WHERE status IN ({}) ORDER BY job_id'
+                                                  .format(', '.join('?'*len(statuses))), list(statuses))]
+
+def set_job_status(conn, job_id, status, dump_filename=None, commit=True, dump_hash=None):
+    '''set_job_status(conn, job_id, status, dump_filename=None, commit=True, dump_hash=None)
+    Records the status of job_id. When dump_filename is given the hash, size and modification
+    time of the dump are recorded too, dump_hash being its hash when already known.
+    Setting 'processed' also records the processing time.
+    '''
+    if not status in JOB_STATUSES:
+        raise ValueError('Unknown job status: ' + str(status))
+    now = time.time()
+    conn.execute('INSERT INTO jobs (job_id, status, updated_at) VALUES (?, ?, ?) '
+                 'ON CONFLICT(job_id) DO UPDATE SET status = excluded.status, updated_at = excluded.updated_at',
+                 (job_id, status, now))
+    if dump_filename:
+        dump_stat = os.stat(dump_filename)
+        conn.execute('UPDATE jobs SET dump_hash = ?, dump_size = ?, dump_mtime_ns = ? WHERE job_id = ?',
+                     (dump_hash or file_hash(dump_filename), dump_stat.st_size, dump_stat.st_mtime_ns, job_id))
+    if status == 'processed':
+        conn.execute('UPDATE jobs SET processed_at = ? WHERE job_id = ?', (now, job_id))
+    if commit:
+        conn.commit()
+
+def import_id_file(conn, filename, status):
+    '''import_id_file(conn, filename, status)
+    Imports a legacy text list of job ids (one per line) with the given status.
+    Jobs already known with a more advanced status are left untouched. Returns the number imported.
+    '''
+    n_imported = 0
+    with open(filename, 'r') as ids_file:
+        for id_line in ids_file:
+            job_id = id_line.rstrip()
+            if not job_id:
+                continue
+            row = get_job(conn, job_id)
+            if row is None or JOB_STATUSES.index(row['status']) < JOB_STATUSES.index(status):
+                set_job_status(conn, job_id, status, commit=False)
+                n_imported += 1
+    conn.commit()
+    return n_imported
+
+def dump_needs_processing(conn, job_id, dump_filename, pending_hashes=None):
+    '''dump_needs_processing(conn, job_id, dump_filename, pending_hashes=None)
+    Tells whether the dump of job_id is new and has to be processed. Unchanged size and
+    modification time skip the hashing. A dump whose hash was already processed under another job
+    id, or is in the dictionary pending_hashes {hash: job id} of the dumps selected in the same
+    run, is marked 'duplicate' and skipped. The dump of a processed job whose content changed is
+    not processed as a new one, since its earlier results are already written: the job is marked
+    'changed' and the mismatch reported (see Experiment_tools.reprocess_changed). The hash of a
+    selected dump is added to pending_hashes, so that it is recorded without hashing it again.
+    '''
+    row = get_job(conn, job_id)
+    dump_stat = os.stat(dump_filename)
+    if (row is not None and row['status'] in ['processed', 'duplicate', 'changed']
+            and row['dump_size'] == dump_stat.st_size and row['dump_mtime_ns'] == dump_stat.st_mtime_ns):
+        return False
+    dump_hash = file_hash(dump_filename)
+    if row is not None and row['status'] in ['processed', 'duplicate', 'changed'] and row['dump_hash'] == dump_hash:
+        return False
+    if row is not None and row['status'] in ['processed', 'changed']:
+        print('Dump of the processed job', job_id, 'changed (hash', str(row['dump_hash']), '->', dump_hash + '),',
+              'marked to be processed again by reprocess_changed')
+        set_job_status(conn, job_id, 'changed', dump_filename, dump_hash=dump_hash)
+        return False
+    duplicate = conn.execute('SELECT job_id FROM jobs WHERE dump_hash = ? AND status = ? AND job_id != ?',
+                             (dump_hash, 'processed', job_id)).fetchone()
+    if duplicate is not None or (pending_hashes is not None and dump_hash in pending_hashes):
+        set_job_status(conn, job_id, 'duplicate', dump_filename, dump_hash=dump_hash)
+        return False
+    if pending_hashes is not None:
+        pending_hashes[dump_hash] = job_id
+    return True
+
+def get_batch_job(conn, batch_hash):
+    '''get_batch_job(conn, batch_hash)
+    Returns the id of the job the batch of hash batch_hash was submitted as, or None.
+    '''
+    row = conn.execute('SELECT job_id FROM batches WHERE batch_hash = ?', (batch_hash,)).fetchone()
+    if row is None:
+        return None
+    return row['job_id']
+
+def record_batch(conn, batch_hash, job_id):
+    '''record_batch(conn, batch_hash, job_id)
+    Records the submission of the batch of hash batch_hash as job_id, with status 'submitted'.
+    '''
+    conn.execute('INSERT OR REPLACE INTO batches (batch_hash, job_id, submitted_at) VALUES (?, ?, ?)',
+                 (batch_hash, job_id, time.time()))
+    set_job_status(conn, job_id, 'submitted')
+
+def reset_processed(conn):
+    '''reset_processed(conn)
+    Sets back every 'processed', 'duplicate' or 'changed' job to 'dumped', so that all the dumps are
+    processed again (after the processed data was cleared). Returns the number of reset jobs.
+    '''
+    cursor = conn.execute('UPDATE jobs SET status = ?, processed_at = NULL, updated_at = ? WHERE status IN (?, ?, ?)',
+                          ('dumped', time.time(), 'processed', 'duplicate', 'changed'))
+    conn.commit()
+    return cursor.rowcount
@@ -0,0 +1,281 @@
+import heapq
+import math
+from collections import Counter
+
+import tools.Experiment_tools as exptool
+import tools.Simulation_tools as simtool
+from tools.Noise_tools import noise_parameters
+
+# Calibration-aware placement of the circuits on a device
+#########################################################
+# The circuits of all_circuits are written on the template qubits 0 to 4 (the qubits of ibmqx4).
+# A placement is the list of the device qubit of every template qubit: all_circuits(quantump,
+# pairs, placement=placement) builds the same circuits on the device qubits placement[q], with
+# the template names and decoding. A placement is valid when every CX of the suite acts on a pair
+# of the coupling map, in either direction (a reversed CX costs four more single qubit gates).
+# Its score is the expected number of errors of one run of every circuit of the suite:
+#   sum of n_single[q] gate_error[p[q]] + n_cx[a, b] cx_cost[p[a], p[b]] + n_measure[q] readout_error[p[q]]
+# with the gate counts of the template suite and the error rates of a calibration snapshot. A CX
+# without gateError in the snapshot is unavailable, and a qubit it does not calibrate costs
+# math.inf per gate or measurement, so that the uncalibrated (often broken) parts are never used.
+# Only the encoded circuits are placed this way. The search is a branch and bound over their
+# template qubits, by decreasing number of CX partners, pruned by the coupling map and by a lower
+# bound of the cost of the qubits left to place. The bare circuits of a template pair only use
+# that pair, so they are not tied to the encoded placement: every template pair gets an edge of
+# the coupling map of its own (all_circuits(..., bare_pairs=...)), the edges being scored with
+# the same formula on the gate counts of the bare circuits and the cheapest distinct ones chosen.
+#
+# The encoded circuits still need the union of the CX graphs of their preparations on the
+# device. On the ladder of ibmqx5 (no triangle, at most three partners per qubit) ftv2 (triangle
+# of the qubits 0, 1 and 2) and ftv1 (four CX partners of the qubit 2) have no placement, nor
+# nftv1, |0+> and |00>+|11> together (triangle of the qubits 2, 3 and 4); nftv1 with |00>+|11>,
+# or |0+> alone, place there in milliseconds with all the bare pairs.
+
+
+# Gate counts of the template suite
+###################################
+def circuit_operations(qasm):
+    '''circuit_operations(qasm)
+    Gate counts of a circuit: Counter of the physical single qubit gates per qubit (a run of
+    single qubit gates on a qubit is one u gate after compilation, a run of z and s only is a
+    free frame change), Counter of the CX per (control, target) and Counter of the measurements
+    per qubit.
+    '''
+    n_qubits, n_clbits, ops, measurements = simtool.parse_qasm(qasm)
+    single = Counter()
+    cx = Counter()
+    pending = {}
+
+    def flush(q):
+        if pending.pop(q, False):
+            single[q] += 1
+
+    for op in ops:
+        if op[0] == 'cx':
+            flush(op[1])
+            flush(op[2])
+            cx[op[1:]] += 1
+        else:
+            pending[op[1]] = pending.get(op[1], False) or op[0] not in ['z', 's']
+    for q in list(pending):
+        flush(q)
+    return single, cx, Counter(qubit for qubit, clbit in measurements)
+
+def suite_operations(quantump, circuit_names):
+    '''suite_operations(quantump, circuit_names)
+    Sums of the gate counts of circuit_operations over the named template circuits of quantump,
+    as {'single': Counter, 'cx': Counter, 'measure': Counter}.
+    '''
+    counts = {'single': Counter(), 'cx': Counter(), 'measure': Counter()}
+    for name in circuit_names:
+        single, cx, measure = circuit_operations(quantump.get_qasm(name))
+        counts['single'].update(single)
+        counts['cx'].update(cx)
+        counts['measure'].update(measure)
+    return counts
+
+def split_suite_operations(quantump, circuit_names):
+    '''split_suite_operations(quantump, circuit_names)
+    Gate counts (as suite_operations) of the named encoded circuits, and {template pair: counts}
+    of the named bare circuits of every pair, restricted to the two qubits of the pair (placed on
+    an edge of their own, only the pair is measured).
+    '''
+    encoded_names = []
+    bare_names = {}
+    for name in circuit_names:
+        record = exptool.circuit_record(name)
+        if record.version == 'encoded':
+            encoded_names.append(name)
+        else:
+            bare_names.setdefault(record.pair, []).append(name)
+    pair_counts = {}
+    for pair, names in bare_names.items():
+        counts = suite_operations(quantump, names)
+        pair_counts[pair] = {'single': Counter({q: counts['single'][q] for q in pair}),
+                             'cx': Counter({cx: n for cx, n in counts['cx'].items() if set(cx) <= set(pair)}),
+                             'measure': Counter({q: counts['measure'][q] for q in pair})}
+    return suite_operations(quantump, encoded_names), pair_counts
+
+
+# Per-gate costs of a calibration
+#################################
+def gate_costs(coupling_map, calibration):
+    '''gate_costs(coupling_map, calibration)
+    Error costs of the device: per qubit 'single' (gate error) and 'readout' (readout error),
+    math.inf for the qubits the calibration does not give, and 'cx' indexed by (control, target)
+    for both orders of every pair of the coupling map with a calibrated CX error, the order against
+    the coupling map paying the four Hadamard gates of the reversal.
+    '''
+    params = noise_parameters(calibration)
+    n_qubits = max([len(params['gate_error'])] + [max(pair) + 1 for pair in coupling_map])
+    single = [math.inf]*n_qubits
+    readout = [math.inf]*n_qubits
+    for q in params['qubits']:
+        single[q] = params['gate_error'][q]
+        readout[q] = params['readout_error'][q]
+    cx = {}
+    for a, b in coupling_map:
+        if not (a, b) in params['cx_error'] or math.isinf(single[a]) or math.isinf(single[b]):
+            continue
+        error = params['cx_error'][(a, b)]
+        cx[(a, b)] = min(error, cx.get((a, b), error))
+        reversed_cost = error + 2*single[a] + 2*single[b]
+        cx[(b, a)] = min(reversed_cost, cx.get((b, a), reversed_cost))
+    return {'n_qubits': n_qubits, 'single': single, 'readout': readout, 'cx': cx}
+
+
+# Choice of the bare pairs
+##########################
+def pair_score(counts, pair, device_pair, costs):
+    '''pair_score(counts, pair, device_pair, costs)
+    Expected number of errors of the bare circuits of counts on the template pair when run on
+    device_pair (in the order of pair) with the costs of gate_costs, None if a CX is not available
+    or a used qubit is not calibrated.
+    '''
+    place = dict(zip(pair, device_pair))
+    score = sum(n*costs['single'][place[q]] for q, n in counts['single'].items() if n)
+    score += sum(n*costs['readout'][place[q]] for q, n in counts['measure'].items() if n)
+    if math.isinf(score):
+        return None
+    for (a, b), n in counts['cx'].items():
+        if n:
+            if (place[a], place[b]) not in costs['cx']:
+                return None
+            score += n*costs['cx'][(place[a], place[b])]
+    return score
+
+def choose_bare_pairs(pair_counts, costs):
+    '''choose_bare_pairs(pair_counts, costs)
+    Device pair of every template pair of pair_counts (from split_suite_operations): distinct
+    edges of the coupling map of costs, in either order, taken greedily by increasing pair_score
+    (the cheapest edges when every pair runs the same circuits, as with all_circuits). Returns
+    ({template pair: device pair}, total score), or (None, None) if there are too few edges.
+    '''
+    edges = sorted(set(tuple(sorted(cx)) for cx in costs['cx']))
+    candidates = []
+    for pair, counts in pair_counts.items():
+        for edge in edges:
+            for device_pair in [edge, edge[::-1]]:
+                score = pair_score(counts, pair, device_pair, costs)
+                if score is not None:
+                    candidates.append((score, pair, device_pair))
+    chosen = {}
+    used = set()
+    total = 0.
+    for score, pair, device_pair in sorted(candidates):
+        edge = tuple(sorted(device_pair))
+        if pair not in chosen and edge not in used:
+            chosen[pair] = list(device_pair)
+            used.add(edge)
+            total += score
+    if len(chosen) < len(pair_counts):
+        return None, None
+    return chosen, total
+
+
+# Branch and bound search
+#########################
+def search_placements(counts, coupling_map, calibration, top=1, mapping=exptool.MAPPING, pair_counts=None):
+    '''search_placements(counts, coupling_map, calibration, top=1, mapping=exptool.MAPPING, pair_counts=None)
+    The top valid placements of the encoded template circuits of counts (from split_suite_operations)
+    on the device of coupling_map, with the lowest scores under the error rates of the calibration
+    snapshot, best first, as dictionaries {'placement', 'score', 'mapping', 'bare_pairs',
+    'bare_score'}: 'mapping' holds the device qubits of the template mapping and 'bare_pairs' the
+    device pairs chosen independently for the bare circuits of pair_counts (see choose_bare_pairs,
+    {} without pair_counts), their 'bare_score' being included in 'score'.
+    An empty list if the suite has no placement on the device.
+    '''
+    costs = gate_costs(coupling_map, calibration)
+    bare_pairs, bare_score = choose_bare_pairs(pair_counts or {}, costs)
+    if bare_pairs is None:
+        return []
+    device_qubits = range(costs['n_qubits'])
+    template_qubits = sorted(set(counts['single']) | set(counts['measure'])
+                             | set(q for pair in counts['cx'] for q in pair))
+    if template_qubits != list(range(len(template_qubits))):
+        raise ValueError('The template qubits are not 0 to ' + str(len(template_qubits) - 1))
+    neighbours = {q: Counter() for q in template_qubits}
+    for (a, b), n in counts['cx'].items():
+        neighbours[a][b] += 1
+        neighbours[b][a] += 1
+    # Most connected qubits first, then each qubit connected to the already placed ones
+    order = []
+    left = set(template_qubits)
+    while left:
+        q = max(sorted(left), key=lambda q: (sum(1 for r in neighbours[q] if r in order), len(neighbours[q])))
+        order.append(q)
+        left.discard(q)
+    local_cost = {q: [(counts['single'][q]*costs['single'][d] if counts['single'][q] else 0.)
+                      + (counts['measure'][q]*costs['readout'][d] if counts['measure'][q] else 0.)
+                      for d in device_qubits] for q in template_qubits}
+    min_cx = min(costs['cx'].values()) if costs['cx'] else 0.
+    # Lower bound of the CX cost of every template qubit with the ones placed after it
+    later_cx = [0.]*(len(order) + 1)
+    for k in range(len(order) - 1, -1, -1):
+        later = order[k+1:]
+        later_cx[k] = later_cx[k+1] + min_cx*sum(counts['cx'][(order[k], r)] + counts['cx'][(r, order[k])]
+                                                 for r in later)
+    best = []
+    placement = {}
+    used = set()
+
+    def bound(k):
+        return later_cx[k] + sum(min(local_cost[q][d] for d in device_qubits if d not in used)
+                                 for q in order[k:])
+
+    def placement_step(q, d):
+        # Cost of placing q on d, None if d is not calibrated or a CX with a placed qubit is not available
+        step = local_cost[q][d]
+        if math.isinf(step):
+            return None
+        for r in neighbours[q]:
+            if r in placement:
+                for pair, device_pair in [((q, r), (d, placement[r])), ((r, q), (placement[r], d))]:
+                    if counts['cx'][pair]:
+                        if device_pair not in costs['cx']:
+                            return None
+                        step += counts['cx'][pair]*costs['cx'][device_pair]
+        return step
+
+    def explore(k, score):
+        if len(best) == top and score + bound(k) >= -best[0][0]:
+            return
+        if k == len(order):
+            entry = (-score, [placement[q] for q in template_qubits])
+            if len(best) < top:
+                heapq.heappush(best, entry)
+            else:
+                heapq.heapreplace(best, entry)
+            return
+        q = order[k]
+        candidates = []
+        for d in device_qubits:
+            if d not in used:
+                step = placement_step(q, d)
+                if step is not None:
+                    candidates.append((step, d))
+        for step, d in sorted(candidates):
+            placement[q] = d
+            used.add(d)
+            explore(k + 1, score + step)
+            used.discard(d)
+            del placement[q]
+
+    explore(0, 0.)
+    results = []
+    for neg_score, device in sorted(best, reverse=True):
+        results.append({'placement': device or None, 'score': bare_score - neg_score,
+                        'mapping': [device[q] for q in mapping] if device else None,
+                        'bare_pairs': bare_pairs, 'bare_score': bare_score})
+    return results
+
+def best_placement(quantump, circuit_names, coupling_map, calibration, mapping=exptool.MAPPING):
+    '''best_placement(quantump, circuit_names, coupling_map, calibration, mapping=exptool.MAPPING)
+    Best placement (see search_placements) of the named template circuits of quantump (built by
+    all_circuits without placement) on the device of coupling_map, None if there is none. Build the
+    placed suite with all_circuits(quantump, pairs, placement=best['placement'],
+    bare_pairs=best['bare_pairs']).
+    '''
+    counts, pair_counts = split_suite_operations(quantump, circuit_names)
+    results = search_placements(counts, coupling_map, calibration, mapping=mapping, pair_counts=pair_counts)
+    return results[0] if results else None
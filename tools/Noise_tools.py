@@ -0,0 +1,255 @@
+import concurrent.futures
+import math
+import numpy as np
+
+import tools.Experiment_tools as exptool
+import tools.Simulation_tools as simtool
+import tools.Calibration_tools as calibtool
+from tools.Analysis_tools import ProcessedAggregate, convert_parameter
+
+# Pauli-frame Monte-Carlo simulation of the noisy experiment suite
+##################################################################
+# Pauli errors commute through the Clifford circuits up to a change of Pauli, so a noisy shot is
+# the ideal shot of simulate_job with its measured bits flipped by the X part of the error frame
+# accumulated until the measurements. Every shot keeps its frame as two bit-packed uint64 words
+# (X part and Z part, bit j is qubit j) and the frames of all the shots of a chunk are propagated
+# together gate by gate with NumPy bit operations. The noise is depolarizing after the gates, a
+# Pauli-twirled T1/T2 channel on the idling qubits and bit flips on the readout, with the
+# parameters of a device calibration snapshot.
+
+# Gate durations used when the calibration does not give them
+SINGLE_GATE_TIME = 100e-9
+CX_GATE_TIME = 300e-9
+
+
+# Noise parameters from a calibration snapshot
+##############################################
+def calibration_snapshots(folder):
+    '''calibration_snapshots(folder)
+    Distinct calibrations of a processed data folder (text or columnar store), sorted by
+    'lastUpdateDate' when the calibrations have one.
+    '''
+    return sorted(calibtool.calibration_table(folder),
+                  key=lambda calibration: str(calibration.get('lastUpdateDate', '')))
+
+def _qubit_index(param, position):
+    name = str(param.get('name', ''))
+    if name[1:].isdigit():
+        return int(name[1:])
+    return position
+
+def noise_parameters(calibration, single_gate_time=None, cx_gate_time=None):
+    '''noise_parameters(calibration, single_gate_time=None, cx_gate_time=None)
+    Noise model of a calibration snapshot: per qubit 'gate_error', 'readout_error', 'T1' and 'T2'
+    (in seconds), 'cx_error' indexed by the pair of qubits (in both orders), the gate durations and
+    the sorted list of the calibrated 'qubits' (the others keeping zero errors).
+    The single qubit gate time is the 'gateTime' of the calibration when it has one.
+    '''
+    qubits = calibration['qubits']
+    n_qubits = max(_qubit_index(param, k) for k, param in enumerate(qubits)) + 1
+    params = {'gate_error': [0.]*n_qubits, 'readout_error': [0.]*n_qubits,
+              'T1': [math.inf]*n_qubits, 'T2': [math.inf]*n_qubits, 'cx_error': {},
+              'qubits': sorted(_qubit_index(param, k) for k, param in enumerate(qubits))}
+    gate_times = []
+    for k, param in enumerate(qubits):
+        q = _qubit_index(param, k)
+        params['gate_error'][q] = convert_parameter(param['gateError'])
+        params['readout_error'][q] = convert_parameter(param['readoutError'])
+        params['T1'][q] = convert_parameter(param['T1'])
+        params['T2'][q] = convert_parameter(param['T2'])
+        if 'gateTime' in param:
+            gate_times.append(convert_parameter(param['gateTime']))
+    for param in calibration.get('multiQubitGates', []):
+        a, b = param['qubits']
+        params['cx_error'][(a, b)] = convert_parameter(param['gateError'])
+        params['cx_error'].setdefault((b, a), params['cx_error'][(a, b)])
+    if single_gate_time is None:
+        single_gate_time = max(gate_times) if gate_times else SINGLE_GATE_TIME
+    params['single_gate_time'] = single_gate_time
+    params['cx_gate_time'] = CX_GATE_TIME if cx_gate_time is None else cx_gate_time
+    return params
+
+def idle_probabilities(duration, T1, T2):
+    '''idle_probabilities(duration, T1, T2)
+    Probabilities of X, Y and Z of the Pauli twirl of amplitude and phase damping over duration.
+    '''
+    px = (1 - math.exp(-duration/T1))/4
+    pz = max((1 - math.exp(-duration/T2))/2 - px, 0.)
+    return px, px, pz
+
+
+# Noisy schedule of a circuit
+#############################
+def noisy_schedule(ops, measurements, params):
+    '''noisy_schedule(ops, measurements, params)
+    Interleaves the gates of parse_qasm with the noise steps of params (from noise_parameters):
+    ('dep1', q, p) after every single qubit gate, ('dep2', a, b, p) after every CX,
+    ('idle', q, px, py, pz) while a qubit waits for its CX partner or for the measurements, and
+    ('readout', q, p) on the measured qubits. The consecutive single qubit operations of parse_qasm
+    on a qubit are one physical gate, since the compiler merges them into one u gate.
+    '''
+    schedule = []
+    clocks = {}
+    pending = set()
+
+    def flush(q):
+        if q in pending:
+            pending.discard(q)
+            if params['gate_error'][q] > 0:
+                schedule.append(('dep1', q, params['gate_error'][q]))
+            clocks[q] = clocks.get(q, 0.) + params['single_gate_time']
+
+    def wait(q, until):
+        if q in clocks and until > clocks[q]:
+            px, py, pz = idle_probabilities(until - clocks[q], params['T1'][q], params['T2'][q])
+            if px + py + pz > 0:
+                schedule.append(('idle', q, px, py, pz))
+        clocks[q] = until
+
+    for op in ops:
+        if op[0] != 'cx':
+            schedule.append(op)
+            pending.add(op[1])
+            continue
+        a, b = op[1:]
+        flush(a)
+        flush(b)
+        start = max(clocks.get(a, 0.), clocks.get(b, 0.))
+        wait(a, start)
+        wait(b, start)
+        if not (a, b) in params['cx_error']:
+            raise ValueError('No CX gate error in the calibration for the qubits ' + str([a, b]))
+        schedule.append(op)
+        if params['cx_error'][(a, b)] > 0:
+            schedule.append(('dep2', a, b, params['cx_error'][(a, b)]))
+        clocks[a] = clocks[b] = start + params['cx_gate_time']
+    measured = sorted(set(qubit for qubit, clbit in measurements))
+    for q in measured:
+        flush(q)
+    end = max([clocks.get(q, 0.) for q in measured] + [0.])
+    for q in measured:
+        wait(q, end)
+        if params['readout_error'][q] > 0:
+            schedule.append(('readout', q, params['readout_error'][q]))
+    return schedule
+
+
+# Propagation of the Pauli frames
+#################################
+def _pauli_bits(codes):
+    # Pauli codes 0, 1, 2, 3 for I, X, Y, Z to their X and Z bits
+    return ((codes + 1) >> 1) & 1, codes >> 1
+
+def propagate_frames(schedule, shots, rng):
+    '''propagate_frames(schedule, shots, rng)
+    Samples the errors of schedule for shots shots and propagates them to the end of the circuit.
+    Returns the X and Z parts of the final Pauli frames as bit-packed uint64 arrays.
+    '''
+    frame_x = np.zeros(shots, dtype=np.uint64)
+    frame_z = np.zeros(shots, dtype=np.uint64)
+    one = np.uint64(1)
+    for step in schedule:
+        name = step[0]
+        if name == 'h':
+            bit = one << np.uint64(step[1])
+            swap = (frame_x ^ frame_z) & bit
+            frame_x ^= swap
+            frame_z ^= swap
+        elif name == 's':
+            frame_z ^= frame_x & (one << np.uint64(step[1]))
+        elif name == 'cx':
+            a, b = np.uint64(step[1]), np.uint64(step[2])
+            frame_x ^= ((frame_x >> a) & one) << b
+            frame_z ^= ((frame_z >> b) & one) << a
+        elif name == 'dep1':
+            hits = np.flatnonzero(rng.random(shots) < step[2])
+            x_bits, z_bits = _pauli_bits(rng.integers(1, 4, size=len(hits), dtype=np.uint64))
+            frame_x[hits] ^= x_bits << np.uint64(step[1])
+            frame_z[hits] ^= z_bits << np.uint64(step[1])
+        elif name == 'dep2':
+            hits = np.flatnonzero(rng.random(shots) < step[3])
+            codes = rng.integers(1, 16, size=len(hits), dtype=np.uint64)
+            for q, q_codes in [(step[1], codes >> np.uint64(2)), (step[2], codes & np.uint64(3))]:
+                x_bits, z_bits = _pauli_bits(q_codes)
+                frame_x[hits] ^= x_bits << np.uint64(q)
+                frame_z[hits] ^= z_bits << np.uint64(q)
+        elif name == 'idle':
+            q, px, py, pz = step[1:]
+            draws = rng.random(shots)
+            frame_x ^= (draws < px + py).astype(np.uint64) << np.uint64(q)
+            frame_z ^= ((draws >= px) & (draws < px + py + pz)).astype(np.uint64) << np.uint64(q)
+        elif name == 'readout':
+            hits = np.flatnonzero(rng.random(shots) < step[2])
+            frame_x[hits] ^= one << np.uint64(step[1])
+    return frame_x, frame_z
+
+def _run_frame_task(task):
+    # One chunk of runs of one circuit: returns the (n_runs, 32) raw outcome histograms
+    x0, basis, measurements, schedule, n_runs, shots_per_run, seed_sequence = task
+    rng = np.random.default_rng(seed_sequence)
+    shots = n_runs*shots_per_run
+    words = simtool.sample_qubit_words(x0, basis, shots, rng)
+    frame_x, frame_z = propagate_frames(schedule, shots, rng)
+    outcomes = simtool.words_to_clbits(words ^ frame_x, measurements)
+    run_index = np.arange(shots, dtype=np.int64)//shots_per_run
+    return np.bincount(run_index*32 + outcomes, minlength=32*n_runs).reshape(n_runs, 32)
+
+
+# Predicted performance of the suite
+####################################
+def predict_runs(quantump, circuit_names, calibration, n_runs, shots_per_run=8192, n_workers=1,
+                 seed=None, chunk_shots=1 << 20, single_gate_time=None, cx_gate_time=None):
+    '''predict_runs(quantump, circuit_names, calibration, n_runs, shots_per_run=8192, n_workers=1, seed=None, chunk_shots=1 << 20, single_gate_time=None, cx_gate_time=None)
+    Simulates n_runs noisy runs of shots_per_run shots of every named circuit of quantump with the
+    noise of the calibration snapshot, decodes them as the experimental runs and returns
+    {name: {'stat_dist': array, 'post_selection_ratio': array, 'qasm_count': [count], 'counts': array,
+    'expected_distribution_array': array}}.
+    The runs are simulated by chunks of about chunk_shots shots, on n_workers processes if > 1.
+    '''
+    params = noise_parameters(calibration, single_gate_time, cx_gate_time)
+    runs_per_chunk = max(1, chunk_shots//shots_per_run)
+    tasks = []
+    task_names = []
+    qasm_counts = {}
+    for name in circuit_names:
+        qasm = quantump.get_qasm(name)
+        if qasm.startswith('OPENQASM 2.0;'):
+            qasm = qasm[len('OPENQASM 2.0;'):]
+        qasm_counts[name] = len([q_instr for q_instr in qasm.split('\n') if len(q_instr) > 0]) - 3
+        n_qubits, n_clbits, ops, measurements = simtool.parse_qasm(qasm)
+        if n_clbits > 5:
+            raise ValueError('The decoding tables hold 5 classical bits, not ' + str(n_clbits))
+        x0, basis = simtool.StabilizerTableau(n_qubits).apply(ops).measurement_affine_space()
+        schedule = noisy_schedule(ops, measurements, params)
+        for first_run in range(0, n_runs, runs_per_chunk):
+            tasks.append([x0, basis, measurements, schedule, min(runs_per_chunk, n_runs - first_run), shots_per_run])
+            task_names.append(name)
+    for task, seed_sequence in zip(tasks, np.random.SeedSequence(seed).spawn(len(tasks))):
+        task.append(seed_sequence)
+    if n_workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+            histograms = list(executor.map(_run_frame_task, tasks))
+    else:
+        histograms = [_run_frame_task(task) for task in tasks]
+    predictions = {}
+    for name in circuit_names:
+        raw_counts = np.concatenate([h for h, task_name in zip(histograms, task_names) if task_name == name])
+        circuit_info, version, pair, number_H = exptool.circuit_name_info(name)
+        table = exptool.decoding_table(version, pair, number_H)
+        expected = np.array(circuit_info[2], dtype=float)
+        arrays = exptool.decode_counts(raw_counts, np.tile(table, (n_runs, 1)), np.tile(expected, (n_runs, 1)))
+        predictions[name] = {'stat_dist': arrays['stat_dist'],
+                             'post_selection_ratio': arrays['post_selection_ratio'],
+                             'qasm_count': [qasm_counts[name]],
+                             'counts': arrays['counts'],
+                             'expected_distribution_array': np.tile(expected, (n_runs, 1))}
+    return predictions
+
+def predicted_aggregate(quantump, circuit_names, calibration, n_runs, shots_per_run=8192, n_workers=1, seed=None):
+    '''predicted_aggregate(quantump, circuit_names, calibration, n_runs, shots_per_run=8192, n_workers=1, seed=None)
+    ProcessedAggregate of the runs of predict_runs, to plot with plot_everything_averaged and
+    plot_everything_averaged_diff next to the experimental aggregates.
+    '''
+    predictions = predict_runs(quantump, circuit_names, calibration, n_runs, shots_per_run, n_workers, seed)
+    circuits = [(name + '.txt', values) for name, values in predictions.items()]
+    return ProcessedAggregate(circuits, 0, n_runs*len(circuits))
@@ -0,0 +1,335 @@
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import threading
+
+import tools.Manifest_tools as manifesttool
+import tools.Calibration_tools as calibtool
+import tools.Experiment_tools as exptool
+import tools.Timeline_tools as timetool
+import tools.Qasm_index_tools as qasmindextool
+import tools.Analysis_tools as anatool
+from tools.Analysis_tools import PLOT_LABELS, label_index
+
+# Incremental pipeline from the API dumps to the figures
+########################################################
+# The steps of the notebook (fetch the jobs, process the dumps with the qasm -> names dictionary,
+# save the plot and calibration data, render the figures) are stages declaring the files under
+# data/ they read and write. After a successful run the content hashes of these files are kept in
+# data/pipeline_state.json, and a stage is ran again only if one of them (or one of its
+# parameters) changed. The processing itself only decodes the new dumps (see the manifest) and
+# the changed dumps of processed jobs, whose earlier runs it replaces, and every figure only
+# depends on the circuits of the labels it shows, so that e.g. new bare[2, 4] runs redo the
+# averaged plot and the bare[2, 4] diff but not the five other diffs.
+# Stages whose dependencies are done run concurrently in threads, figures being rendered in
+# worker processes. Run from the repository root with:  python -m tools.Pipeline_tools --figures
+
+STATE_FILENAME = 'data/pipeline_state.json'
+DUMP_FOLDER = 'data/API_dumps/'
+PROCESSED_FOLDER = 'data/Processed_data/'
+PLOT_DATA_FOLDER = 'data/Plot_data/'
+TABLE_DATA_FOLDER = 'data/Table_data/'
+FIGURE_FOLDER = 'data/Figures/'
+QASM_NAMES_FILENAME = 'data/qasm_names.json'
+QASM_INDEX_FILENAME = qasmindextool.QASM_INDEX_FILENAME
+
+
+class FileHashes:
+    '''Content hashes of files, recomputed only when their size or modification time changed.
+    known is the {path: [size, mtime_ns, hash]} saved in the state of the previous run, updated
+    under a lock since the stages hash their files from several threads (see snapshot).
+    '''
+    def __init__(self, known=None):
+        self.known = dict(known or {})
+        self._lock = threading.Lock()
+
+    def __call__(self, filename):
+        if not os.path.isfile(filename):
+            return None
+        file_stat = os.stat(filename)
+        with self._lock:
+            known = self.known.get(filename)
+        if known is not None and known[0] == file_stat.st_size and known[1] == file_stat.st_mtime_ns:
+            return known[2]
+        file_hash = manifesttool.file_hash(filename)
+        with self._lock:
+            self.known[filename] = [file_stat.st_size, file_stat.st_mtime_ns, file_hash]
+        return file_hash
+
+    def snapshot(self):
+        '''snapshot()
+        Copy of known taken under the lock, safe to serialize while other threads hash files.
+        '''
+        with self._lock:
+            return dict(self.known)
+
+class Stage:
+    '''A step of the pipeline. run(changed) writes the files of outputs() from the ones of inputs(),
+    changed being the set of inputs and outputs whose hash differs from the last successful run
+    (None for a first run). inputs and outputs are functions returning lists of paths, called
+    once the dependencies are done. params are compared between runs as well. An always stage runs
+    at every run (e.g. fetching from the API).
+    '''
+    def __init__(self, name, run, inputs=None, outputs=None, deps=(), params=None, always=False):
+        self.name = name
+        self.run = run
+        self.inputs = inputs or list
+        self.outputs = outputs or list
+        self.deps = list(deps)
+        self.params = params or {}
+        self.always = always
+
+class Pipeline:
+    '''Runs stages in dependency order, skipping the ones whose inputs, outputs and params are
+    unchanged since their last successful run, see run.
+    '''
+    def __init__(self, stages, state_filename=STATE_FILENAME, n_threads=4, force=False, dry_run=False):
+        self.stages = {stage.name: stage for stage in stages}
+        self.state_filename = state_filename
+        self.n_threads = n_threads
+        self.force = force
+        self.dry_run = dry_run
+        self.state = {'stages': {}, 'hashes': {}}
+        if os.path.isfile(state_filename):
+            with open(state_filename, 'r') as state_file:
+                self.state = json.load(state_file)
+        self.hashes = FileHashes(self.state.get('hashes'))
+        self._lock = threading.Lock()
+
+    def signature(self, filenames):
+        return {filename: self.hashes(filename) for filename in sorted(set(filenames))}
+
+    def changes(self, stage):
+        '''changes(stage)
+        Set of the input and output files of stage changed since its last run, None if it never
+        ran or its params changed, or the empty set if it is up to date.
+        '''
+        record = self.state['stages'].get(stage.name)
+        if record is None or record['params'] != stage.params:
+            return None
+        current = dict(self.signature(stage.inputs()), **self.signature(stage.outputs()))
+        recorded = dict(record['inputs'], **record['outputs'])
+        return {filename for filename in set(current) | set(recorded)
+                if current.get(filename) != recorded.get(filename)}
+
+    def execute(self, stage):
+        changed = self.changes(stage)
+        if changed is not None and not changed and not stage.always and not self.force:
+            return 'up to date'
+        if self.dry_run:
+            return 'would run'
+        stage.run(changed)
+        record = {'params': stage.params,
+                  'inputs': self.signature(stage.inputs()),
+                  'outputs': self.signature(stage.outputs())}
+        with self._lock:
+            self.state['stages'][stage.name] = record
+            self.save_state()
+        return 'ran'
+
+    def save_state(self):
+        self.state['hashes'] = self.hashes.snapshot()
+        with open(self.state_filename + '.part', 'w') as state_file:
+            json.dump(self.state, state_file, indent=1, sort_keys=True)
+        os.replace(self.state_filename + '.part', self.state_filename)
+
+    def run(self):
+        '''run()
+        Executes the stages, concurrently when their dependencies allow it. A failing stage is
+        reported and its dependents are skipped. Returns {stage name: status}.
+        '''
+        statuses = {}
+        waiting = dict(self.stages)
+        running = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.n_threads) as pool:
+            while waiting or running:
+                for name, stage in list(waiting.items()):
+                    if any(statuses.get(dep, '').startswith(('failed', 'skipped')) for dep in stage.deps):
+                        statuses[name] = 'skipped'
+                        del waiting[name]
+                    elif all(dep in statuses or not dep in self.stages for dep in stage.deps):
+                        running[pool.submit(self.execute, stage)] = name
+                        del waiting[name]
+                if not running:
+                    continue
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        statuses[name] = future.result()
+                    except Exception as stage_err:
+                        statuses[name] = 'failed: ' + repr(stage_err)
+                    print('{:28} {}'.format(name, statuses[name]))
+        return statuses
+
+
+# Stages of the experiment
+##########################
+def dump_files():
+    if not os.path.isdir(DUMP_FOLDER):
+        return []
+    return [os.path.join(DUMP_FOLDER, filename) for filename in sorted(os.listdir(DUMP_FOLDER))
+            if filename.startswith('api_dump_') and filename.endswith(('.jsonl', '.txt'))]
+
+def dump_job_id(filename):
+    return os.path.basename(filename)[len('api_dump_'):].rsplit('.', 1)[0]
+
+def processed_files(labels=None):
+    '''processed_files(labels=None)
+    Circuit files of the text Processed_data folder, of the labels (indices in PLOT_LABELS) only if given.
+    '''
+    if not os.path.isdir(PROCESSED_FOLDER):
+        return []
+    return [PROCESSED_FOLDER + filename for filename in sorted(os.listdir(PROCESSED_FOLDER))
+            if labels is None or label_index(filename) in labels]
+
+def fetch_stage(n_concurrent=5):
+    def run(changed):
+        import Qconfig
+        import tools.Job_tools as jobtool
+        from qiskit import QuantumProgram
+        qprogram = QuantumProgram()
+        qprogram.set_api(Qconfig.APItoken, Qconfig.config['url'])
+        manifest = manifesttool.open_manifest()
+        try:
+            jobtool.resume_jobs(qprogram.get_api(), manifest, dump_folder=DUMP_FOLDER, max_concurrent=n_concurrent)
+        finally:
+            manifest.close()
+    return Stage('fetch', run, always=True)
+
+def process_stage(n_workers=1, rebuild=False, deps=()):
+    '''process_stage(n_workers=1, rebuild=False, deps=())
+    Processes the new dumps of data/API_dumps/ into data/Processed_data/ and indexes them in the
+    timeline, then the changed dumps of processed jobs (Experiment_tools.reprocess_changed), the
+    stage failing if a job is still marked 'changed' afterwards. The processed data and the timeline are cleared and every dump processed
+    again when the qasm -> names dictionary changed or if rebuild. The names are looked up in the
+    persistent index data/qasm_names.sqlite when it exists, else in data/qasm_names.json.
+    '''
+    def run(changed):
+        if os.path.isfile(QASM_INDEX_FILENAME):
+            dict_qasm_name = qasmindextool.QasmNameIndex(QASM_INDEX_FILENAME)
+        else:
+            dict_qasm_name = exptool.load_qasm_name_dict(QASM_NAMES_FILENAME)
+        os.makedirs(PROCESSED_FOLDER, exist_ok=True)
+        manifest = manifesttool.open_manifest()
+        timeline = timetool.open_timeline()
+        try:
+            if rebuild or (changed and (QASM_NAMES_FILENAME in changed or QASM_INDEX_FILENAME in changed)):
+                for filename in processed_files() + [calibtool.calibration_table_filename(PROCESSED_FOLDER)]:
+                    if os.path.isfile(filename):
+                        os.remove(filename)
+                manifesttool.reset_processed(manifest)
+                timetool.reset_timeline(timeline)
+            ids_filename = 'data/pipeline_to_process.txt'
+            with open(ids_filename, 'w') as ids_file:
+                ids_file.write(''.join(dump_job_id(filename) + '\n' for filename in dump_files()))
+            exptool.process_all_api_dumps(ids_filename, None, dict_qasm_name, n_workers=n_workers, manifest=manifest,
+                                         timeline=timeline)
+            exptool.reprocess_changed(manifest, dict_qasm_name, timeline)
+            changed_jobs = manifesttool.jobs_with_status(manifest, 'changed')
+            if changed_jobs:
+                raise RuntimeError('Changed dumps left unprocessed: ' + ', '.join(changed_jobs))
+        finally:
+            timeline.close()
+            manifest.close()
+    return Stage('process', run, deps=deps,
+                 inputs=lambda: dump_files() + [QASM_NAMES_FILENAME, QASM_INDEX_FILENAME],
+                 outputs=lambda: processed_files() + [calibtool.calibration_table_filename(PROCESSED_FOLDER)])
+
+_AGGREGATE_LOCK = threading.Lock()
+
+def shared_aggregate():
+    with _AGGREGATE_LOCK:
+        return anatool.aggregate_processed_data(PROCESSED_FOLDER)
+
+def render(render_pool, task):
+    if render_pool is None:
+        return
+    import tools.Ploting_tools as plottool
+    render_pool.submit(plottool.render_figure_task, task).result()
+
+def figure_stages(render_pool=None, fmt='pdf', logscaley=True, ci=.99, ci_method='student', n_resamples=10000):
+    '''figure_stages(render_pool=None, fmt='pdf', logscaley=True, ci=.99, ci_method='student', n_resamples=10000)
+    Stages saving the .dat files of the averaged plot, of the six averaged diffs and of the
+    calibration averages, and rendering their figures in the process pool render_pool if given.
+    '''
+    import tools.Ploting_tools as plottool
+    figures = render_pool is not None
+    params = {'fmt': fmt, 'logscaley': logscaley, 'ci': ci, 'ci_method': ci_method,
+              'n_resamples': n_resamples, 'figures': figures}
+
+    def figure_file(kind, bareindex=None):
+        return [FIGURE_FOLDER + plottool.figure_name(kind, bareindex) + '.' + fmt] if figures else []
+
+    def run_averaged(changed):
+        data = anatool.averaged_plot_data(shared_aggregate(), ci=ci, ci_method=ci_method, n_resamples=n_resamples)
+        plottool.write_averaged_plot_data(data, PLOT_DATA_FOLDER)
+        render(render_pool, ('averaged', data, {'logscaley': logscaley}, FIGURE_FOLDER + plottool.figure_name('averaged') + '.' + fmt))
+
+    stages = [Stage('averaged', run_averaged, deps=['process'], params=params,
+                    inputs=processed_files,
+                    outputs=lambda: ([PLOT_DATA_FOLDER + label + '.dat' for label in PLOT_LABELS]
+                                     + [PLOT_DATA_FOLDER + 'bare_qasm_count.dat'] + figure_file('averaged')))]
+    for bareindex in range(0, 6):
+        def run_diff(changed, bareindex=bareindex):
+            data = anatool.averaged_diff_plot_data(shared_aggregate(), bareindex, ci, ci_method, n_resamples)
+            plottool.write_averaged_diff_plot_data(data, PLOT_DATA_FOLDER)
+            render(render_pool, ('averaged_diff', data, {'logscaley': logscaley},
+                                 FIGURE_FOLDER + plottool.figure_name('averaged_diff', bareindex) + '.' + fmt))
+        stages.append(Stage(plottool.figure_name('averaged_diff', bareindex), run_diff, deps=['process'], params=params,
+                            inputs=lambda bareindex=bareindex: processed_files([bareindex] + list(range(6, len(PLOT_LABELS)))),
+                            outputs=lambda bareindex=bareindex: ([PLOT_DATA_FOLDER + PLOT_LABELS[j] + '-' + PLOT_LABELS[bareindex] + '.dat'
+                                                                   for j in range(6, len(PLOT_LABELS))]
+                                                                  + figure_file('averaged_diff', bareindex))))
+
+    def run_calibration(changed):
+        stats = anatool.calibration_statistics(PROCESSED_FOLDER)
+        plottool.save_everything_calib_data_avg(PROCESSED_FOLDER, TABLE_DATA_FOLDER, stats)
+        render(render_pool, ('calibration', stats, {}, FIGURE_FOLDER + plottool.figure_name('calibration') + '.' + fmt))
+
+    stages.append(Stage('calibration', run_calibration, deps=['process'], params=params,
+                        inputs=lambda: [calibtool.calibration_table_filename(PROCESSED_FOLDER)],
+                        outputs=lambda: ([TABLE_DATA_FOLDER + name for name in ['multi_q.dat', 'single_q.dat', 'temp.dat']]
+                                         + figure_file('calibration'))))
+    return stages
+
+def main():
+    parser = argparse.ArgumentParser(description='Incremental pipeline from the API dumps to the plot data and figures.')
+    parser.add_argument('--fetch', action='store_true', help='poll the pending jobs of the manifest first (needs Qconfig)')
+    parser.add_argument('--figures', action='store_true', help='render the figures into ' + FIGURE_FOLDER)
+    parser.add_argument('--fmt', default='pdf', help='figure format')
+    parser.add_argument('--workers', type=int, default=1, help='processes decoding the dumps and rendering the figures')
+    parser.add_argument('--threads', type=int, default=4, help='stages running concurrently')
+    parser.add_argument('--ci', type=float, default=.99)
+    parser.add_argument('--ci-method', default='student', choices=['student', 'bootstrap'])
+    parser.add_argument('--n-resamples', type=int, default=10000)
+    parser.add_argument('--logscale', action='store_true', help='log scale on the stat_dist axes')
+    parser.add_argument('--rebuild', action='store_true', help='clear the processed data and process every dump again')
+    parser.add_argument('--force', action='store_true', help='run every stage even if up to date')
+    parser.add_argument('--dry-run', action='store_true', help='only tell which stages would run')
+    args = parser.parse_args()
+    for folder in [PROCESSED_FOLDER, PLOT_DATA_FOLDER, TABLE_DATA_FOLDER] + ([FIGURE_FOLDER] if args.figures else []):
+        os.makedirs(folder, exist_ok=True)
+    render_pool = None
+    if args.figures:
+        import tools.Ploting_tools as plottool
+        # The render processes are started from the stage threads, so they are spawned, not forked
+        render_pool = concurrent.futures.ProcessPoolExecutor(max_workers=max(1, args.workers),
+                                                             mp_context=multiprocessing.get_context('spawn'),
+                                                             initializer=plottool.init_render_worker)
+    try:
+        stages = [fetch_stage()] if args.fetch else []
+        stages.append(process_stage(args.workers, args.rebuild, deps=['fetch'] if args.fetch else []))
+        stages.extend(figure_stages(render_pool, args.fmt, args.logscale, args.ci, args.ci_method, args.n_resamples))
+        statuses = Pipeline(stages, n_threads=args.threads, force=args.force or args.rebuild, dry_run=args.dry_run).run()
+    finally:
+        if render_pool is not None:
+            render_pool.shutdown()
+    if any(status.startswith(('failed', 'skipped')) for status in statuses.values()):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,30 @@
 import ast
+import concurrent.futures
 import os
-import re
-import statistics
 import random
 import numpy as np
-from scipy.stats import t, norm, gaussian_kde
-import matplotlib.pyplot as plt
 
 from tools.Experiment_tools import CIRCUIT_NAMES
+import tools.Storage_tools as storetool
+import tools.Profiling_tools as proftool
+from tools.Analysis_tools import (PLOT_LABELS, RE_LABELS, label_index, load_processed_data, aggregate_processed_data,
+                                  averaged_plot_data, averaged_diff_plot_data, calibration_statistics)
 
+# matplotlib (and scipy) are imported by the functions that render, so that importing this module
+# to compute or save plot data does not load them. The render_* functions draw a figure from the
+# data computed by Analysis_tools and return it; the plot_* functions compute, render, show and
+# print; render_all_figures writes every figure to files without display.
 
+
+@proftool.profiled('plot_everything_raw')
 def plot_everything_raw(folder):
-    list_file = os.listdir(folder)
-    n_circuit = len(list_file)
-    n_skipped = 0
-    n_keapt = 0
+    import matplotlib.pyplot as plt
+    circuits, n_skipped, n_keapt = load_processed_data(folder, ['qasm_count', 'stat_dist'])
+    n_circuit = len(circuits)
     cmap = plt.cm.get_cmap('gist_ncar')
     plt.figure(figsize=(20, 20))
-    for j, circuit_filename in enumerate(list_file):
-        with open(folder+circuit_filename, 'r') as circuit_file:
-            expe_list = circuit_file.readlines()
-        stat_dist = []
-        qasm_count = []
-        for expe_data_string in expe_list:
-            try:
-                expe_data = ast.literal_eval(expe_data_string)
-                qasm_count.append(expe_data['qasm_count'])
-                stat_dist.append(expe_data['stat_dist'])
-                n_keapt += 1
-            except SyntaxError:
-                n_skipped += 1
-        plt.scatter(qasm_count, stat_dist, label=circuit_filename, marker='x', c=cmap(j/n_circuit))
+    for j, (circuit_filename, values) in enumerate(circuits):
+        plt.scatter(values['qasm_count'], values['stat_dist'], label=circuit_filename, marker='x', c=cmap(j/n_circuit))
     plt.title('all experiments')
     plt.legend(loc='lower left', bbox_to_anchor=(1, 0))
     plt.yscale('log')
@@ -38,167 +32,109 @@ def plot_everything_raw(folder):
     plt.show()
     print(n_skipped, n_keapt)
 
-PLOT_LABELS = ['bare[1, 0]',
-               'bare[2, 0]',
-               'bare[2, 1]',
-               'bare[2, 4]',
-               'bare[3, 2]',
-               'bare[3, 4]',
-               'encoded|00>ftv1',
-               'encoded|00>ftv2',
-               'encoded|00>nftv1',
-               'encoded|0+>',
-               'encoded|00>+|11>']
-
-RE_LABELS = [re.compile('[\\S]*\\[1, 0\\].txt'),
-             re.compile('[\\S]*\\[2, 0\\].txt'),
-             re.compile('[\\S]*\\[2, 1\\].txt'),
-             re.compile('[\\S]*\\[2, 4\\].txt'),
-             re.compile('[\\S]*\\[3, 2\\].txt'),
-             re.compile('[\\S]*\\[3, 4\\].txt'),
-             re.compile('[\\S]*>ftv1.txt'),
-             re.compile('[\\S]*>ftv2.txt'),
-             re.compile('[\\S]*nftv1.txt'),
-             re.compile('e[\\S]*\\|0\\+>.txt'),
-             re.compile('e[\\S]*\\|00>\\+\\|11>.txt')]
-
-def plot_everything_averaged(folder, logscaley=True, sublabels=PLOT_LABELS, ci=.99, save_data_folder_pref=None):
-    list_file = os.listdir(folder)
-    n_skipped = 0
-    n_kept = 0
+def write_conf_int_data(data_file, column, rows):
+    '''write_conf_int_data(data_file, column, rows)
+    Writes the (index, value, conf_int) rows of a .dat file, conf_int being a half width
+    (column conf_int99) or the (low, high) bounds of a bootstrap interval (columns conf_int99_low
+    and conf_int99_high).
+    '''
+    rows = list(rows)
+    if rows and isinstance(rows[0][2], tuple):
+        data_file.write('index {} conf_int99_low conf_int99_high\n'.format(column))
+        for index, value, (low, high) in rows:
+            data_file.write('{} {} {} {}\n'.format(index, value, low, high))
+    else:
+        data_file.write('index {} conf_int99\n'.format(column))
+        for tup in rows:
+            data_file.write('{} {} {}\n'.format(*tup))
+
+def write_averaged_plot_data(data, save_data_folder_pref):
+    '''write_averaged_plot_data(data, save_data_folder_pref)
+    Writes the .dat files of the averaged_plot_data data (one per label and bare_qasm_count.dat).
+    '''
+    for j, points in data['series']:
+        with open(save_data_folder_pref + PLOT_LABELS[j] + '.dat', 'w') as data_file:
+            write_conf_int_data(data_file, 'stat_dist', points)
+    with open(save_data_folder_pref + 'bare_qasm_count.dat', 'w') as data_file:
+        data_file.write('index qasm_count\n')
+        for tup in data['qasm_count']:
+            data_file.write('{} {}\n'.format(*tup))
+
+def write_averaged_diff_plot_data(data, save_data_folder_pref):
+    '''write_averaged_diff_plot_data(data, save_data_folder_pref)
+    Writes the .dat files (one per encoded label) of the averaged_diff_plot_data data.
+    '''
+    for j, points in data['series']:
+        with open(save_data_folder_pref + PLOT_LABELS[j] + '-' + PLOT_LABELS[data['bareindex']] + '.dat', 'w') as data_file:
+            write_conf_int_data(data_file, 'stat_dist_diff', points)
+
+def label_colors():
+    import matplotlib.pyplot as plt
     cmap = plt.cm.get_cmap('Paired')
-    colors = [cmap(j/12) for j in [1,5,10,11,4,0,8,9,6,2,3]]
-    qasm_counts = [[] for j in range(0, 12)]
-    circuit_indices = [[] for j in range(0, 12)]
-    stat_dists = [[] for j in range(0, 12)]
-    post_select_r = [[] for j in range(0, 12)]
-    stdevs = [[] for j in range(0, 12)]
-    conf_ints = [[] for j in range(0, 12)]
+    return [cmap(j/12) for j in [1,5,10,11,4,0,8,9,6,2,3]]
+
+def draw_points(ax, l1, l2, l3, label, color):
+    '''draw_points(ax, l1, l2, l3, label, color)
+    Draws the points (l1, l2) with their confidence intervals l3: symmetric error bars of half
+    widths, or vertical segments between the (low, high) bounds of bootstrap intervals.
+    '''
+    if l3 and isinstance(l3[0], tuple):
+        ax.errorbar(l1, l2, markersize=15, mew=3, fmt='x', label=label, c=color)
+        lows, highs = zip(*l3)
+        ax.vlines(l1, lows, highs, colors=[color])
+    else:
+        ax.errorbar(l1, l2, yerr=l3, markersize=15, mew=3, fmt='x', label=label, c=color)
+
+def set_circuit_ticks(ax):
+    ax.set_xticks(range(1,21))
+    ax.set_xticklabels([c[1:] for c in CIRCUIT_NAMES], rotation=60, horizontalalignment='right')
+
+@proftool.profiled('render')
+def render_averaged(data, logscaley=True):
+    '''render_averaged(data, logscaley=True)
+    Figure of plot_everything_averaged drawn from its averaged_plot_data data.
+    '''
+    import matplotlib.pyplot as plt
+    colors = label_colors()
     fig, ax = plt.subplots(figsize=(20, 20))
-    for j, circuit_filename in enumerate(list_file):
-        total = 0
-        stat_dist_avg = 0
-        values = []
-        with open(folder+circuit_filename, 'r') as circuit_file:
-            expe_list = circuit_file.readlines()
-        for k, reg_ex in enumerate(RE_LABELS):
-            if reg_ex.match(circuit_filename):
-                index = k
-                break
-        for expe_data_string in expe_list:
-            try:
-                expe_data = ast.literal_eval(expe_data_string)
-                total += 1
-                stat_dist_avg += expe_data['stat_dist']
-                post_select_r[index].append(expe_data['post_selection_ratio'])
-                values.append(expe_data['stat_dist'])
-                n_kept += 1
-            except SyntaxError:
-                n_skipped += 1
-        stat_dists[index].append(stat_dist_avg/total)
-        qasm_counts[index].append(expe_data['qasm_count'])
-        for l, cn in enumerate(CIRCUIT_NAMES):
-            if cn in circuit_filename:
-                circuit_index = l+1
-        circuit_indices[index].append(circuit_index)
-        stdevs[index].append(statistics.stdev(values))
-        ct = t.interval(ci, len(values)-1, loc=0, scale=1)[1]
-        conf_ints[index].append(ct*statistics.stdev(values)/np.sqrt(len(values)))
-    indices_to_plot = [PLOT_LABELS.index(pl) for pl in sublabels]
-    for j in indices_to_plot:
-        l1, l2, l3 = zip(*sorted(zip(circuit_indices[j], stat_dists[j], conf_ints[j])))
-        ax.errorbar(l1, l2, yerr=l3, markersize=15, mew=3, fmt='x', label=PLOT_LABELS[j], c=colors[j])
-        if save_data_folder_pref:
-            with open(save_data_folder_pref + PLOT_LABELS[j] + '.dat', 'w') as data_file:
-                data_file.write('index stat_dist conf_int99\n')
-                for tup in zip(l1, l2, l3):
-                    data_file.write('{} {} {}\n'.format(*tup))
-    l1, l2 = zip(*sorted(zip(circuit_indices[0], qasm_counts[0])))
-    ax2 = ax.twinx()
-    ax2.plot(l1, l2, 'k-')
-    if save_data_folder_pref:
-        with open(save_data_folder_pref + 'bare_qasm_count.dat', 'w') as data_file:
-            data_file.write('index qasm_count\n')
-            for tup in zip(l1, l2):
-                data_file.write('{} {}\n'.format(*tup))
-    handles, labs = ax.get_legend_handles_labels()
+    for j, points in data['series']:
+        if not points:
+            continue
+        l1, l2, l3 = zip(*points)
+        draw_points(ax, l1, l2, l3, PLOT_LABELS[j], colors[j])
+    if data['qasm_count']:
+        l1, l2 = zip(*data['qasm_count'])
+        ax2 = ax.twinx()
+        ax2.plot(l1, l2, 'k-')
     ax.set_title('all experiments')
-    #ax.legend([h[0] for h in handles], labels, loc='lower left', bbox_to_anchor=(1, 0))
     ax.legend(loc='lower left', bbox_to_anchor=(1, 0))
     if logscaley:
         ax.set_yscale('log')
     ax.grid(True)
     fig.tight_layout()
-    plt.sca(ax)
-    plt.xticks(range(1,21), [c[1:] for c in CIRCUIT_NAMES], rotation=60, horizontalalignment='right')
-    plt.show()
-    print(n_skipped, n_kept)
-    print('\nAverage performance:\n')
-    for k in range(0, 11):
-        print(PLOT_LABELS[k], statistics.mean(stat_dists[k]))
-    print('\nPost selection ratios:\n')
-    for k in range(6, 10):
-        print(PLOT_LABELS[k], statistics.mean(post_select_r[k]+post_select_r[10]+post_select_r[11]))
+    set_circuit_ticks(ax)
+    return fig
 
-def plot_everything_averaged_diff(folder, logscaley=True, bareindex=1, ci=.99, plot_qasm_count=False, save_data_folder_pref=None):
-    list_file = os.listdir(folder)
-    n_skipped = 0
-    n_kept = 0
-    cmap = plt.cm.get_cmap('Paired')
-    colors = [cmap(j/12) for j in [1,5,10,11,4,0,8,9,6,2,3]]
-    qasm_counts = [[] for j in range(0, 12)]
-    circuit_indices = [[] for j in range(0, 12)]
-    stat_dists = [[] for j in range(0, 12)]
-    stdevs = [[] for j in range(0, 12)]
-    conf_ints = [[] for j in range(0, 12)]
+@proftool.profiled('render')
+def render_averaged_diff(data, logscaley=True, plot_qasm_count=False):
+    '''render_averaged_diff(data, logscaley=True, plot_qasm_count=False)
+    Figure of plot_everything_averaged_diff drawn from its averaged_diff_plot_data data.
+    '''
+    import matplotlib.pyplot as plt
+    colors = label_colors()
     fig, ax = plt.subplots(figsize=(20, 20))
-    for j, circuit_filename in enumerate(list_file):
-        total = 0
-        stat_dist_avg = 0
-        values = []
-        with open(folder+circuit_filename, 'r') as circuit_file:
-            expe_list = circuit_file.readlines()
-        for k, reg_ex in enumerate(RE_LABELS):
-            if reg_ex.match(circuit_filename):
-                index = k
-                break
-        for expe_data_string in expe_list:
-            try:
-                expe_data = ast.literal_eval(expe_data_string)
-                total += 1
-                stat_dist_avg += expe_data['stat_dist']
-                values.append(expe_data['stat_dist'])
-                n_kept += 1
-            except SyntaxError:
-                n_skipped += 1
-        stat_dists[index].append(stat_dist_avg/total)
-        qasm_counts[index].append(expe_data['qasm_count'])
-        for l,cn in enumerate(CIRCUIT_NAMES):
-            if cn in circuit_filename:
-                circuit_index = l+1
-        circuit_indices[index].append(circuit_index)
-        stdevs[index].append(statistics.stdev(values))
-        ct = t.interval(ci, len(values)-1, loc=0, scale=1)[1]
-        conf_ints[index].append(ct*statistics.stdev(values)/np.sqrt(len(values)))
     if plot_qasm_count:
         ax2 = ax.twinx()
     ax.plot([j for j in range(-1,22)], [0 for j in range(-1,22)], '-r')
-    indices_to_plot = [pl for pl in range(6,12)]
-    for j in indices_to_plot:
+    for (j, points), (_, qasm_points) in zip(data['series'], data['qasm_counts']):
+        if not points:
+            continue
         if plot_qasm_count:
-            l1, l2 = zip(*sorted(zip(circuit_indices[j], qasm_counts[j])))
-            ax2.plot(l1, l2, label=PLOT_LABELS[j], c=colors[j]) 
-        for k in range(0,len(stat_dists[j])):
-            bare_ref = stat_dists[bareindex][circuit_indices[bareindex].index(circuit_indices[j][k])]
-            stat_dists[j][k] -= bare_ref
-        ax.errorbar(np.array(circuit_indices[j]), np.array(stat_dists[j]), yerr=np.array(conf_ints[j]), markersize=15, mew=3, fmt='x', label=PLOT_LABELS[j], c=colors[j])
-        if save_data_folder_pref:
-            with open(save_data_folder_pref + PLOT_LABELS[j] + '-' + PLOT_LABELS[bareindex] + '.dat', 'w') as data_file:
-                data_file.write('index stat_dist_diff conf_int99\n')
-                for tup in sorted(zip(circuit_indices[j], stat_dists[j], conf_ints[j])):
-                    data_file.write('{} {} {}\n'.format(*tup))
-    handles, labs = ax.get_legend_handles_labels()
-    ax.set_title('Encoded circuits compared to bare qubit pair '+PLOT_LABELS[bareindex][4:])
+            l1, l2 = zip(*qasm_points)
+            ax2.plot(l1, l2, label=PLOT_LABELS[j], c=colors[j])
+        l1, l2, l3 = zip(*points)
+        draw_points(ax, l1, l2, l3, PLOT_LABELS[j], colors[j])
+    ax.set_title('Encoded circuits compared to bare qubit pair '+PLOT_LABELS[data['bareindex']][4:])
     if plot_qasm_count:
         ax2.legend(loc='upper left', bbox_to_anchor=(1, 0))
     ax.legend(loc='lower left', bbox_to_anchor=(1, 0))
@@ -206,61 +142,193 @@ def plot_everything_averaged_diff(folder, logscaley=True, bareindex=1, ci=.99, p
         ax.set_yscale('log')
     ax.grid(True)
     ax.set_xlim([0,21])
-    plt.sca(ax)
-    plt.xticks(range(1,21), [c[1:] for c in CIRCUIT_NAMES], rotation=60, horizontalalignment='right')
+    set_circuit_ticks(ax)
     fig.tight_layout()
+    return fig
+
+CALIBRATION_PANELS = [('T1', 'T1 (s)'), ('T2', 'T2 (s)'), ('gateError', 'single qubit gate error'),
+                      ('readoutError', 'readout error')]
+
+@proftool.profiled('render')
+def render_calibration(stats):
+    '''render_calibration(stats)
+    Figure of the calibration averages of calibration_statistics: one panel (mean and standard
+    deviation per qubit) per single qubit parameter, one for the CX gate errors and one for the
+    fridge temperature.
+    '''
+    import matplotlib.pyplot as plt
+    fig, axes = plt.subplots(2, 3, figsize=(18, 10))
+    qubit_names = [line['name'] for line in stats['single_q']]
+    for ax, (param, title) in zip(axes.flat, CALIBRATION_PANELS):
+        ax.bar(range(len(qubit_names)), [line[param][0] for line in stats['single_q']],
+               yerr=[line[param][1] for line in stats['single_q']], capsize=5)
+        ax.set_xticks(range(len(qubit_names)))
+        ax.set_xticklabels(qubit_names)
+        ax.set_title(title)
+    ax = axes.flat[4]
+    ax.bar(range(len(stats['multi_q'])), [line['gateError'][0] for line in stats['multi_q']],
+           yerr=[line['gateError'][1] for line in stats['multi_q']], capsize=5)
+    ax.set_xticks(range(len(stats['multi_q'])))
+    ax.set_xticklabels(['CX' + '-'.join(str(k) for k in line['qubits']) for line in stats['multi_q']])
+    ax.set_title('CX gate error')
+    ax = axes.flat[5]
+    ax.bar([0], [stats['temperature'][0]], yerr=[stats['temperature'][1]], capsize=5)
+    ax.set_xticks([0])
+    ax.set_xticklabels(['fridge'])
+    ax.set_title('temperature (K)')
+    fig.suptitle('Average over {} calibrations'.format(stats['n_calibrations']))
+    fig.tight_layout()
+    return fig
+
+@proftool.profiled('plot_everything_averaged')
+def plot_everything_averaged(folder, logscaley=True, sublabels=PLOT_LABELS, ci=.99, save_data_folder_pref=None,
+                             ci_method='student', n_resamples=10000, n_workers=1):
+    '''plot_everything_averaged(folder, logscaley=True, sublabels=PLOT_LABELS, ci=.99, save_data_folder_pref=None, ci_method='student', n_resamples=10000, n_workers=1)
+    Plots the average stat_dist of every circuit per label. folder is either a processed data
+    folder or the ProcessedAggregate returned by aggregate_processed_data. The confidence intervals
+    are Student-t intervals over the runs, or with ci_method='bootstrap' basic bootstrap intervals of
+    n_resamples bootstrap resamples of the runs and of their shots, drawn between their bounds.
+    '''
+    import matplotlib.pyplot as plt
+    data = averaged_plot_data(folder, sublabels, ci, ci_method, n_resamples, n_workers)
+    if save_data_folder_pref:
+        write_averaged_plot_data(data, save_data_folder_pref)
+    render_averaged(data, logscaley)
     plt.show()
-    print(n_skipped, n_kept)
-    for k in range(0,11):
-        print(PLOT_LABELS[k],statistics.mean(stat_dists[k]))
-
-
-def save_everything_calib_data_avg(folder, save_data_folder_pref):
-    list_file = os.listdir(folder)
-    n_skipped = 0
-    n_kept = 0
-    single_q_param_names = ['name', 'T1', 'T2', 'gateError', 'readoutError']
-    #single_q_parameters = [dict.fromkeys(single_q_param_names) for j in range(0, 5)]
-    single_q_parameters = [{} for j in range(0, 5)]
-    multi_q_param_names = ['qubits', 'gateError']
-    #multi_q_parameters = [dict.fromkeys(multi_q_param_names) for j in range(0, 6)]
-    multi_q_parameters = [{} for j in range(0, 6)]
-    fridge_T = []
-    for j, circuit_filename in enumerate(list_file):
-        with open(folder+circuit_filename, 'r') as circuit_file:
-            expe_list = circuit_file.readlines()
-        for expe_data_string in expe_list:
-            try:
-                expe_data = ast.literal_eval(expe_data_string)
-                for i,param in enumerate(expe_data['calibration']['multiQubitGates']):
-                    multi_q_parameters[i]['qubits'] = param['qubits']
-                    for name in multi_q_param_names[1:]:
-                        multi_q_parameters[i].setdefault(name, []).append(convert_parameter(param[name]))
-                for i,param in enumerate(expe_data['calibration']['qubits']):
-                    single_q_parameters[i]['name'] = param['name']
-                    for name in single_q_param_names[1:]:
-                        single_q_parameters[i].setdefault(name, []).append(convert_parameter(param[name]))
-                fridge_T.append(expe_data['calibration']['fridgeParameters']['Temperature']['value'])
-                n_kept += 1
-            except SyntaxError:
-                n_skipped += 1
+    print(data['n_skipped'], data['n_kept'])
+    print('\nAverage performance:\n')
+    for label, average in data['averages']:
+        print(label, average)
+    print('\nPost selection ratios:\n')
+    for label, average in data['post_selection']:
+        print(label, average)
+
+@proftool.profiled('plot_everything_averaged_diff')
+def plot_everything_averaged_diff(folder, logscaley=True, bareindex=1, ci=.99, plot_qasm_count=False, save_data_folder_pref=None,
+                                  ci_method='student', n_resamples=10000, n_workers=1):
+    '''plot_everything_averaged_diff(folder, logscaley=True, bareindex=1, ci=.99, plot_qasm_count=False, save_data_folder_pref=None, ci_method='student', n_resamples=10000, n_workers=1)
+    Plots the average stat_dist of the encoded circuits minus the one of the bare pair bareindex.
+    folder is either a processed data folder or the ProcessedAggregate returned by aggregate_processed_data.
+    With ci_method='bootstrap' the intervals are bootstrapped on the differences, as in plot_everything_averaged.
+    '''
+    import matplotlib.pyplot as plt
+    data = averaged_diff_plot_data(folder, bareindex, ci, ci_method, n_resamples, n_workers)
+    if save_data_folder_pref:
+        write_averaged_diff_plot_data(data, save_data_folder_pref)
+    render_averaged_diff(data, logscaley, plot_qasm_count)
+    plt.show()
+    print(data['n_skipped'], data['n_kept'])
+    for label, average in data['averages']:
+        print(label, average)
+
+
+@proftool.profiled('save_everything_calib_data_avg')
+def save_everything_calib_data_avg(folder, save_data_folder_pref, stats=None):
+    '''save_everything_calib_data_avg(folder, save_data_folder_pref, stats=None)
+    Saves the averages and standard deviations of the calibration parameters over the distinct
+    calibrations of folder, read from its calibration table (or given as calibration_statistics stats).
+    '''
+    if stats is None:
+        stats = calibration_statistics(folder)
     with open(save_data_folder_pref + 'multi_q.dat', 'w') as data_file:
         data_file.write('qubits gateError sigma(gateError)\n')
-        for line in multi_q_parameters:
-            data_file.write('{} {} {}\n'.format('-'.join([str(k) for k in line['qubits']]), statistics.mean(line['gateError']), statistics.stdev(line['gateError'])))
+        for line in stats['multi_q']:
+            data_file.write('{} {} {}\n'.format('-'.join([str(k) for k in line['qubits']]), *line['gateError']))
     with open(save_data_folder_pref + 'single_q.dat', 'w') as data_file:
         data_file.write('name T1 sigma(T1) T2 sigma(T2) gateError sigma(gateError) readoutError sigma(readoutError)\n')
-        for line in single_q_parameters:
-            data_file.write('{0} {1} {5} {2} {6} {3} {7} {4} {8}\n'.format(line['name'], *[statistics.mean(line[name]) for name in single_q_param_names[1:]], *[statistics.stdev(line[name]) for name in single_q_param_names[1:]])) 
+        for line in stats['single_q']:
+            data_file.write('{} {} {} {} {} {} {} {} {}\n'.format(line['name'], *line['T1'], *line['T2'],
+                                                                  *line['gateError'], *line['readoutError']))
     with open(save_data_folder_pref + 'temp.dat', 'w') as data_file:
         data_file.write('T sigma(T)\n')
-        data_file.write('{} {}\n'.format(statistics.mean(fridge_T), statistics.stdev(fridge_T)))
-    print(n_skipped, n_kept)
-    
+        data_file.write('{} {}\n'.format(*stats['temperature']))
+    print(stats['n_calibrations'])
+
+
+# Batch rendering of every figure to files
+##########################################
+FIGURE_RENDERERS = {'averaged': render_averaged,
+                    'averaged_diff': render_averaged_diff,
+                    'calibration': render_calibration}
+
+def figure_name(kind, bareindex=None):
+    '''figure_name(kind, bareindex=None)
+    Name (without extension) of the file of a batch figure: averaged, averaged_diff_bare<pair> or calibration.
+    '''
+    if kind == 'averaged_diff':
+        return 'averaged_diff_bare' + ''.join(c for c in PLOT_LABELS[bareindex] if c.isdigit())
+    return kind
+
+def init_render_worker():
+    '''init_render_worker()
+    Initializer of the render processes: selects the non-interactive Agg backend.
+    '''
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+
+def render_figure_task(task):
+    '''render_figure_task(task)
+    Renders the (kind, data, kwargs, filename) task of figure_tasks to filename.
+    '''
+    import matplotlib.pyplot as plt
+    kind, data, kwargs, filename = task
+    fig = FIGURE_RENDERERS[kind](data, **kwargs)
+    fig.savefig(filename)
+    plt.close(fig)
+    return filename
+
+def figure_tasks(folder, output_folder, fmt='pdf', logscaley=True, ci=.99, ci_method='student', n_resamples=10000,
+                 n_workers=1, save_data_folder_pref=None):
+    '''figure_tasks(folder, output_folder, fmt='pdf', logscaley=True, ci=.99, ci_method='student', n_resamples=10000, n_workers=1, save_data_folder_pref=None)
+    Computes the data of every figure of folder (the .dat files are saved as well if
+    save_data_folder_pref is given) and returns the (kind, data, kwargs, filename) render tasks:
+    averaged.<fmt>, averaged_diff_bare<pair>.<fmt> for the six bare pairs and calibration.<fmt>.
+    '''
+    aggregate = aggregate_processed_data(folder)
+    data = averaged_plot_data(aggregate, ci=ci, ci_method=ci_method, n_resamples=n_resamples, n_workers=n_workers)
+    if save_data_folder_pref:
+        write_averaged_plot_data(data, save_data_folder_pref)
+    tasks = [('averaged', data, {'logscaley': logscaley}, os.path.join(output_folder, figure_name('averaged') + '.' + fmt))]
+    for bareindex in range(0, 6):
+        data = averaged_diff_plot_data(aggregate, bareindex, ci, ci_method, n_resamples, n_workers)
+        if save_data_folder_pref:
+            write_averaged_diff_plot_data(data, save_data_folder_pref)
+        tasks.append(('averaged_diff', data, {'logscaley': logscaley},
+                      os.path.join(output_folder, figure_name('averaged_diff', bareindex) + '.' + fmt)))
+    stats = calibration_statistics(folder)
+    if save_data_folder_pref:
+        save_everything_calib_data_avg(folder, save_data_folder_pref, stats)
+    tasks.append(('calibration', stats, {}, os.path.join(output_folder, figure_name('calibration') + '.' + fmt)))
+    return tasks
+
+@proftool.profiled('render_all_figures')
+def render_all_figures(folder, output_folder, fmt='pdf', logscaley=True, ci=.99, ci_method='student', n_resamples=10000,
+                       n_workers=1, save_data_folder_pref=None):
+    '''render_all_figures(folder, output_folder, fmt='pdf', logscaley=True, ci=.99, ci_method='student', n_resamples=10000, n_workers=1, save_data_folder_pref=None)
+    Batch mode: writes every figure of figure_tasks to output_folder without displaying anything.
+    The statistics are computed once in this process, then the figures are rendered in n_workers
+    processes (Agg backend) if n_workers > 1. Returns the list of written files.
+    '''
+    os.makedirs(output_folder, exist_ok=True)
+    tasks = figure_tasks(folder, output_folder, fmt, logscaley, ci, ci_method, n_resamples, n_workers,
+                         save_data_folder_pref)
+    if n_workers <= 1:
+        return [render_figure_task(task) for task in tasks]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers, initializer=init_render_worker) as pool:
+        return list(pool.map(render_figure_task, tasks))
+
 
 # Plotting one bare run next to one encoded run with the expected output distribution
+@proftool.profiled('plot_one_random_expe')
 def plot_one_random_expe(data_folder, circuit_name, deselect_labels=range(0,12), ci=.99):
-    list_file = [filename for filename in os.listdir(data_folder) if circuit_name in filename]
+    import matplotlib.pyplot as plt
+    from scipy.stats import norm
+    if storetool.is_store(data_folder):
+        data = storetool.load_store(data_folder)
+        store_rows = dict(storetool.group_by_circuit(data))
+        list_file = [filename for filename in store_rows if circuit_name in filename]
+    else:
+        list_file = [filename for filename in os.listdir(data_folder) if circuit_name in filename]
     n_type = len(list_file)
     cmap = plt.cm.get_cmap('Paired')
     colors = [cmap(j/12) for j in [1,5,10,11,4,0,8,9,6,2,3]]
@@ -272,16 +340,18 @@ def plot_one_random_expe(data_folder, circuit_name, deselect_labels=range(0,12),
     hist = []
 
     for j, circuit_filename in enumerate(list_file):
-        with open(data_folder+circuit_filename, 'r') as circuit_file:
-            expe_string = random.choice(circuit_file.readlines())
-        for k, reg_ex in enumerate(RE_LABELS):
-            if reg_ex.match(circuit_filename):
-                index = k
-                break
-        if index in deselect_labels:
+        if storetool.is_store(data_folder):
+            row = random.choice(store_rows[circuit_filename])
+            expe_data = {field: data[field][row].tolist()
+                         for field in ['experimental_distribution_array', 'stand_dev',
+                                       'stat_dist', 'post_selection_ratio']}
+        else:
+            with open(data_folder+circuit_filename, 'r') as circuit_file:
+                expe_data = ast.literal_eval(random.choice(circuit_file.readlines()))
+        index = label_index(circuit_filename)
+        if index is None or index in deselect_labels:
             continue
         else:
-            expe_data = ast.literal_eval(expe_string)
             hist.append(ax.bar(ind+j*width,
                                np.array(expe_data['experimental_distribution_array']),
                                width,
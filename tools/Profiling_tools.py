@@ -0,0 +1,167 @@
+import contextlib
+import cProfile
+import functools
+import json
+import time
+
+# Opt-in stage instrumentation
+##############################
+# The pipeline functions open named stages ('parse_dump', 'decode', 'write_processed',
+# 'statistics', 'plot_everything_averaged', ...) and count the items, bytes read and bytes
+# written they handle. Nothing is recorded unless a Profiler has been started, in which case every
+# stage accumulates its number of calls, its inclusive wall and CPU times, its self times (time
+# not spent in nested stages, e.g. the rendering part of a plot stage) and its counters, globally
+# and per circuit when the stage is given one. Stages ran in worker processes (n_workers > 1) are
+# not recorded, only the ones of the parent process.
+
+_PROFILER = None
+_NO_STAGE = contextlib.nullcontext()
+
+
+def _new_record():
+    return {'calls': 0, 'wall_s': 0., 'cpu_s': 0., 'self_wall_s': 0., 'self_cpu_s': 0.,
+            'items': 0, 'bytes_read': 0, 'bytes_written': 0}
+
+class Profiler:
+    '''Accumulates the stage records of a profiled run, optionally under cProfile as well.
+    '''
+    def __init__(self, cprofile=False):
+        self.stages = {}
+        self.circuits = {}
+        self.cprofile = cProfile.Profile() if cprofile else None
+        self._stack = []
+        self._started = None
+
+    def records(self, stage, circuit=None):
+        records = [self.stages.setdefault(stage, _new_record())]
+        if circuit is not None:
+            records.append(self.circuits.setdefault(circuit, {}).setdefault(stage, _new_record()))
+        return records
+
+    @contextlib.contextmanager
+    def stage(self, stage, circuit=None):
+        records = self.records(stage, circuit)
+        frame = [0., 0.]
+        self._stack.append(frame)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1][0] += wall
+                self._stack[-1][1] += cpu
+            for record in records:
+                record['calls'] += 1
+                record['wall_s'] += wall
+                record['cpu_s'] += cpu
+                record['self_wall_s'] += wall - frame[0]
+                record['self_cpu_s'] += cpu - frame[1]
+
+    def start(self):
+        self._started = (time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime()), time.perf_counter())
+        if self.cprofile is not None:
+            self.cprofile.enable()
+
+    def stop(self):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+
+    def report(self):
+        '''report()
+        JSON serializable report: start date, total wall time, and the records per stage and per circuit.
+        '''
+        return {'date': self._started[0] if self._started else None,
+                'wall_s': time.perf_counter() - self._started[1] if self._started else None,
+                'stages': self.stages,
+                'circuits': self.circuits}
+
+
+def start_profiling(cprofile=False):
+    '''start_profiling(cprofile=False)
+    Starts recording the pipeline stages (and running cProfile if cprofile) and returns the Profiler.
+    '''
+    global _PROFILER
+    _PROFILER = Profiler(cprofile)
+    _PROFILER.start()
+    return _PROFILER
+
+def stop_profiling(report_filename=None, cprofile_filename=None):
+    '''stop_profiling(report_filename=None, cprofile_filename=None)
+    Stops recording and returns the report, written as JSON to report_filename if given. The
+    cProfile statistics are dumped to cprofile_filename (for pstats or snakeviz) if given.
+    '''
+    global _PROFILER
+    profiler, _PROFILER = _PROFILER, None
+    if profiler is None:
+        return None
+    profiler.stop()
+    report = profiler.report()
+    if report_filename:
+        with open(report_filename, 'w') as report_file:
+            json.dump(report, report_file, indent=1)
+    if cprofile_filename and profiler.cprofile is not None:
+        profiler.cprofile.dump_stats(cprofile_filename)
+    return report
+
+@contextlib.contextmanager
+def profiling(report_filename=None, cprofile_filename=None):
+    '''profiling(report_filename=None, cprofile_filename=None)
+    Context manager profiling its body, e.g.
+        with proftool.profiling('data/profile.json', 'data/profile.prof'):
+            exptool.process_all_api_dumps(...)
+    cProfile runs only when cprofile_filename is given.
+    '''
+    profiler = start_profiling(cprofile=cprofile_filename is not None)
+    try:
+        yield profiler
+    finally:
+        stop_profiling(report_filename, cprofile_filename)
+
+def is_profiling():
+    return _PROFILER is not None
+
+def stage(name, circuit=None):
+    '''stage(name, circuit=None)
+    Context manager timing its body as stage name (and as stage name of circuit if given).
+    A shared no-op context when not profiling.
+    '''
+    if _PROFILER is None:
+        return _NO_STAGE
+    return _PROFILER.stage(name, circuit)
+
+def count(name, items=0, bytes_read=0, bytes_written=0, circuit=None):
+    '''count(name, items=0, bytes_read=0, bytes_written=0, circuit=None)
+    Adds to the counters of stage name (and of stage name of circuit if given).
+    '''
+    if _PROFILER is None:
+        return
+    for record in _PROFILER.records(name, circuit):
+        record['items'] += items
+        record['bytes_read'] += bytes_read
+        record['bytes_written'] += bytes_written
+
+def count_circuits(name, circuit_names):
+    '''count_circuits(name, circuit_names)
+    Counts one item of stage name for each circuit of circuit_names (repetitions included), per
+    circuit only: the total of the stage is counted with count.
+    '''
+    if _PROFILER is None:
+        return
+    for circuit in circuit_names:
+        _PROFILER.records(name, circuit)[1]['items'] += 1
+
+def profiled(name):
+    '''profiled(name)
+    Decorator recording every call of the decorated function as stage name.
+    '''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,118 @@
+import hashlib
+import os
+import sqlite3
+
+# Persistent content-addressed index of the circuit names
+#########################################################
+# Decoding a dump needs the names of the circuits every result stands for, found from its QASM.
+# Instead of the dictionary of get_qasm_name_dict, which needs the compiled qobjs of the session,
+# the names are stored at compile time in a sqlite index keyed by the SHA-256 of the normalized
+# compiled QASM (no 'OPENQASM 2.0;' header, one statement per line, whitespace collapsed), so that
+# a QASM of the API results and the compiled one have the same key. New compilations are appended
+# across sessions, and a QasmNameIndex answers the lookups of iter_decoded_batches from disk.
+
+QASM_INDEX_FILENAME = 'data/qasm_names.sqlite'
+
+
+def normalize_qasm(qasm):
+    '''normalize_qasm(qasm)
+    QASM without its 'OPENQASM 2.0;' header, with one statement per line and collapsed whitespace.
+    '''
+    qasm = qasm.strip()
+    if qasm.startswith('OPENQASM 2.0;'):
+        qasm = qasm[len('OPENQASM 2.0;'):]
+    statements = (' '.join(statement.split()) for statement in qasm.split(';'))
+    return '\n'.join(statement + ';' for statement in statements if statement)
+
+def qasm_hash(qasm):
+    '''qasm_hash(qasm)
+    Key of a QASM in the index: SHA-256 (hex) of its normalized form.
+    '''
+    return hashlib.sha256(normalize_qasm(qasm).encode()).hexdigest()
+
+def open_qasm_index(filename=QASM_INDEX_FILENAME):
+    '''open_qasm_index(filename=QASM_INDEX_FILENAME)
+    Opens (and creates if needed) the index database, returns the sqlite3 connection.
+    '''
+    conn = sqlite3.connect(filename)
+    conn.execute('CREATE TABLE IF NOT EXISTS qasm_names ('
+                 'qasm_hash TEXT NOT NULL, '
+                 'name TEXT NOT NULL, '
+                 'PRIMARY KEY (qasm_hash, name)) WITHOUT ROWID')
+    conn.commit()
+    return conn
+
+def add_qasm_names(conn, qasm_names):
+    '''add_qasm_names(conn, qasm_names)
+    Adds the (qasm, name) pairs of the iterable qasm_names to the index, the pairs already in it
+    being ignored. Returns the number of new pairs.
+    '''
+    n_before = conn.total_changes
+    conn.executemany('INSERT OR IGNORE INTO qasm_names (qasm_hash, name) VALUES (?, ?)',
+                     ((qasm_hash(qasm), name) for qasm, name in qasm_names))
+    conn.commit()
+    return conn.total_changes - n_before
+
+def add_compiled_qobjs(conn, compiled_qobj_list):
+    '''add_compiled_qobjs(conn, compiled_qobj_list)
+    Indexes the name of every circuit of the compiled qobjs under its compiled QASM.
+    Returns the number of new pairs.
+    '''
+    return add_qasm_names(conn, ((circuit['compiled_circuit_qasm'], circuit['name'])
+                                 for qobj in compiled_qobj_list for circuit in qobj['circuits']))
+
+def add_qasm_name_dict(conn, dict_qasm_name):
+    '''add_qasm_name_dict(conn, dict_qasm_name)
+    Indexes a dictionary qasm -> names (of get_qasm_name_dict, load_qasm_name_dict or
+    schedule_batches), e.g. to import data/qasm_names.json. Returns the number of new pairs.
+    '''
+    return add_qasm_names(conn, ((qasm, name) for qasm, names in dict_qasm_name.items() for name in names))
+
+
+class QasmNameIndex:
+    '''Read-only view of an index file usable in place of the dictionary qasm -> names:
+    index[qasm] is the sorted list of the names of qasm (KeyError if it has none). The names of
+    every key looked up are cached. The index pickles as its filename, so that it can be sent
+    to the worker processes of process_all_api_dumps, each one opening its own connection.
+    '''
+    def __init__(self, filename=QASM_INDEX_FILENAME):
+        if not os.path.isfile(filename):
+            raise FileNotFoundError(filename)
+        self.filename = filename
+        self._conn = None
+        self._cache = {}
+
+    def __getstate__(self):
+        return {'filename': self.filename}
+
+    def __setstate__(self, state):
+        self.__init__(state['filename'])
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect('file:' + self.filename + '?mode=ro', uri=True, check_same_thread=False)
+        return self._conn
+
+    def _names(self, qasm):
+        key = qasm_hash(qasm)
+        names = self._cache.get(key)
+        if names is None:
+            rows = self._connection().execute('SELECT name FROM qasm_names WHERE qasm_hash = ? ORDER BY name', (key,))
+            names = [row[0] for row in rows]
+            self._cache[key] = names
+        return names
+
+    def __getitem__(self, qasm):
+        names = self._names(qasm)
+        if not names:
+            raise KeyError(qasm)
+        return names
+
+    def get(self, qasm, default=None):
+        return self._names(qasm) or default
+
+    def __contains__(self, qasm):
+        return bool(self._names(qasm))
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(DISTINCT qasm_hash) FROM qasm_names').fetchone()[0]
@@ -0,0 +1,306 @@
+import ast
+import math
+import operator
+import time
+import numpy as np
+
+# Stabilizer simulation of the (Clifford) experiment suite
+##########################################################
+# Every circuit of the suite only uses H, CX, S, X, Z and final measurements, so it can be
+# simulated exactly with a stabilizer tableau. The tableau holds one row per stabilizer
+# generator, with the X and Z parts bit-packed in uint64 words (bit j is qubit j), so every gate
+# is a handful of vectorized bit operations over the rows. The final measurement distribution is
+# uniform over an affine subspace of outcomes, which is sampled for all shots at once.
+
+
+# Parsing of the QASM produced by QISKit (plain or compiled)
+############################################################
+_ANGLE_OPERATORS = {ast.Add: operator.add, ast.Sub: operator.sub,
+                    ast.Mult: operator.mul, ast.Div: operator.truediv}
+
+def _eval_angle(node):
+    if isinstance(node, ast.Expression):
+        return _eval_angle(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return node.value
+    if isinstance(node, ast.Name) and node.id == 'pi':
+        return math.pi
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        value = _eval_angle(node.operand)
+        return -value if isinstance(node.op, ast.USub) else value
+    if isinstance(node, ast.BinOp) and type(node.op) in _ANGLE_OPERATORS:
+        return _ANGLE_OPERATORS[type(node.op)](_eval_angle(node.left), _eval_angle(node.right))
+    raise ValueError('Unsupported angle expression')
+
+def quarter_turns(angle_string):
+    '''quarter_turns(angle_string)
+    Number (mod 4) of quarter turns of a QASM angle such as 'pi/2' or '-1.5707963', which must
+    be a multiple of pi/2 for the gate to be Clifford.
+    '''
+    angle = _eval_angle(ast.parse(angle_string.strip(), mode='eval'))
+    turns = angle/(math.pi/2)
+    if abs(turns - round(turns)) > 1e-6:
+        raise ValueError('Non Clifford angle: ' + angle_string)
+    return int(round(turns)) % 4
+
+def _rotation_ops(gate, angles, qubit):
+    # u1(l) = Rz(l), u2(p, l) = Rz(p).Ry(pi/2).Rz(l), u3(t, p, l) = Rz(p).Ry(t).Rz(l)
+    # up to global phases, with Rz(pi/2) = S and Ry(pi/2) = H.Z
+    turns = [quarter_turns(a) for a in angles]
+    if gate == 'u1':
+        theta, phi, lam = 0, 0, turns[0]
+    elif gate == 'u2':
+        theta, phi, lam = 1, turns[0], turns[1]
+    else:
+        theta, phi, lam = turns
+    return [('s', qubit)]*lam + [('z', qubit), ('h', qubit)]*theta + [('s', qubit)]*phi
+
+def parse_qasm(qasm):
+    '''parse_qasm(qasm)
+    Parses an OPENQASM 2.0 circuit made of Clifford gates (h, x, y, z, s, sdg, cx, id, u1/u2/u3
+    with angles multiple of pi/2) followed by measurements, all on single registers.
+    Returns the numbers of qubits and of classical bits, the list of gates (name, qubits...)
+    and the list of measurements (qubit, classical bit).
+    '''
+    n_qubits = 0
+    n_clbits = 0
+    ops = []
+    measurements = []
+    for statement in qasm.replace('\n', ' ').split(';'):
+        statement = statement.strip()
+        if not statement or statement.startswith(('OPENQASM', 'include', 'barrier')):
+            continue
+        if statement.startswith('qreg'):
+            n_qubits += int(statement.split('[')[1].split(']')[0])
+            continue
+        if statement.startswith('creg'):
+            n_clbits += int(statement.split('[')[1].split(']')[0])
+            continue
+        if statement.startswith('measure'):
+            qubit_arg, clbit_arg = statement[len('measure'):].split('->')
+            measurements.append((int(qubit_arg.split('[')[1].split(']')[0]),
+                                 int(clbit_arg.split('[')[1].split(']')[0])))
+            continue
+        if '(' in statement:
+            gate = statement[:statement.index('(')].strip()
+            angles = statement[statement.index('(')+1:statement.rindex(')')].split(',')
+            args = statement[statement.rindex(')')+1:]
+        else:
+            gate, args = statement.split(None, 1)
+            angles = []
+        qubits = [int(arg.split('[')[1].split(']')[0]) for arg in args.split(',')]
+        if gate in ['u1', 'u2', 'u3']:
+            ops.extend(_rotation_ops(gate, angles, qubits[0]))
+        elif gate == 'sdg':
+            ops.extend([('s', qubits[0])]*3)
+        elif gate == 'y':
+            ops.extend([('z', qubits[0]), ('x', qubits[0])])
+        elif gate in ['h', 'x', 'z', 's']:
+            ops.append((gate, qubits[0]))
+        elif gate == 'cx':
+            ops.append(('cx', qubits[0], qubits[1]))
+        elif gate != 'id':
+            raise ValueError('Unsupported gate for the stabilizer simulator: ' + gate)
+    return n_qubits, n_clbits, ops, measurements
+
+
+# Bit-packed stabilizer tableau
+###############################
+class StabilizerTableau:
+    '''Stabilizer generators of an n qubit state (n <= 64), starting in |0...0>.
+    Row i is (-1)^r[i] X^x[i] Z^z[i] with x[i] and z[i] bit-packed in uint64 words.
+    '''
+    def __init__(self, n_qubits):
+        if n_qubits > 64:
+            raise ValueError('The bit-packed tableau holds at most 64 qubits')
+        self.n_qubits = n_qubits
+        self.x = np.zeros(n_qubits, dtype=np.uint64)
+        self.z = np.left_shift(np.uint64(1), np.arange(n_qubits, dtype=np.uint64))
+        self.r = np.zeros(n_qubits, dtype=np.uint8)
+
+    def _bits(self, words, qubit):
+        return ((words >> np.uint64(qubit)) & np.uint64(1)).astype(np.uint8)
+
+    def h(self, a):
+        xa = self._bits(self.x, a)
+        za = self._bits(self.z, a)
+        self.r ^= xa & za
+        flip = (xa ^ za).astype(np.uint64) << np.uint64(a)
+        self.x ^= flip
+        self.z ^= flip
+
+    def s(self, a):
+        xa = self._bits(self.x, a)
+        self.r ^= xa & self._bits(self.z, a)
+        self.z ^= xa.astype(np.uint64) << np.uint64(a)
+
+    def x_gate(self, a):
+        self.r ^= self._bits(self.z, a)
+
+    def z_gate(self, a):
+        self.r ^= self._bits(self.x, a)
+
+    def cx(self, a, b):
+        xa = self._bits(self.x, a)
+        zb = self._bits(self.z, b)
+        self.r ^= xa & zb & (self._bits(self.x, b) ^ self._bits(self.z, a) ^ 1)
+        self.x ^= xa.astype(np.uint64) << np.uint64(b)
+        self.z ^= zb.astype(np.uint64) << np.uint64(a)
+
+    def apply(self, ops):
+        gates = {'h': self.h, 's': self.s, 'x': self.x_gate, 'z': self.z_gate, 'cx': self.cx}
+        for op in ops:
+            gates[op[0]](*op[1:])
+        return self
+
+    def measurement_affine_space(self):
+        '''measurement_affine_space()
+        Returns (x0, basis): the outcomes of measuring every qubit in the Z basis are uniformly
+        distributed over {x0 ^ (any combination of basis)}, outcomes being bit-packed integers.
+        '''
+        n = self.n_qubits
+        x = [int(w) for w in self.x]
+        z = [int(w) for w in self.z]
+        r = [int(p) for p in self.r]
+
+        def rowsum(h, i):
+            # row h <- row i * row h, with the phase from the products of single qubit Paulis
+            y1, x1, z1 = x[i] & z[i], x[i] & ~z[i], ~x[i] & z[i]
+            plus = (y1 & z[h] & ~x[h]) | (x1 & z[h] & x[h]) | (z1 & x[h] & ~z[h])
+            minus = (y1 & x[h] & ~z[h]) | (x1 & z[h] & ~x[h]) | (z1 & x[h] & z[h])
+            exponent = (2*r[h] + 2*r[i] + bin(plus).count('1') - bin(minus).count('1')) % 4
+            r[h] = exponent//2
+            x[h] ^= x[i]
+            z[h] ^= z[i]
+
+        # Echelon form of the X parts, the remaining rows are Z type stabilizers
+        rank = 0
+        for qubit in range(n):
+            pivot = next((i for i in range(rank, n) if (x[i] >> qubit) & 1), None)
+            if pivot is None:
+                continue
+            for lst in (x, z, r):
+                lst[rank], lst[pivot] = lst[pivot], lst[rank]
+            for i in range(n):
+                if i != rank and (x[i] >> qubit) & 1:
+                    rowsum(i, rank)
+            rank += 1
+        # Outcomes solve z.outcome = r for the Z type stabilizers
+        equations = [[z[i], r[i]] for i in range(rank, n)]
+        pivots = []
+        used = set()
+        for qubit in range(n):
+            pivot = next((k for k, e in enumerate(equations) if not k in used and (e[0] >> qubit) & 1), None)
+            if pivot is None:
+                continue
+            used.add(pivot)
+            for k, e in enumerate(equations):
+                if k != pivot and (e[0] >> qubit) & 1:
+                    e[0] ^= equations[pivot][0]
+                    e[1] ^= equations[pivot][1]
+            pivots.append((qubit, equations[pivot]))
+        x0 = 0
+        for qubit, (mask, parity) in pivots:
+            if parity:
+                x0 |= 1 << qubit
+        pivot_qubits = [qubit for qubit, _ in pivots]
+        basis = []
+        for free in range(n):
+            if free in pivot_qubits:
+                continue
+            vector = 1 << free
+            for qubit, (mask, parity) in pivots:
+                if (mask >> free) & 1:
+                    vector |= 1 << qubit
+            basis.append(vector)
+        return x0, basis
+
+
+# Sampling and result formatting
+################################
+def sample_qubit_words(x0, basis, shots, rng):
+    '''sample_qubit_words(x0, basis, shots, rng)
+    Draws shots outcomes of the affine space (x0, basis) of measurement_affine_space,
+    as bit-packed uint64 words (bit j is qubit j).
+    '''
+    words = np.full(shots, x0, dtype=np.uint64)
+    for vector in basis:
+        words ^= rng.integers(0, 2, size=shots, dtype=np.uint64)*np.uint64(vector)
+    return words
+
+def words_to_clbits(words, measurements):
+    '''words_to_clbits(words, measurements)
+    Classical outcomes (bit j is the classical bit j) of bit-packed qubit outcomes words,
+    for the list of measurements (qubit, classical bit).
+    '''
+    outcomes = np.zeros(len(words), dtype=np.int64)
+    for qubit, clbit in measurements:
+        outcomes |= ((words >> np.uint64(qubit)) & np.uint64(1)).astype(np.int64) << clbit
+    return outcomes
+
+def sample_outcomes(qasm, shots=8192, rng=None):
+    '''sample_outcomes(qasm, shots=8192, rng=None)
+    Simulates the QASM circuit and returns the array of the shots classical outcomes,
+    as integers whose bit j is the classical bit j.
+    '''
+    if rng is None:
+        rng = np.random.default_rng()
+    n_qubits, n_clbits, ops, measurements = parse_qasm(qasm)
+    x0, basis = StabilizerTableau(n_qubits).apply(ops).measurement_affine_space()
+    return words_to_clbits(sample_qubit_words(x0, basis, shots, rng), measurements)
+
+def sample_counts(qasm, shots=8192, rng=None):
+    '''sample_counts(qasm, shots=8192, rng=None)
+    Simulates the QASM circuit and returns its counts dictionary in the format of the API results.
+    '''
+    n_clbits = parse_qasm(qasm)[1]
+    histogram = np.bincount(sample_outcomes(qasm, shots, rng), minlength=2**n_clbits)
+    return {format(outcome, '0{}b'.format(n_clbits)): int(count)
+            for outcome, count in enumerate(histogram) if count > 0}
+
+def simulate_job(quantump, circuit_names, shots=8192, seed=None, calibration=None, job_id='simulated'):
+    '''simulate_job(quantump, circuit_names, shots=8192, seed=None, calibration=None, job_id='simulated')
+    Simulates the named circuits of quantump and returns a job result shaped like the API dumps
+    written by fetch_previous ({'id', 'status', 'calibration', 'qasms': [{'qasm', 'data'}]}), ready
+    for decode_api_dump/process_api_dump. Build its dict_qasm_name with simulated_qasm_name_dict.
+    '''
+    rng = np.random.default_rng(seed)
+    date = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+    qasms = []
+    for name in circuit_names:
+        qasm = quantump.get_qasm(name)
+        qasms.append({'qasm': qasm[len('OPENQASM 2.0;'):] if qasm.startswith('OPENQASM 2.0;') else qasm,
+                      'data': {'counts': sample_counts(qasm, shots, rng), 'date': date}})
+    return {'id': job_id, 'status': 'COMPLETED', 'calibration': calibration, 'qasms': qasms}
+
+def simulated_qasm_name_dict(quantump, circuit_names):
+    '''simulated_qasm_name_dict(quantump, circuit_names)
+    Dictionary from QASM to circuit names, as get_qasm_name_dict, for the jobs of simulate_job.
+    '''
+    dictionary = {}
+    for name in circuit_names:
+        qasm = quantump.get_qasm(name)
+        if not qasm.startswith('OPENQASM 2.0;'):
+            qasm = 'OPENQASM 2.0;' + qasm
+        dictionary.setdefault(qasm, []).append(name)
+    return dictionary
+
+class SimulatedResult:
+    '''Result of simulate_job with the interface post_treatment and post_treatment_list use.
+    '''
+    def __init__(self, job_result, circuit_names):
+        self.job_result = job_result
+        self.circuit_names = list(circuit_names)
+        self._positions = {name: k for k, name in enumerate(self.circuit_names)}
+
+    def get_status(self):
+        return self.job_result['status']
+
+    def get_job_id(self):
+        return self.job_result['id']
+
+    def get_names(self):
+        return self.circuit_names
+
+    def get_data(self, name):
+        return self.job_result['qasms'][self._positions[name]]['data']
@@ -0,0 +1,181 @@
+import ast
+import json
+import os
+import numpy as np
+
+import tools.Experiment_tools as exptool
+import tools.Calibration_tools as calibtool
+
+# Columnar, memory-mappable store for the processed data
+########################################################
+# A store is a folder holding one raw binary file per column (fixed width, little endian)
+# plus a meta.json with the number of rows and the dictionaries used to encode the
+# string columns. The columns are appended to and read back with np.memmap, so loading
+# a store costs one mmap per column instead of one ast.literal_eval per experiment.
+
+COUNT_KEYS = ['00', '01', '10', '11', 'err', 'total_valid']
+
+STORE_COLUMNS = [('stat_dist', '<f8', ()),
+                 ('stat_dist_stand_dev', '<f8', ()),
+                 ('post_selection_ratio', '<f8', ()),
+                 ('qasm_count', '<i4', ()),
+                 ('experimental_distribution_array', '<f8', (4,)),
+                 ('expected_distribution_array', '<f8', (4,)),
+                 ('stand_dev', '<f8', (4,)),
+                 ('counts', '<i8', (len(COUNT_KEYS),)),
+                 ('raw_counts', '<u4', (32,)),
+                 ('name', '<i4', ()),
+                 ('label', '<i4', ()),
+                 ('version', '<i4', ()),
+                 ('calibration', '<i4', ())]
+
+DICTIONARY_COLUMNS = ['name', 'label', 'version']
+
+
+def is_store(folder):
+    '''is_store(folder)
+    Tells whether folder holds a columnar store rather than text Processed_data files.
+    '''
+    return os.path.isfile(os.path.join(folder, 'meta.json'))
+
+def _read_meta(store_folder):
+    if not is_store(store_folder):
+        return {'n_rows': 0,
+                'n_calibrations': 0,
+                'calibrations_size': 0,
+                'columns': [[name, dtype, list(shape)] for name, dtype, shape in STORE_COLUMNS],
+                'dictionaries': {col: [] for col in DICTIONARY_COLUMNS}}
+    with open(os.path.join(store_folder, 'meta.json'), 'r') as meta_file:
+        return json.load(meta_file)
+
+def _write_meta(store_folder, meta):
+    tmp_name = os.path.join(store_folder, 'meta.json.tmp')
+    with open(tmp_name, 'w') as meta_file:
+        json.dump(meta, meta_file)
+    os.replace(tmp_name, os.path.join(store_folder, 'meta.json'))
+
+def _read_calibrations(store_folder, n_calibrations):
+    calibrations = []
+    filename = os.path.join(store_folder, 'calibrations.jsonl')
+    if os.path.isfile(filename):
+        with open(filename, 'r') as calib_file:
+            for line in calib_file:
+                if len(calibrations) == n_calibrations:
+                    break
+                calibrations.append(json.loads(line))
+    return calibrations
+
+def _encode_raw_counts(raw_counts):
+    vector = np.zeros(32, dtype='<u4')
+    for key, value in raw_counts.items():
+        vector[int(key, 2)] += value
+    return vector
+
+def append_to_store(store_folder, entries):
+    '''append_to_store(store_folder, entries)
+    Appends the processed entries (as returned by api_data_to_dict, with their calibration)
+    to the columnar store in store_folder, creating it if needed. Returns the number of rows.
+    '''
+    os.makedirs(store_folder, exist_ok=True)
+    meta = _read_meta(store_folder)
+    n_rows = meta['n_rows']
+    dictionaries = meta['dictionaries']
+    codes = {col: {v: k for k, v in enumerate(dictionaries[col])} for col in DICTIONARY_COLUMNS}
+    calibrations = _read_calibrations(store_folder, meta['n_calibrations'])
+    calib_codes = {json.dumps(c, sort_keys=True): k for k, c in enumerate(calibrations)}
+    new_calibrations = []
+
+    columns = {name: [] for name, _, _ in STORE_COLUMNS}
+    for entry in entries:
+        for name in ['stat_dist', 'stat_dist_stand_dev', 'post_selection_ratio', 'qasm_count',
+                     'experimental_distribution_array', 'expected_distribution_array', 'stand_dev']:
+            columns[name].append(entry[name])
+        columns['counts'].append([entry['counts'][key] for key in COUNT_KEYS])
+        columns['raw_counts'].append(_encode_raw_counts(entry.get('raw_counts', {})))
+        string_values = {'name': entry['name'],
+                         'label': exptool.circuit_label(entry['name']),
+                         'version': entry['version']}
+        for col in DICTIONARY_COLUMNS:
+            value = string_values[col]
+            if value not in codes[col]:
+                codes[col][value] = len(dictionaries[col])
+                dictionaries[col].append(value)
+            columns[col].append(codes[col][value])
+        calib_key = json.dumps(entry.get('calibration'), sort_keys=True)
+        if calib_key not in calib_codes:
+            calib_codes[calib_key] = len(calibrations) + len(new_calibrations)
+            new_calibrations.append(calib_key)
+        columns['calibration'].append(calib_codes[calib_key])
+
+    # Rows past meta['n_rows'] come from an interrupted append and are dropped first
+    for name, dtype, shape in STORE_COLUMNS:
+        filename = os.path.join(store_folder, name + '.bin')
+        row_size = np.dtype(dtype).itemsize*int(np.prod(shape))
+        with open(filename, 'ab') as column_file:
+            column_file.truncate(n_rows*row_size)
+            column_file.write(np.asarray(columns[name], dtype=dtype).reshape((-1,)+shape).tobytes())
+    with open(os.path.join(store_folder, 'calibrations.jsonl'), 'ab') as calib_file:
+        calib_file.truncate(meta['calibrations_size'])
+        for calib_key in new_calibrations:
+            calib_file.write((calib_key + '\n').encode())
+        meta['calibrations_size'] = calib_file.seek(0, os.SEEK_END)
+
+    meta['n_rows'] = n_rows + len(entries)
+    meta['n_calibrations'] = len(calibrations) + len(new_calibrations)
+    _write_meta(store_folder, meta)
+    return meta['n_rows']
+
+def load_store(store_folder):
+    '''load_store(store_folder)
+    Returns a dictionary of read-only arrays memory-mapped from the store, one per column,
+    together with the decoding lists for the dictionary columns ('names', 'labels', 'versions')
+    and the list of distinct 'calibrations'.
+    '''
+    meta = _read_meta(store_folder)
+    n_rows = meta['n_rows']
+    data = {}
+    for name, dtype, shape in STORE_COLUMNS:
+        if n_rows == 0:
+            data[name] = np.zeros((0,)+shape, dtype=dtype)
+        else:
+            data[name] = np.memmap(os.path.join(store_folder, name + '.bin'),
+                                   dtype=dtype, mode='r', shape=(n_rows,)+shape)
+    for col in DICTIONARY_COLUMNS:
+        data[col + 's'] = meta['dictionaries'][col]
+    data['calibrations'] = _read_calibrations(store_folder, meta['n_calibrations'])
+    return data
+
+def convert_processed_folder(folder, store_folder):
+    '''convert_processed_folder(folder, store_folder)
+    One-shot converter of a text Processed_data folder (one str(dict) per line) into a store.
+    Calibration references are resolved with the calibration table of the folder.
+    Returns the number of skipped and converted lines.
+    '''
+    n_skipped = 0
+    n_converted = 0
+    calibrations = calibtool.load_calibration_table(folder)
+    for circuit_filename in sorted(os.listdir(folder)):
+        entries = []
+        with open(os.path.join(folder, circuit_filename), 'r') as circuit_file:
+            for expe_data_string in circuit_file:
+                try:
+                    entry = ast.literal_eval(expe_data_string)
+                except SyntaxError:
+                    n_skipped += 1
+                    continue
+                entry['calibration'] = calibtool.resolve_calibration(entry.get('calibration'), calibrations)
+                entries.append(entry)
+        if entries:
+            append_to_store(store_folder, entries)
+            n_converted += len(entries)
+    return n_skipped, n_converted
+
+def group_by_circuit(data):
+    '''group_by_circuit(data)
+    Returns a list of (circuit_filename, rows) for every circuit of a loaded store, where
+    circuit_filename mimics the text layout (name + '.txt') and rows indexes its experiments.
+    '''
+    order = np.argsort(data['name'], kind='stable')
+    bounds = np.flatnonzero(np.diff(np.asarray(data['name'])[order])) + 1
+    return [(data['names'][data['name'][rows[0]]] + '.txt', rows)
+            for rows in np.split(order, bounds) if len(rows) > 0]
@@ -0,0 +1,247 @@
+# Generated suites of gate sequences
+####################################
+# CIRCUITS is a hand-picked list of sequences of the encoded gates. A generated suite holds one
+# sequence of every distinct logical Clifford reachable with at most max_length gates, on every
+# input state. The sequences are not enumerated one by one but breadth first on their Clifford
+# tableaux: a tableau is the list of the images of X1, X2, Z1, Z2 under the circuit (x bits,
+# z bits and sign bit, as in Aaronson and Gottesman), two sequences are the same logical Clifford
+# up to a global phase exactly when their tableaux are equal, and only the tableaux new at a
+# length are extended to the next one. The gates are conjugated as they are implemented:
+#  - encoded: transversal gates on the codewords of CODEWORDS, the HHS being H H followed by the
+#    swap of the logical qubits and the CZ (S on the four data qubits) being CZ Z1 Z2,
+#  - bare: the gates of bare_gate_keys on the pair, the bZ1 being a Z on pair[1] like the bZ2
+#    and an odd number of HHS swapping the roles of the qubits of the pair in the decoding.
+# The two versions of a sequence can thus differ, and a sequence is only kept when its bare and
+# encoded versions have the same expected distribution on its input state. The classes are the
+# (input state, encoded tableau) pairs, and the representative of a class is its shortest
+# sequence, then the one with the fewest compiled CX and single qubit gates (compiled_operations).
+# The rows are packed in 5 bit integers (x bits, z bits << 2, sign << 4), every gate being a
+# precomputed permutation of the 32 rows, and the tableaux are hashed as tuples of packed rows.
+
+SUITE_GATES = ['X1', 'X2', 'Z1', 'Z2', 'HHS', 'CZ']
+INPUT_STATES = ['|00>', '|0+>', '|00>+|11>']
+
+# Rows (x bits, z bits, sign bit) of the tableau of the identity and of the stabilizer generators
+# of the input states, bit q for the qubit q (logical qubit q + 1, qubit pair[q] of the bare version)
+IDENTITY_TABLEAU = [(1, 0, 0), (2, 0, 0), (0, 1, 0), (0, 2, 0)]
+STATE_STABILIZERS = {'|00>': [(0, 1, 0), (0, 2, 0)],
+                     '|0+>': [(0, 1, 0), (2, 0, 0)],
+                     '|00>+|11>': [(3, 0, 0), (0, 3, 0)]}
+
+
+# Conjugation of the rows by the gates
+######################################
+def _bit(value, q):
+    return (value >> q) & 1
+
+def _h(row, q):
+    x, z, r = row
+    flip = (_bit(x, q) ^ _bit(z, q)) << q
+    return (x ^ flip, z ^ flip, r ^ (_bit(x, q) & _bit(z, q)))
+
+def _x(row, q):
+    return (row[0], row[1], row[2] ^ _bit(row[1], q))
+
+def _z(row, q):
+    return (row[0], row[1], row[2] ^ _bit(row[0], q))
+
+def _cz(row):
+    x, z, r = row
+    return (x, z ^ (_bit(x, 1) | (_bit(x, 0) << 1)), r ^ (_bit(x, 0) & _bit(x, 1) & (_bit(z, 0) ^ _bit(z, 1))))
+
+def _swap(row):
+    x, z, r = row
+    return (((x & 1) << 1) | (x >> 1), ((z & 1) << 1) | (z >> 1), r)
+
+def _pack(row):
+    return row[0] | (row[1] << 2) | (row[2] << 4)
+
+def _unpack(row):
+    return (row & 3, (row >> 2) & 3, row >> 4)
+
+def _row_map(*ops):
+    # Permutation of the 32 packed rows done by the conjugation with the ops, in order
+    rows = [_unpack(row) for row in range(32)]
+    for op in ops:
+        rows = [op(row) for row in rows]
+    return [_pack(row) for row in rows]
+
+_SWAP_MAP = _row_map(_swap)
+ENCODED_ROW_MAPS = {'X1': _row_map(lambda row: _x(row, 0)),
+                    'X2': _row_map(lambda row: _x(row, 1)),
+                    'Z1': _row_map(lambda row: _z(row, 0)),
+                    'Z2': _row_map(lambda row: _z(row, 1)),
+                    'HHS': _row_map(lambda row: _h(row, 0), lambda row: _h(row, 1), _swap),
+                    'CZ': _row_map(_cz, lambda row: _z(row, 0), lambda row: _z(row, 1))}
+# Bare gates on (pair[0], pair[1]) after an even (0) or odd (1) number of HHS
+BARE_ROW_MAPS = {}
+for _parity in [0, 1]:
+    BARE_ROW_MAPS['X1', _parity] = _row_map(lambda row, q=_parity: _x(row, q))
+    BARE_ROW_MAPS['X2', _parity] = _row_map(lambda row, q=1-_parity: _x(row, q))
+    BARE_ROW_MAPS['Z1', _parity] = _row_map(lambda row: _z(row, 1))
+    BARE_ROW_MAPS['Z2', _parity] = _row_map(lambda row: _z(row, 1))
+    BARE_ROW_MAPS['HHS', _parity] = _row_map(lambda row: _h(row, 0), lambda row: _h(row, 1))
+    BARE_ROW_MAPS['CZ', _parity] = _row_map(_cz)
+
+# The tracked rows: the tableau, then the two stabilizer generators of every input state
+_INITIAL_ROWS = tuple(_pack(row) for row in IDENTITY_TABLEAU
+                      + [row for state in INPUT_STATES for row in STATE_STABILIZERS[state]])
+
+def _apply(rows, row_map):
+    return tuple(row_map[row] for row in rows)
+
+def _tracked_rows(gates):
+    # Tracked rows of the encoded and the bare versions of gates, with the parity of the HHS
+    encoded = bare = _INITIAL_ROWS
+    parity = 0
+    for gate in gates:
+        encoded = _apply(encoded, ENCODED_ROW_MAPS[gate])
+        bare = _apply(bare, BARE_ROW_MAPS[gate, parity])
+        parity ^= gate == 'HHS'
+    return encoded, bare, parity
+
+def clifford_tableau(gates, version='encoded'):
+    '''clifford_tableau(gates, version='encoded')
+    Tableau of the logical Clifford of the sequence gates (first gate applied first) in version
+    'encoded' or 'bare' (the swap of the qubits of the pair by an odd number of HHS included):
+    the images of X1, X2, Z1, Z2 as (x bits, z bits, sign bit), bit q for the qubit q.
+    Two sequences have the same tableau when they are the same Clifford up to a global phase.
+    '''
+    encoded, bare, parity = _tracked_rows(gates)
+    rows = encoded if version == 'encoded' else (_apply(bare, _SWAP_MAP) if parity else bare)
+    return [_unpack(row) for row in rows[:4]]
+
+
+# Expected distributions
+########################
+def _phase_exponent(x1, z1, x2, z2):
+    # Power of i of the product of the single qubit Paulis (x1, z1) (x2, z2)
+    if x1 == z1 == 0:
+        return 0
+    if x1 == z1 == 1:
+        return z2 - x2
+    if x1 == 1:
+        return z2*(2*x2 - 1)
+    return x2*(1 - 2*z2)
+
+def _product(row1, row2):
+    x1, z1, r1 = _unpack(row1)
+    x2, z2, r2 = _unpack(row2)
+    exponent = 2*r1 + 2*r2 + sum(_phase_exponent(_bit(x1, q), _bit(z1, q), _bit(x2, q), _bit(z2, q)) for q in [0, 1])
+    return _pack((x1 ^ x2, z1 ^ z2, (exponent % 4) // 2))
+
+def stabilizer_distribution(row1, row2, swap=False):
+    '''stabilizer_distribution(row1, row2, swap=False)
+    Distribution over '00', '01', '10', '11' (bit q read from the right for the qubit q, swapped
+    if swap) of the Z measurement of the state stabilized by the packed rows row1 and row2:
+    the average over its stabilizers that are products of Z of their signed parity.
+    '''
+    distribution = [0.]*4
+    for row in [_pack((0, 0, 0)), row1, row2, _product(row1, row2)]:
+        x, z, r = _unpack(row)
+        if x == 0:
+            if swap:
+                z = _unpack(_SWAP_MAP[z << 2])[1]
+            for outcome in range(4):
+                distribution[outcome] += (-1)**(r + bin(outcome & z).count('1'))/4
+    return distribution
+
+def _distributions(rows, parity, swap_on_odd):
+    # Expected distribution of every input state from the tracked rows
+    swap = swap_on_odd and parity == 1
+    return [stabilizer_distribution(rows[4 + 2*k], rows[5 + 2*k], swap) for k in range(len(INPUT_STATES))]
+
+def expected_distribution(gates, state, version='encoded'):
+    '''expected_distribution(gates, state, version='encoded')
+    Expected distribution over '00', '01', '10', '11' of the sequence gates on the input state in
+    version 'encoded' or 'bare' (decoded as the bare results are).
+    '''
+    encoded, bare, parity = _tracked_rows(gates)
+    if version == 'encoded':
+        return _distributions(encoded, 0, False)[INPUT_STATES.index(state)]
+    return _distributions(bare, parity, True)[INPUT_STATES.index(state)]
+
+
+# Compiled size of the sequences
+################################
+_BARE_OPS = {'X1': lambda p: [('x', p)], 'X2': lambda p: [('x', 1 - p)], 'Z1': lambda p: [('z', 1)],
+             'Z2': lambda p: [('z', 1)], 'HHS': lambda p: [('h', 0), ('h', 1)],
+             'CZ': lambda p: [('h', 1), ('cx', 0, 1), ('h', 1)]}
+_ENCODED_OPS = {'X1': [('x', 0), ('x', 1)], 'X2': [('x', 0), ('x', 2)], 'Z1': [('z', 1), ('z', 3)],
+                'Z2': [('z', 2), ('z', 3)], 'HHS': [('h', q) for q in range(4)], 'CZ': [('s', q) for q in range(4)]}
+
+def _operation_counts(ops):
+    # Numbers of CX and of physical single qubit gates, counted as in Mapping_tools.circuit_operations
+    n_cx = 0
+    n_single = 0
+    pending = {}
+    for op in ops:
+        if op[0] == 'cx':
+            n_cx += 1
+            n_single += pending.pop(op[1], False) + pending.pop(op[2], False)
+        else:
+            pending[op[1]] = pending.get(op[1], False) or op[0] not in ['z', 's']
+    return n_cx, n_single + sum(pending.values())
+
+def compiled_operations(gates):
+    '''compiled_operations(gates)
+    Numbers of CX and of physical single qubit gates of the sequence gates after compilation,
+    summed over its bare and encoded versions (preparations and measurements excluded): a run of
+    single qubit gates on a qubit is one gate, a run of z and s only is free.
+    '''
+    bare_ops = []
+    parity = 0
+    for gate in gates:
+        bare_ops.extend(_BARE_OPS[gate](parity))
+        parity ^= gate == 'HHS'
+    bare = _operation_counts(bare_ops)
+    encoded = _operation_counts([op for gate in gates for op in _ENCODED_OPS[gate]])
+    return bare[0] + encoded[0], bare[1] + encoded[1]
+
+
+# Generation of the suite
+#########################
+def generate_suite(max_length, states=INPUT_STATES, gates=SUITE_GATES):
+    '''generate_suite(max_length, states=INPUT_STATES, gates=SUITE_GATES)
+    One sequence of at most max_length of the gates for every distinct encoded logical Clifford
+    and input state of states, its bare and encoded versions having the same expected
+    distribution, as CIRCUITS-like entries [gates, state, expected distribution] sorted by state,
+    length and gates. all_circuits builds them with circuits=entries once they are registered
+    with Experiment_tools.add_circuits. The empty sequence of every state is included: it is the
+    entry [[], state, ...] of CIRCUITS (a preparation followed by the measurements), which
+    add_circuits keeps as it is.
+    '''
+    initial = (_INITIAL_ROWS, _INITIAL_ROWS, 0)
+    reached = {(_INITIAL_ROWS[:4], _INITIAL_ROWS[:4], 0): ((), initial)}
+    level = dict(reached)
+    for length in range(1, max_length + 1):
+        new = {}
+        for sequence, (encoded, bare, parity) in level.values():
+            for gate in gates:
+                next_encoded = _apply(encoded, ENCODED_ROW_MAPS[gate])
+                next_bare = _apply(bare, BARE_ROW_MAPS[gate, parity])
+                next_parity = parity ^ (gate == 'HHS')
+                key = (next_encoded[:4], next_bare[:4], next_parity)
+                if key in reached:
+                    continue
+                candidate = sequence + (gate,)
+                best = new.get(key)
+                if best is None or (compiled_operations(candidate), candidate) < (compiled_operations(best[0]), best[0]):
+                    new[key] = (candidate, (next_encoded, next_bare, next_parity))
+        reached.update(new)
+        level = new
+
+    representatives = {}
+    for sequence, (encoded, bare, parity) in reached.values():
+        encoded_distributions = _distributions(encoded, 0, False)
+        bare_distributions = _distributions(bare, parity, True)
+        preference = (len(sequence), compiled_operations(sequence), sequence)
+        for k, state in enumerate(INPUT_STATES):
+            if state not in states or encoded_distributions[k] != bare_distributions[k]:
+                continue
+            key = (state, encoded[:4])
+            if key not in representatives or preference < representatives[key][0]:
+                representatives[key] = (preference, encoded_distributions[k])
+    entries = [[list(preference[2]), state, distribution]
+               for (state, tableau), (preference, distribution) in representatives.items()]
+    return sorted(entries, key=lambda entry: (INPUT_STATES.index(entry[1]), len(entry[0]), entry[0]))
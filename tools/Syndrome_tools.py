@@ -0,0 +1,137 @@
+import numpy as np
+
+import tools.Experiment_tools as exptool
+import tools.Storage_tools as storetool
+import tools.Timeline_tools as timetool
+
+# Syndrome histograms of the encoded circuits
+#############################################
+# The decoding of the encoded runs keeps the outcomes that are codewords of the [[4,2,2]] code and
+# counts all the others as 'err'. The errors are classified here instead: the four data qubits
+# (the qubits of MAPPING) and the fifth qubit (the ancilla of the fault-tolerant |00>
+# preparations) are measured in the Z basis, so an outcome shows a violation of the ZZZZ
+# stabilizer when its data bits have odd parity, and a raised flag when the ancilla reads 1.
+# The 32 outcomes fall into 24 classes: the 4 logical outcomes without and with flag, and the 8
+# odd data patterns without and with flag. An odd pattern without flag is explained by a single
+# flip of any of the four data qubits (the code detects but cannot correct it), an even flagged
+# outcome by a flip of the ancilla, an odd flagged one by no single flip.
+# The histograms of many runs are computed in one np.bincount over their raw counts.
+
+LOGICAL_OUTCOMES = ['00', '01', '10', '11']
+
+
+def syndrome_table(mapping=exptool.MAPPING, n_bits=5):
+    '''syndrome_table(mapping=exptool.MAPPING, n_bits=5)
+    Classification of the 2^n_bits outcomes of the encoded circuits measured with mapping:
+    {'classes': names of the classes, 'class_of_outcome': array of the class of every outcome,
+    'violated': per class, the checks it violates ([], ['ZZZZ'], ['flag'] or both),
+    'single_flips': per class, the (clbit, logical outcome) of every single flip making it a
+    codeword, 'logical': per class, the logical outcome of the codeword classes (None otherwise)}.
+    The odd classes are named by their data bits, the bit of the qubit mapping[0] first.
+    '''
+    codewords = {}
+    for logical, codeword_list in zip(LOGICAL_OUTCOMES, exptool.mapped_codewords(mapping, n_bits)):
+        for codeword in codeword_list:
+            codewords[int(codeword, 2)] = logical
+    ancillas = [bit for bit in range(n_bits) if bit not in mapping]
+    classes = []
+    class_index = {}
+    table = {'class_of_outcome': np.zeros(2**n_bits, dtype=np.intp), 'violated': [], 'single_flips': [], 'logical': []}
+    for flag in [0, 1]:
+        for logical in LOGICAL_OUTCOMES:
+            class_index[('codeword', flag, logical)] = len(classes)
+            classes.append(('flag ' if flag else '') + 'codeword ' + logical)
+            table['violated'].append(['flag'] if flag else [])
+            table['logical'].append(logical)
+        for pattern in range(2**len(mapping)):
+            if bin(pattern).count('1') % 2 == 1:
+                class_index[('odd', flag, pattern)] = len(classes)
+                classes.append(('flag ' if flag else '') + 'ZZZZ ' + format(pattern, '0' + str(len(mapping)) + 'b'))
+                table['violated'].append(['ZZZZ', 'flag'] if flag else ['ZZZZ'])
+                table['logical'].append(None)
+    table['classes'] = classes
+    table['single_flips'] = [set() for _ in classes]
+    for outcome in range(2**n_bits):
+        flag = int(any((outcome >> bit) & 1 for bit in ancillas))
+        data = sum(((outcome >> qubit) & 1) << (len(mapping) - 1 - k) for k, qubit in enumerate(mapping))
+        codeword = codewords.get(outcome & ~sum(1 << bit for bit in ancillas))
+        key = ('codeword', flag, codeword) if bin(data).count('1') % 2 == 0 else ('odd', flag, data)
+        table['class_of_outcome'][outcome] = class_index[key]
+        for bit in range(n_bits):
+            if (outcome ^ (1 << bit)) in codewords:
+                table['single_flips'][class_index[key]].add((bit, codewords[outcome ^ (1 << bit)]))
+    table['single_flips'] = [sorted(flips) for flips in table['single_flips']]
+    table['class_of_outcome'].setflags(write=False)
+    return table
+
+SYNDROME_TABLE = syndrome_table()
+
+
+# Vectorized aggregation
+########################
+def syndrome_histograms(raw_counts, keys, table=SYNDROME_TABLE):
+    '''syndrome_histograms(raw_counts, keys, table=SYNDROME_TABLE)
+    Syndrome histograms of runs grouped by keys: raw_counts is (n, 32), keys a list of arrays of
+    length n (one per grouping column). Returns the (n_groups, len(keys)) distinct key rows and the
+    (n_groups, n_classes) histograms, computed in one np.bincount.
+    '''
+    raw_counts = np.asarray(raw_counts)
+    n_classes = len(table['classes'])
+    if len(raw_counts) == 0:
+        return np.zeros((0, len(keys)), dtype=np.int64), np.zeros((0, n_classes), dtype=np.int64)
+    key_rows, groups = np.unique(np.column_stack([np.asarray(key) for key in keys]), axis=0, return_inverse=True)
+    index = groups.reshape(-1, 1)*n_classes + table['class_of_outcome'][np.arange(raw_counts.shape[1])]
+    histograms = np.bincount(index.ravel(), weights=raw_counts.ravel(), minlength=len(key_rows)*n_classes)
+    return key_rows, np.rint(histograms).astype(np.int64).reshape(len(key_rows), n_classes)
+
+def _window_codes(timestamps, window, origin=None):
+    # Index of the window of window seconds (from origin, the first date if None) of every date
+    timestamps = np.asarray(timestamps, dtype=float)
+    if origin is None:
+        origin = np.nanmin(timestamps) if len(timestamps) else 0.
+    return np.where(np.isnan(timestamps), -1, np.floor((timestamps - origin)/window)).astype(np.int64), origin
+
+def _group_histograms(raw_counts, columns, by, table):
+    # Histograms keyed by tuples of the decoded values of the columns of by
+    key_rows, histograms = syndrome_histograms(raw_counts, [columns[column][0] for column in by], table)
+    return {tuple(columns[column][1](code) for column, code in zip(by, key_row)): histogram
+            for key_row, histogram in zip(key_rows, histograms)}
+
+def _encoded_columns(names, name_codes):
+    # Rows of the encoded runs among the runs of name codes name_codes, and their 'name' and 'version' columns
+    records = [exptool.circuit_record(name) for name in names]
+    encoded = np.array([record.version == 'encoded' for record in records] + [False], dtype=bool)
+    versions = sorted(set(record.encoded_version for record in records))
+    version_codes = np.array([versions.index(record.encoded_version) for record in records] + [-1], dtype=np.int64)
+    name_codes = np.asarray(name_codes)
+    rows = np.flatnonzero(encoded[name_codes])
+    return rows, {'name': (name_codes[rows], lambda code: names[code]),
+                  'version': (version_codes[name_codes[rows]], lambda code: versions[code])}
+
+def store_syndrome_histograms(store_folder, by=('name',), window=None, origin=None, table=SYNDROME_TABLE):
+    '''store_syndrome_histograms(store_folder, by=('name',), window=None, origin=None, table=SYNDROME_TABLE)
+    Syndrome histograms of the encoded runs of a columnar store, in one pass over its raw counts,
+    grouped by the columns of by among 'name', 'version' (encoded version of the |00>
+    preparation: 'ftv1', 'ftv2', 'nftv1' or '') and 'window' (start timestamp of the calibration
+    window of window seconds from origin, by the 'lastUpdateDate' of the calibrations). Returns
+    {key tuple: histogram} with the classes of table['classes'].
+    '''
+    data = storetool.load_store(store_folder)
+    rows, columns = _encoded_columns(data['names'], data['name'])
+    if 'window' in by:
+        dates = np.array([timetool.timestamp(c.get('lastUpdateDate')) if c else np.nan for c in data['calibrations']]
+                         + [np.nan], dtype=float)
+        windows, origin = _window_codes(dates[np.asarray(data['calibration'])[rows]], window, origin)
+        columns['window'] = (windows, lambda code: None if code < 0 else origin + code*window)
+    return _group_histograms(np.asarray(data['raw_counts'])[rows], columns, by, table)
+
+def archive_syndrome_histograms(archive, by=('name',), window=None, origin=None, table=SYNDROME_TABLE):
+    '''archive_syndrome_histograms(archive, by=('name',), window=None, origin=None, table=SYNDROME_TABLE)
+    Same as store_syndrome_histograms for a raw counts archive loaded with Archive_tools.load_archive,
+    the windows being taken on the execution dates of the runs.
+    '''
+    rows, columns = _encoded_columns(archive['circuits'], archive['circuit'])
+    if 'window' in by:
+        windows, origin = _window_codes(np.asarray(archive['timestamp'])[rows], window, origin)
+        columns['window'] = (windows, lambda code: None if code < 0 else origin + code*window)
+    return _group_histograms(archive['counts'][rows], columns, by, table)
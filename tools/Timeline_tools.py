@@ -0,0 +1,196 @@
+import collections
+import datetime
+import math
+import sqlite3
+
+import tools.Experiment_tools as exptool
+
+# Time index of the processed results
+#####################################
+# The processed data is grouped by circuit, so looking at the runs of one week means reading
+# every circuit file. The timeline is a sqlite database with one row per processed run: its
+# circuit name and label, its execution date (the 'date' of the API result), the date of the
+# calibration it ran under ('lastUpdateDate') and the numbers the drift is followed on
+# (stat_dist, post_selection_ratio, total_valid). The rows are indexed by date, by label and date
+# and by name and date, so range queries and rolling windows only read the rows of the range.
+# The dates are stored as POSIX timestamps (seconds, UTC).
+
+TIMELINE_FILENAME = 'data/timeline.sqlite'
+DATE_COLUMNS = {'executed': 'executed_at', 'calibrated': 'calibrated_at'}
+
+
+def open_timeline(filename=TIMELINE_FILENAME):
+    '''open_timeline(filename=TIMELINE_FILENAME)
+    Opens (and creates if needed) the timeline database, returns the sqlite3 connection.
+    '''
+    conn = sqlite3.connect(filename)
+    conn.row_factory = sqlite3.Row
+    conn.execute('CREATE TABLE IF NOT EXISTS runs ('
+                 'name TEXT NOT NULL, '
+                 'label TEXT NOT NULL, '
+                 'executed_at REAL NOT NULL, '
+                 'calibrated_at REAL, '
+                 'stat_dist REAL, '
+                 'post_selection_ratio REAL, '
+                 'total_valid INTEGER, '
+                 'UNIQUE (name, executed_at))')
+    conn.execute('CREATE INDEX IF NOT EXISTS runs_executed ON runs (executed_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS runs_calibrated ON runs (calibrated_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS runs_label ON runs (label, executed_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS runs_name ON runs (name, executed_at)')
+    conn.commit()
+    return conn
+
+def timestamp(date):
+    '''timestamp(date)
+    POSIX timestamp of a date given as an ISO 8601 string ('2018-01-12T10:21:03.412Z'), a datetime
+    (naive ones being UTC) or a number (returned as is). None for None.
+    '''
+    if date is None or isinstance(date, (int, float)):
+        return date
+    if isinstance(date, str):
+        date = datetime.datetime.fromisoformat(date.strip().replace('Z', '+00:00'))
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return date.timestamp()
+
+def index_entries(conn, entries):
+    '''index_entries(conn, entries)
+    Adds the processed entries (with their 'date' and their calibration dictionary) to the
+    timeline. Entries without date are skipped and runs already indexed are ignored, so that
+    processing a dump again does not duplicate its rows. Returns the number of new rows.
+    '''
+    rows = []
+    for entry in entries:
+        if entry.get('date') is None:
+            continue
+        calibration = entry.get('calibration')
+        calibrated_at = timestamp(calibration.get('lastUpdateDate')) if isinstance(calibration, dict) else None
+        rows.append((entry['name'], exptool.circuit_label(entry['name']), timestamp(entry['date']), calibrated_at,
+                     float(entry['stat_dist']), float(entry['post_selection_ratio']), int(entry['counts']['total_valid'])))
+    n_before = conn.total_changes
+    conn.executemany('INSERT OR IGNORE INTO runs (name, label, executed_at, calibrated_at, stat_dist, '
+                     'post_selection_ratio, total_valid) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+    conn.commit()
+    return conn.total_changes - n_before
+
+def index_api_dumps(conn, filenames, dict_qasm_name):
+    '''index_api_dumps(conn, filenames, dict_qasm_name)
+    Decodes the dumps of filenames and indexes their results, without writing processed data:
+    fills the timeline of data processed before it existed. Returns the number of new rows.
+    '''
+    n_new = 0
+    for filename in filenames:
+        for entries in exptool.iter_decoded_batches(filename, dict_qasm_name):
+            n_new += index_entries(conn, entries)
+    return n_new
+
+def remove_runs(conn, keys):
+    '''remove_runs(conn, keys)
+    Removes the runs whose (name, date) is in keys, before they are indexed again from a changed
+    dump. Returns the number of removed rows.
+    '''
+    n_before = conn.total_changes
+    conn.executemany('DELETE FROM runs WHERE name = ? AND executed_at = ?',
+                     [(name, timestamp(date)) for name, date in keys])
+    conn.commit()
+    return conn.total_changes - n_before
+
+def reset_timeline(conn):
+    '''reset_timeline(conn)
+    Removes every row of the timeline, before the processed data is rebuilt.
+    '''
+    conn.execute('DELETE FROM runs')
+    conn.commit()
+
+
+# Range queries
+###############
+def _range_query(columns, start, end, by, names, labels):
+    date_column = DATE_COLUMNS[by]
+    clauses = [date_column + ' IS NOT NULL']
+    params = []
+    if start is not None:
+        clauses.append(date_column + ' >= ?')
+        params.append(timestamp(start))
+    if end is not None:
+        clauses.append(date_column + ' < ?')
+        params.append(timestamp(end))
+    for column, values in [('name', names), ('label', labels)]:
+        if values is not None:
+            values = list(values)
+            clauses.append(column + ' IN (' + ', '.join('?'*len(values)) + ')')
+            params.extend(values)
+    return 'SELECT ' + columns + ' FROM runs WHERE ' + ' AND '.join(clauses), params
+
+def query_runs(conn, start=None, end=None, by='executed', names=None, labels=None):
+    '''query_runs(conn, start=None, end=None, by='executed', names=None, labels=None)
+    Runs whose execution date (by='executed') or calibration date (by='calibrated') is in
+    [start, end), optionally restricted to some circuit names or labels, as dictionaries sorted
+    by that date.
+    '''
+    query, params = _range_query('*', start, end, by, names, labels)
+    return [dict(row) for row in conn.execute(query + ' ORDER BY ' + DATE_COLUMNS[by], params)]
+
+def _statistics(n, sum_sd, sum_sd2, sum_psr):
+    variance = (sum_sd2 - sum_sd*sum_sd/n)/(n - 1) if n > 1 else math.nan
+    return {'n_runs': n, 'stat_dist': sum_sd/n, 'stat_dist_stdev': math.sqrt(max(variance, 0.)) if n > 1 else math.nan,
+            'post_selection_ratio': sum_psr/n}
+
+def window_statistics(conn, start=None, end=None, by='executed', group='label', names=None, labels=None):
+    '''window_statistics(conn, start=None, end=None, by='executed', group='label', names=None, labels=None)
+    Statistics of the runs of [start, end) (see query_runs) per label (group='label') or per
+    circuit (group='name'): {key: {'n_runs', 'stat_dist' (average), 'stat_dist_stdev',
+    'post_selection_ratio' (average)}}, aggregated by sqlite.
+    '''
+    query, params = _range_query(group + ', COUNT(*), SUM(stat_dist), SUM(stat_dist*stat_dist), '
+                                 'SUM(post_selection_ratio)', start, end, by, names, labels)
+    return {row[0]: _statistics(*row[1:]) for row in conn.execute(query + ' GROUP BY ' + group, params)}
+
+def rolling_statistics(conn, window, step=None, start=None, end=None, by='executed', group='label',
+                       names=None, labels=None):
+    '''rolling_statistics(conn, window, step=None, start=None, end=None, by='executed', group='label', names=None, labels=None)
+    Rolling window_statistics over [start, end) (from the first run and up to the last one if None):
+    windows of window seconds (or a datetime.timedelta) every step (window if None), as a list of
+    (window_start, window_end, {key: statistics}) with timestamps. The runs of the range are read
+    once, in date order, and the sums of every key are updated as the windows slide.
+    '''
+    window = window.total_seconds() if isinstance(window, datetime.timedelta) else float(window)
+    step = window if step is None else (step.total_seconds() if isinstance(step, datetime.timedelta) else float(step))
+    date_column = DATE_COLUMNS[by]
+    if start is None or end is None:
+        query, params = _range_query('MIN(' + date_column + '), MAX(' + date_column + ')', start, end, by, names, labels)
+        first, last = conn.execute(query, params).fetchone()
+        if first is None:
+            return []
+    first = timestamp(start) if start is not None else first
+    last = timestamp(end) if end is not None else math.nextafter(last, math.inf)
+    query, params = _range_query(date_column + ', ' + group + ', stat_dist, post_selection_ratio',
+                                 first, last, by, names, labels)
+    rows = conn.execute(query + ' ORDER BY ' + date_column, params)
+    inside = collections.deque()
+    sums = {}
+
+    def add(row, sign):
+        key_sums = sums.setdefault(row[1], [0, 0., 0., 0.])
+        key_sums[0] += sign
+        key_sums[1] += sign*row[2]
+        key_sums[2] += sign*row[2]*row[2]
+        key_sums[3] += sign*row[3]
+        if key_sums[0] == 0:
+            del sums[row[1]]
+
+    windows = []
+    row = rows.fetchone()
+    window_start = first
+    while window_start < last:
+        window_end = window_start + window
+        while row is not None and row[0] < window_end:
+            inside.append(tuple(row))
+            add(inside[-1], 1)
+            row = rows.fetchone()
+        while inside and inside[0][0] < window_start:
+            add(inside.popleft(), -1)
+        windows.append((window_start, window_end, {key: _statistics(*key_sums) for key, key_sums in sums.items()}))
+        window_start += step
+    return windows